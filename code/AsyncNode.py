@@ -0,0 +1,367 @@
+from Node import Node
+from ValidationPipeline import check_block, decode_block
+from Transport import SocketTransport
+from threading import Thread, get_ident
+import asyncio, collections, concurrent.futures, sys
+
+DRAIN_TIMEOUT = 5.0  # seconds a stopping node waits for each outbox to be sent
+
+
+def send_batch(send, batch: list, peer: str) -> list:
+    """
+    Sends messages to one peer in order, going on past a failed send.
+
+    :param send: function. Messenger.send.
+    :param batch: list of dicts. Messages.
+    :param peer: str. id of the receiving node
+    :return: list of (message type, exception) of the messages that failed.
+    """
+    failures = []
+    for msg in batch:
+        try:
+            send(msg, peer)
+        except Exception as e:
+            failures.append((msg['type'], e))
+    return failures
+
+
+class AsyncValidation:
+    """
+    Validation pipeline of an AsyncNode. submit() hands a received block to an executor running check_block(), worker
+    processes or a single thread without workers, and a collector coroutine awaits the results in arrival order and
+    passes the blocks that passed to the node. Up to queue_size blocks are checked at once; the node's receive loop
+    awaits room() before reading more messages, and the collector awaits room in received_blocks, so a burst of blocks
+    slows the sender down instead of piling up in memory.
+
+    Attributes
+    ----------
+    node : AsyncNode
+        the node the blocks are delivered to, from the event loop
+    executor : Executor
+        runs check_block()
+    pending : deque
+        (contents, future) of every block being checked, in arrival order
+    rejected : int
+        number of blocks that failed the checks
+
+    Methods
+    -------
+    submit(contents)
+        queue a received block for validation, from the event loop
+    room()
+        coroutine returning once fewer than queue_size blocks are being checked
+    collect()
+        collector coroutine
+    close()
+        stop the executor
+    """
+
+    def __init__(self, node, workers: int = 0, queue_size: int = 64):
+        """
+        Constructor for the AsyncValidation.
+
+        :param node: AsyncNode. Node the blocks that pass are delivered to.
+        :param workers: int. Number of worker processes, 0 checks the blocks in one thread.
+        :param queue_size: int. Most blocks checked at once.
+        """
+        self.node = node
+        self.queue_size = queue_size
+        if workers > 0:
+            self.executor = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='Validation' + node.node_id)
+        self.pending = collections.deque()
+        self.rejected = 0
+
+    def submit(self, contents):
+        """
+        Queue a received block for validation.
+
+        :param contents: bytes or str. Block in its binary or JSON representation.
+        :return: None
+        """
+        self.pending.append((contents, self.node.loop.run_in_executor(self.executor, check_block, contents)))
+        self.node.wake()
+
+    async def room(self):
+        while len(self.pending) >= self.queue_size and not self.node.stop_mine_function:
+            await self.node.changed()
+
+    async def collect(self):
+        """
+        Collector coroutine: awaits the checks of every block in arrival order and delivers the blocks that passed.
+
+        :return: None
+        """
+        node = self.node
+        while not node.stop_mine_function:
+            if not self.pending:
+                await node.changed()
+                continue
+            contents, result = self.pending[0]
+            try:
+                passed, outcome = await result
+            except Exception as e:  # a broken pool or a bug in the checks, not the block's fault alone
+                passed, outcome = False, repr(e)
+            self.pending.popleft()
+            node.wake()  # room for the receive loop
+            if not passed:
+                self.rejected += 1
+                print('Incoming block rejected:', outcome)
+                continue
+            while len(node.received_blocks) >= node.max_received_blocks and not node.stop_mine_function:
+                await node.changed()
+            block = decode_block(contents, outcome)
+            block.mark_verified()
+            node.receive_block(block)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+class AsyncNode(Node):
+    """
+    Node whose receiving, sending, validation and chain updates run as coroutines on one asyncio event loop, in a
+    single thread, instead of in a thread each. The mempool, block tree, ledger, relay and chain sync state are only
+    changed from the loop, so the stages no longer interleave in the middle of an update and the locks they share
+    are never waited on. Blocking work runs in executors the loop awaits: hashing a new block in a one thread
+    executor (or the processes of a ParallelMiningEngine), the checks of received blocks in worker processes, and
+    the Transport's blocking receive() and send() calls in an I/O pool.
+
+    Every peer has an outbox and a sender coroutine, so a message to all peers goes out to them concurrently, while
+    the messages to one peer keep their order and a slow peer only delays its own outbox. A sender hands all the
+    messages waiting in its outbox to the I/O pool at once.
+
+    Attributes
+    ----------
+    loop : AbstractEventLoop
+        the node's event loop, run by mine_thread
+    hasher : ThreadPoolExecutor
+        runs hash_block()
+    io : ThreadPoolExecutor
+        runs the Transport calls, a thread per peer and one receiving
+    outboxes : dict
+        peer -> asyncio.Queue of the messages waiting to be sent to it
+    senders : list
+        the sender tasks
+
+    Methods
+    -------
+    main()
+        the coroutine run by the loop, starts the others and cleans up once the node is stopped
+    changed()
+        coroutine returning at the next wake()
+    wake()
+        wakes every coroutine waiting in changed(), from the loop
+    receive_loop()
+        receives messages and handles them
+    mine_loop()
+        applies received blocks to the chain and mines new blocks
+    post(msg: dict, peer: str)
+        queues a message in a peer's outbox, from the loop
+    sender(peer: str)
+        sends the messages of one peer's outbox
+    every(interval: float, function)
+        calls a function every interval seconds
+    """
+
+    def __init__(self, node_id: str, *args, **kwargs):
+        """
+        Constructor for the AsyncNode, takes the arguments of Node. Starts the event loop thread.
+        """
+        self.loop = asyncio.new_event_loop()
+        self.event = asyncio.Event()
+        self.outboxes = {}
+        self.senders = []
+        self.hasher = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='Hashing' + node_id)
+        self.io = None
+        super().__init__(node_id, *args, **kwargs)
+
+    def create_validation(self, workers: int, queue_size: int):
+        return AsyncValidation(self, workers, queue_size)
+
+    def start(self):
+        """
+        Starts the event loop thread in place of the Messenger, mining, chain sync and relay threads.
+
+        :return: None
+        """
+        self.io = concurrent.futures.ThreadPoolExecutor(len(self.peers) + 1, thread_name_prefix='IO' + self.node_id)
+        self.mine_thread = Thread(target=self.loop.run_until_complete, args=(self.main(),),
+                                  name='Event Loop' + self.node_id)
+        self.mine_thread.start()
+
+    def stop(self):
+        """
+        Stops the node from any thread, the event loop ends once the mining in progress is interrupted.
+
+        :return: None
+        """
+        self.stop_mine_function = True
+        self.loop.call_soon_threadsafe(self.wake)
+        if self.query_server is not None:
+            self.query_server.close()
+
+    async def main(self):
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in (
+            self.receive_loop(), self.validation.collect(), self.every(min(1.0, self.sync.request_timeout),
+                                                                       self.sync.tick))]
+        if self.relay is not None:
+            tasks.append(asyncio.ensure_future(self.every(self.relay.trickle_interval, self.relay.flush)))
+            tasks.append(asyncio.ensure_future(self.every(self.relay.trickle_interval, self.relay.retry)))
+        self.sync.request_tips()
+        try:
+            await self.mine_loop()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # send what is left in the outboxes, giving up on peers that do not take it, then stop the senders
+            for peer, outbox in self.outboxes.items():
+                try:
+                    await asyncio.wait_for(outbox.join(), DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    print('gave up sending the rest of the outbox of', peer)
+            for task in self.senders:
+                task.cancel()
+            self.validation.close()
+            self.hasher.shutdown()
+            self.io.shutdown(wait=False)  # a send to a peer that does not take it may never return
+            self.mining_engine.shutdown()
+
+    async def changed(self):
+        await self.event.wait()
+
+    def wake(self):
+        # waiters hold the old event, which is set, later ones wait for the next wake()
+        self.event.set()
+        self.event = asyncio.Event()
+
+    async def every(self, interval: float, function):
+        while not self.stop_mine_function:
+            await asyncio.sleep(interval)
+            function()
+
+    async def receive_loop(self):
+        """
+        Receives messages from the Transport in the I/O pool, drops duplicates and handles the others on the loop.
+
+        :return: None
+        """
+        messenger = self.messenger
+        while not self.stop_mine_function and messenger.run:
+            await self.validation.room()
+            for msg in await self.loop.run_in_executor(self.io, messenger.transport.receive):
+                if not messenger.is_duplicate(msg):
+                    self.handle_incoming_message(msg)
+
+    def queue_transaction(self, tx):
+        self.transaction_queue.add(tx)
+        self.wake()
+
+    def receive_block(self, incoming_block):
+        """
+        Queues a block that passed validation for mine_loop() and interrupts the mining in progress. Called from the
+        loop, which waits for room in received_blocks first.
+
+        :param incoming_block: Block.
+        :return: None
+        """
+        print("\nIncoming Block received: \n", "Index: ", incoming_block.index, '\n', "Previous Hash: ",
+              incoming_block.prevHash, '\n', "Hash: ", incoming_block.hash, '\n')
+        if self.relay is not None:
+            self.relay.relay_block(incoming_block)
+        self.received_blocks.append(incoming_block)
+        self.reset_mine_function = True
+        self.wake()
+
+    async def mine_loop(self):
+        """
+        Applies received blocks to the chain and mines new blocks from the queue, like Node.mining_thread(), hashing
+        in the hasher while the loop goes on receiving. Waits for a wake() with nothing to do.
+
+        :return: None
+        """
+        while not self.stop_mine_function:
+            if self.received_blocks:
+                self.process_incoming_block()
+                self.wake()  # room for the collector to deliver another block
+            elif self.transaction_queue:
+                tx_to_mine, change, next_index = self.next_template()
+                if not tx_to_mine:
+                    # nothing queued fits a block on this chain, wait for a transaction or block
+                    await self.changed()
+                    continue
+                new_block = await self.loop.run_in_executor(self.hasher, self.hash_block, tx_to_mine, next_index)
+                if new_block:
+                    self.add_mined_block(new_block, change)
+                else:
+                    self.reset_mine_function = False
+            else:
+                await self.changed()
+                continue
+            await asyncio.sleep(0)  # let the other coroutines run between two blocks
+
+    def post(self, msg: dict, peer: str):
+        # from the loop, queue the message in the peer's outbox, starting its sender the first time
+        outbox = self.outboxes.get(peer)
+        if outbox is None:
+            outbox = self.outboxes[peer] = asyncio.Queue()
+            self.senders.append(asyncio.ensure_future(self.sender(peer)))
+        outbox.put_nowait(msg)
+
+    async def sender(self, peer: str):
+        """
+        Sends the messages of one peer's outbox in order, all those waiting in one call to the I/O pool. A failed
+        message is reported and the ones after it are still sent.
+
+        :param peer: str. id of the receiving node
+        :return: None
+        """
+        outbox = self.outboxes[peer]
+        send = self.messenger.send
+        while True:
+            batch = [await outbox.get()]
+            while not outbox.empty():
+                batch.append(outbox.get_nowait())
+            for type, e in await self.loop.run_in_executor(self.io, send_batch, send, batch, peer):
+                print('failed to send', type, 'to', peer, repr(e))
+            for _ in batch:
+                outbox.task_done()
+
+    def send_to(self, peer: str, contents, type: str):
+        """
+        Queues a msg for one peer, from any thread.
+
+        :param peer: str. id of the receiving node
+        :param contents: bytes or str.
+        :param type: str. indicates type of msg
+        :return: None
+        """
+        msg = {'contents': contents, 'type': type, 'sender': self.node_id}
+        if self.mine_thread is not None and self.mine_thread.ident == get_ident():
+            self.post(msg, peer)
+        else:
+            self.loop.call_soon_threadsafe(self.post, msg, peer)
+
+    def send_msg(self, contents, type: str):
+        """
+        Queues a msg for every peer, the senders send it to them concurrently.
+
+        :param contents: bytes or str.
+        :param type: str. indicates type of msg
+        :return: None
+        """
+        for peer in self.peers:
+            self.send_to(peer, contents, type)
+
+
+if __name__ == '__main__':
+    arg = sys.argv[1]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    # an optional JSON file of node addresses connects the nodes directly instead of through SQS
+    transport = SocketTransport.from_file(arg, sys.argv[3]) if len(sys.argv) > 3 else None
+    # the nodes of the file are the peers, without one the hardcoded four
+    peers = list(transport.addresses) if transport is not None else None
+
+    n = AsyncNode(arg, workers, transport=transport, peers=peers)
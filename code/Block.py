@@ -1,5 +1,34 @@
-import json, hashlib, datetime, copy
+import json, hashlib, datetime
 from Transaction import Transaction
+import Codec, Merkle
+
+# Block versions determine the byte layout the block hash is computed over.
+LEGACY_VERSION = 0  # JSON with the nonce serialized ahead of the transactions
+MIDSTATE_VERSION = 1  # JSON with the nonce serialized last, so miners can reuse the SHA-256 state of everything before it
+BINARY_VERSION = 2  # compact binary encoding of the block fields followed by an 8 byte nonce
+MERKLE_VERSION = Codec.MERKLE_VERSION  # fixed size header committing to a Merkle root of the transaction ids, then an
+# 8 byte nonce; the transactions themselves are not hashed
+
+
+def json_nonce_tail(nonce: int) -> bytes:
+    """
+    Bytes hashed after the hash prefix of a MIDSTATE_VERSION block: the nonce and the closing brace of the JSON object.
+
+    :param nonce: int.
+    :return: bytes.
+    """
+    return b'%d}' % nonce
+
+
+def binary_nonce_tail(nonce: int) -> bytes:
+    """
+    Bytes hashed after the hash prefix of a BINARY_VERSION or MERKLE_VERSION block: the nonce as an 8 byte big endian
+    integer.
+
+    :param nonce: int.
+    :return: bytes.
+    """
+    return nonce.to_bytes(8, 'big')
 
 
 class Block:
@@ -11,25 +40,59 @@ class Block:
     index : int
         number of block in the blockchain
     prevHash : str
-        hash of the block previous in the blockchain (block at position index - 1)
+        hash of the block previous in the blockchain (block at position index - 1). Kept as its raw 32 bytes.
     timestamp : str
-        timestamp of block
+        timestamp of block. Kept as integer microseconds.
     nonce : int
         nonce of block. Used to compute a hash of appropriate difficulty.
     transactions : list of Transaction objects
-        Transactions that were mined into the block.
+        Transactions that were mined into the block. Built on first access, so a block parsed only to look at its
+        header never decodes them.
+    transaction_count : int
+        number of transactions in the block, without building them
     hash : str
-        Hash of the block contents in JSON format without the hash attribute included.
+        Hash of the block contents in JSON format without the hash attribute included. Kept as its raw 32 bytes.
+    version : int
+        layout the hash is computed over. Blocks without a version in their JSON are LEGACY_VERSION blocks.
+    merkle_root : str
+        Merkle root of the transaction ids, committed to by the header of MERKLE_VERSION blocks.
 
     Methods
     -----------
     verify_proof_of_work()
         blocks are often constructed from incoming unverified JSON. This method verifies the hash matches the contents
+    verify_merkle_root()
+        verifies the transactions match the Merkle root in the header of a MERKLE_VERSION block
+    verify_transaction_ids()
+        verifies every transaction id is the hash of its transaction
+    mark_verified()
+        records that the proof of work and Merkle root were verified elsewhere
+    merkle_proof(unique_id: str)
+        proof that a transaction is in the block, checked with Merkle.verify_proof() against the Merkle root
+    header_entry()
+        the block as listed in a chain sync Headers message
+    hash_prefix()
+        the bytes hashed ahead of the nonce, fixed for the whole nonce search
+    nonce_tail()
+        the function mapping a nonce to the bytes hashed after the prefix
+    to_bytes()
+        compact binary representation of the block, for the wire and the block store
+    from_bytes(data: bytes)
+        build a block from its compact binary representation
+    from_header(fields: dict, nonce: int, transactions: list)
+        build a MERKLE_VERSION block from its decoded header, nonce and transactions, as rebuilt from a compact block
+
+    Apart from the nonce and hash a miner fills in, a block does not change once built. The hash prefix is cached on
+    first use, and the JSON form, binary form and proof of work result are cached for the nonce and hash they were
+    computed with.
 
     """
+    __slots__ = ('index', '_prev', '_timestamp', 'nonce', '_hash', 'version', '_transactions', '_tx_source',
+                 '_tx_offset', '_tx_count', '_root', '_prefix', '_sealed', '_json', '_bytes', '_verified',
+                 '_merkle_verified')
 
     def __init__(self, json_string: str = '', prevHash: str = '', timestamp: str = '', nonce: int = 0,
-                 transactions: list = [], hash: str = '', index: int = 0):
+                 transactions: list = [], hash: str = '', index: int = 0, version: int = LEGACY_VERSION):
         """
         Constructor for a Block.
 
@@ -40,24 +103,155 @@ class Block:
         :param transactions: list of Transaction objects. Used if JSON string parameter not used.
         :param hash: str. Used if JSON string parameter not used.
         :param index: int. Used if JSON string parameter not used.
+        :param version: int. Used if JSON string parameter not used.
         """
+        self._root = None  # raw Merkle root, from a received header or computed on first use
+        self._prefix = None  # cached hash_prefix() result
+        self._sealed = None  # (nonce, hash) the cached values below belong to
+        self._json = None  # cached __str__() result
+        self._bytes = None  # cached to_bytes() result
+        self._verified = False  # cached verify_proof_of_work() result
+        self._merkle_verified = False  # cached verify_merkle_root() result, once it passed
+        self._tx_source = None  # what transactions are built from on first access, when not built yet
+        self._tx_offset = 0
         # if JSON string is provided, assign parameters from that.
         if json_string != '':
             json_obj = json.loads(json_string)
             self.index = int(json_obj['index'])
-            self.prevHash = json_obj['prevHash']
-            self.timestamp = json_obj['timestamp']
+            self._prev = Codec.pack_hash(json_obj['prevHash'])
+            self._timestamp = Codec.pack_timestamp(json_obj['timestamp'])
             self.nonce = int(json_obj['nonce'])
-            self.transactions = [Transaction(x) for x in json_obj['transactions']]
-            self.hash = json_obj['hash']
+            self._transactions = None
+            self._tx_source = json_obj['transactions']  # JSON strings of the transactions
+            self._tx_count = len(self._tx_source)
+            self._hash = Codec.pack_hash(json_obj['hash'])
+            self.version = int(json_obj.get('version', LEGACY_VERSION))
         # otherwise construct Block from assigned variables.
         else:
             self.index = index
-            self.prevHash = prevHash
-            self.timestamp = timestamp
+            self._prev = Codec.pack_hash(prevHash)
+            self._timestamp = Codec.pack_timestamp(timestamp)
             self.nonce = nonce
-            self.transactions = transactions
-            self.hash = hash
+            self._transactions = transactions
+            self._tx_count = len(transactions)
+            self._hash = Codec.pack_hash(hash)
+            self.version = version
+
+    @property
+    def prevHash(self) -> str:
+        return Codec.unpack_hash(self._prev)
+
+    @property
+    def timestamp(self) -> str:
+        return Codec.unpack_timestamp(self._timestamp)
+
+    @property
+    def hash(self) -> str:
+        return Codec.unpack_hash(self._hash)
+
+    @hash.setter
+    def hash(self, value: str):
+        self._hash = Codec.pack_hash(value)
+
+    @property
+    def transactions(self) -> list:
+        if self._transactions is None:
+            if isinstance(self._tx_source, list):
+                self._transactions = [Transaction(x) for x in self._tx_source]
+            else:
+                self._transactions = [Transaction(**tx) for tx in
+                                      Codec.decode_transactions(self._tx_source, self._tx_offset, self._tx_count)]
+            self._tx_source = None
+        return self._transactions
+
+    @property
+    def transaction_count(self) -> int:
+        return self._tx_count
+
+    @property
+    def merkle_root(self) -> str:
+        return self.merkle_root_digest().hex()
+
+    def merkle_root_digest(self) -> bytes:
+        """
+        Returns the raw Merkle root: the one in the header for a received MERKLE_VERSION block, otherwise computed from
+        the transaction ids.
+
+        :return: bytes.
+        """
+        if self._root is None:
+            self._root = Merkle.merkle_root([Codec.encode_hash(tx.unique_id) for tx in self.transactions])
+        return self._root
+
+    def verify_merkle_root(self) -> bool:
+        """
+        The header of a MERKLE_VERSION block commits to its transactions only through their ids, so this checks every
+        transaction id is the hash of its transaction and that the ids give the Merkle root in the header. Other
+        versions hash their transactions directly and always pass.
+
+        :return: bool.
+        """
+        if self.version < MERKLE_VERSION or self._merkle_verified:
+            return True
+        if not self.verify_transaction_ids():
+            return False
+        self._merkle_verified = Merkle.merkle_root([Codec.encode_hash(tx.unique_id) for tx in self.transactions]) \
+            == self.merkle_root_digest()
+        return self._merkle_verified
+
+    def verify_transaction_ids(self) -> bool:
+        """
+        Checks every transaction id is the hash of its transaction.
+
+        :return: bool.
+        """
+        return all(tx.unique_id == tx.generateIDh() for tx in self.transactions)
+
+    def adopt_transactions(self, transactions: list):
+        """
+        Sets the transactions of a block built from its binary or JSON representation to ones already decoded from it,
+        such as by a validation worker process, so they are not decoded again.
+
+        :param transactions: list of Transaction objects.
+        :return: None
+        """
+        self._transactions = transactions
+        self._tx_source = None
+
+    def mark_verified(self):
+        """
+        Records that verify_proof_of_work() and verify_merkle_root() passed for this block elsewhere, such as in a
+        validation worker process, so they are not computed again.
+
+        :return: None
+        """
+        self.check_seal()
+        self._verified = True
+        self._merkle_verified = True
+
+    def merkle_proof(self, unique_id: str) -> list:
+        """
+        Proof that the transaction with unique_id is in the block, for Merkle.verify_proof() against merkle_root.
+
+        :param unique_id: str.
+        :return: list, or None if the block has no such transaction.
+        """
+        ids = [tx.unique_id for tx in self.transactions]
+        if unique_id not in ids:
+            return None
+        return Merkle.merkle_proof([Codec.encode_hash(_id) for _id in ids], ids.index(unique_id))
+
+    def __getstate__(self):
+        return {'index': self.index, 'prevHash': self._prev, 'timestamp': self._timestamp, 'nonce': self.nonce,
+                'transactions': self.transactions, 'hash': self._hash, 'version': self.version}
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled block, including ones pickled before blocks had slots or versions.
+        """
+        self.__init__(prevHash=state['prevHash'], timestamp=state['timestamp'], nonce=state['nonce'],
+                      transactions=state['transactions'], hash=state['hash'], index=state['index'],
+                      version=state.get('version', LEGACY_VERSION))
 
     def __str__(self):
         """
@@ -65,9 +259,32 @@ class Block:
 
         :return: str.
         """
-        blockDict = copy.deepcopy(self.__dict__)
-        blockDict['transactions'] = [str(tx) for tx in blockDict['transactions']]
-        return json.dumps(blockDict)
+        self.check_seal()
+        if self._json is None:
+            blockDict = {
+                'index': self.index,
+                'prevHash': self.prevHash,
+                'timestamp': self.timestamp,
+                'nonce': self.nonce,
+                'transactions': [str(tx) for tx in self.transactions],
+                'hash': self.hash
+            }
+            if self.version != LEGACY_VERSION:  # legacy blocks go out exactly as older nodes wrote them
+                blockDict['version'] = self.version
+            self._json = json.dumps(blockDict)
+        return self._json
+
+    def check_seal(self):
+        """
+        Drops the cached JSON form, binary form and proof of work result if the nonce or hash changed since they were
+        computed.
+        """
+        seal = (self.nonce, self._hash)
+        if self._sealed != seal:
+            self._sealed = seal
+            self._json = None
+            self._bytes = None
+            self._verified = False
 
     def __eq__(self, _in) -> bool:
         """
@@ -76,19 +293,159 @@ class Block:
         :param _in: str. Transaction to compare with self.
         :return: bool.
         """
-        return _in.hash == self.hash
+        return _in._hash == self._hash
 
     def verify_proof_of_work(self) -> bool:
         """
         This method verifies the hash matches the JSON equivalent of the block contents (sans hash)
 
-        :return:
+        :return: bool.
+        """
+        self.check_seal()
+        if not self._verified:
+            if self.version == LEGACY_VERSION:
+                sha = hashlib.sha256(self.hash_contents())  # recompute hash value of contents
+            else:
+                try:
+                    sha = hashlib.sha256(self.hash_prefix())
+                except ValueError:  # a field the header has no room for, such as a malformed transaction id
+                    return False
+                sha.update(self.nonce_tail()(self.nonce))
+            self._verified = sha.digest() == self._hash
+        return self._verified
+
+    def hash_contents(self) -> bytes:
+        """
+        Returns the exact bytes the block hash is computed over, according to the block version. For a MERKLE_VERSION
+        block this is its fixed size header, all a light consumer needs besides a Merkle proof.
+
+        :return: bytes.
+        """
+        if self.version == LEGACY_VERSION:
+            block_dict = {
+                'index': self.index,
+                'prevHash': self.prevHash,
+                'timestamp': self.timestamp,
+                'nonce': self.nonce,
+                'transactions': [str(tx) for tx in self.transactions]
+            }
+            return json.dumps(block_dict).encode()
+        return b''.join((self.hash_prefix(), self.nonce_tail()(self.nonce)))
+
+    def header_entry(self) -> bytes:
+        """
+        Returns the block as listed in a chain sync Headers message, see Codec.encode_header_entry().
+
+        :return: bytes.
+        """
+        return Codec.encode_header_entry(self.version, self.index, self._prev, self._hash,
+                                         self.hash_contents() if self.version >= MERKLE_VERSION else None)
+
+    def hash_prefix(self) -> bytes:
+        """
+        Returns the bytes hashed ahead of the nonce. These do not change while searching for a nonce, so a miner can
+        hash them once and copy the SHA-256 state for every attempt.
+
+        :return: bytes, or a memoryview into the received bytes of a block built by from_bytes().
+        """
+        if self._prefix is None:
+            if self.version >= MERKLE_VERSION:
+                self._prefix = Codec.encode_header(self.version, self.index, self._prev, self._timestamp,
+                                                   self.merkle_root_digest())
+            elif self.version == BINARY_VERSION:
+                self._prefix = Codec.encode_block_fields(self.version, self.index, self._prev, self._timestamp,
+                                                         self.transactions)
+            elif self.version == MIDSTATE_VERSION:
+                block_dict = {
+                    'version': self.version,
+                    'index': self.index,
+                    'prevHash': self.prevHash,
+                    'timestamp': self.timestamp,
+                    'transactions': [str(tx) for tx in self.transactions]
+                }
+                # json.dumps(block_dict) with 'nonce' as the last key, cut just before the nonce value
+                self._prefix = json.dumps(block_dict)[:-1].encode() + b', "nonce": '
+            else:
+                raise ValueError('block version {} has no fixed hash prefix'.format(self.version))
+        return self._prefix
+
+    def nonce_tail(self):
+        """
+        Returns the function mapping a nonce to the bytes hashed after hash_prefix(). It is a module level function so
+        it can be handed to mining worker processes.
+
+        :return: function.
+        """
+        if self.version >= BINARY_VERSION:
+            return binary_nonce_tail
+        return json_nonce_tail
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns the compact binary representation of the block.
+
+        :return: bytes.
+        """
+        self.check_seal()
+        if self._bytes is None:
+            if self.version == BINARY_VERSION:
+                fields = self.hash_prefix()
+            else:
+                fields = Codec.encode_block_fields(self.version, self.index, self._prev, self._timestamp,
+                                                   self.transactions, self.merkle_root_digest()
+                                                   if self.version >= MERKLE_VERSION else None)
+            self._bytes = Codec.encode_block(self.nonce, self._hash, fields)
+        return self._bytes
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        Build a block from its compact binary representation. Only the header is decoded, the transactions are decoded
+        from data when first accessed.
+
+        :param data: bytes.
+        :return: Block.
+        """
+        header = Codec.decode_block_header(data)
+        if 'transactions' in header:  # older codec version, its transactions had to be decoded to reach the hash
+            return cls(prevHash=header['prevHash'], timestamp=header['timestamp'], nonce=header['nonce'],
+                       transactions=[Transaction(**tx) for tx in header['transactions']], hash=header['hash'],
+                       index=header['index'], version=header['version'])
+        block = cls(prevHash=header['prevHash'], timestamp=header['timestamp'], nonce=header['nonce'],
+                    hash=header['hash'], index=header['index'], version=header['version'])
+        block._transactions = None
+        block._tx_source = data
+        block._tx_offset = header['transactions_offset']
+        block._tx_count = header['transaction_count']
+        block._sealed = (block.nonce, block._hash)
+        block._bytes = data  # re-sending or storing the block needs no encoding
+        if block.version == BINARY_VERSION:
+            block._prefix = memoryview(data)[header['fields_offset']:]
+        elif block.version >= MERKLE_VERSION:  # the header alone proves the work, see verify_merkle_root()
+            block._root = header['merkleRoot']
+            block._prefix = memoryview(data)[header['fields_offset']:header['fields_offset'] + Codec.HEADER.size]
+        return block
+
+    @classmethod
+    def from_header(cls, fields: dict, nonce: int, transactions: list):
+        """
+        Build a MERKLE_VERSION block from its decoded header, nonce and transactions, such as one rebuilt from a
+        compact block. The hash is computed from the header, and the Merkle root kept from it, so verify_merkle_root()
+        checks the transactions against the header.
+
+        :param fields: dict. Header fields as returned by Codec.decode_header().
+        :param nonce: int.
+        :param transactions: list of Transaction objects.
+        :return: Block.
         """
-        block_dict = copy.deepcopy(self.__dict__)
-        block_dict['transactions'] = [str(tx) for tx in block_dict['transactions']]
-        incoming_hash = block_dict.pop('hash')  # remove hash from object to verify the rest of the contents
-        verify_hash = hashlib.sha256(json.dumps(block_dict).encode()).hexdigest()  # recompute hash value of contents
-        return verify_hash == incoming_hash
+        header = Codec.encode_header(fields['version'], fields['index'], fields['prevHash'], fields['timestamp'],
+                                     fields['merkleRoot'])
+        block = cls(prevHash=fields['prevHash'], timestamp=fields['timestamp'], nonce=nonce,
+                    transactions=transactions, hash=hashlib.sha256(header + binary_nonce_tail(nonce)).digest(),
+                    index=fields['index'], version=fields['version'])
+        block._root = fields['merkleRoot']
+        block._prefix = header
+        return block
 
 
 if __name__ == '__main__':
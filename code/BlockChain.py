@@ -1,48 +1,88 @@
 from Block import Block
 from Transaction import Transaction
 from Ledger import Ledger
+from BlockStore import BlockStore, StoredChain
+from BlockTree import BlockTree
+from TxIndex import TxIndex
+import Snapshot
 import datetime, hashlib, json, os, pickle, collections
 
+TREE_DEPTH = 100  # blocks below the tip put back in the block tree at startup, the deepest reorganization followed
+
 
 class BlockChain:
     """
     A class used to hold and manipulate a blockchain. Initialized with an associated ledger. BlockChain contents are
-    stored to disk for node failure recovery.
+    stored to disk for node failure recovery. Every snapshot_interval blocks a snapshot of the tip and the ledger is
+    written, so a restarting node neither reads its whole chain nor replays its whole ledger journal.
 
     Attributes
     ----------
     ledger : Ledger
         a reference to the blockchain's associated ledger, created by Node.py
-    blockchain: List
-        list of Block objects constituting the blockchain
+    blockchain: StoredChain
+        list-like sequence of the Block objects constituting the blockchain, the older ones read from the store when used
+    store: BlockStore
+        append-only block log the chain is persisted to, one record per block
+    tree: BlockTree
+        every known block keyed by hash, including side branches and orphans, for fork choice and ancestor lookup
+    index: TxIndex
+        persistent transaction, account and balance indexes over the chain, kept up to date as blocks are applied and
+        rolled back
 
 
     Methods
     -------
     verify_block(block: Block)
         This method verifies the proof of work and transactions of a block and adds the block to the chain if valid.
+    reorganize(new_tip: Block)
+        Switch the chain to a heavier branch, undoing the ledger back to the fork point.
     add_block(block: Block)
         Adds a block to the blockchain a its appropriate index
     get_last_block()
         Return last block in the chain.
+    write_snapshot()
+        Write a snapshot of the tip and the ledger state.
 
     """
 
-    def __init__(self, node_id: str, ledger: Ledger):
+    def __init__(self, node_id: str, ledger: Ledger, data_dir: str = '../files', snapshot_interval: int = 100,
+                 difficulty: int = 0):
         """
         Constructor initializes a BlockChain using a Genesis Block. Only used if no chain already on disk when Node.py
         starts up.
 
         :param ledger: Ledger. Reference to ledger passed to constructor for reference.
+        :param data_dir: str. Directory the blockchain files are kept in.
+        :param snapshot_interval: int. A snapshot is written whenever the chain reaches a multiple of this height.
+        :param difficulty: int. Leading zeros required of a block hash, 0 accepts any hash.
         """
         self.ledger = ledger
+        self.snapshot_interval = snapshot_interval
         self.node_id = node_id
-        filename = '../files/blockchain' + node_id
+        self.data_dir = data_dir
+        filename = os.path.join(data_dir, 'blockchain' + node_id)
         self.file_path = filename + '.txt'
-        self.pickle_path = filename + '.pickle'
-        self.blockchain = []
-        self.saved_blocks = []
+        self.pickle_path = filename + '.pickle'  # chains written before the block store existed
+        self.store_path = filename + '.blocks'
+        self.store_index_path = filename + '.index'
+        self.tx_index_path = os.path.join(data_dir, 'index' + node_id + '.sqlite')
+        self.store = None
+        self.blockchain = None
+        self.returned_transactions = []  # transactions of blocks abandoned by a reorganization
+        self.confirmed_transactions = []  # transactions of blocks adopted by a reorganization
         self.create_or_read_file()
+        # only the recent blocks go back in the tree, older ones are read from the store if ever needed
+        first = max(0, len(self.blockchain) - 1 - TREE_DEPTH)
+        self.tree = BlockTree(self.blockchain[first], difficulty, prune_depth=TREE_DEPTH)
+        for block in self.blockchain[first + 1:]:
+            self.tree.add(block)
+        self.tree.set_tip(self.get_last_block().hash)
+        snapshot = self.ledger.snapshot
+        if snapshot is not None and self.store.hashes[snapshot['height']:snapshot['height'] + 1] != [snapshot['hash']]:
+            print('the block store does not hold the tip of the ledger snapshot at height', snapshot['height'])
+        self.index = TxIndex(self.tx_index_path)
+        self.update_index()
 
         #  TODO: pickledump and jsondump the chain to disk
 
@@ -54,13 +94,11 @@ class BlockChain:
         :param block: Block. Represents block object to be processed.
         :return: bool. Return True if valid block and added to ledger and chain, return False otherwise.
         """
-        if block.index < len(self.blockchain):
-            self.saved_blocks.append(block)
-            return False
-        elif block.index == len(self.blockchain) and block.prevHash == self.get_last_block().hash:
-            if block.verify_proof_of_work():
+        if block.index == len(self.blockchain) and block.prevHash == self.get_last_block().hash:
+            if block.hash <= self.tree.target and block.verify_proof_of_work():
                 # if transactions are valid verify_and_add will update the ledger and return true
-                verified_bool, change = self.ledger.verify_transaction(block.transactions, block.index)
+                verified_bool, change = self.ledger.verify_transaction(block.transactions, block.index) \
+                    if block.verify_merkle_root() else (False, [])
                 if verified_bool:
                     self.ledger.add_balance_state(change[0], block.index)  # apply that state if none are negative
                     #  add the block to the chain since PoW and tx are valid
@@ -73,68 +111,147 @@ class BlockChain:
             else:
                 print('Proof of work check not passed\nIndex = ', block.index, '\nHash = ', block.hash, '\n')
             return False
-        elif block.index == len(self.blockchain) and block.prevHash != self.get_last_block().hash:
-            self.saved_blocks.append(block)
-            return False
-        elif block.index > len(self.blockchain):
-            self.rebuild_longest_chain(block)
-            print('********************************\n********************************')
-            print('\n\n NEW LONGEST CHAIN \n\n')
-            print('********************************\n********************************\n\n')
-            return False
+        # any other block goes to the block tree, a side branch it completes may now be the longest chain
+        if not self.tree.add(block):
+            print('ancestors of block unknown, keeping it as an orphan\nIndex = ', block.index, '\n')
+        else:
+            # an invalid heaviest branch is dropped from the tree, so try again with the next heaviest
+            while self.tree.best.work > self.tree.tip.work:
+                if self.reorganize(self.tree.best_tip()):
+                    print('********************************\n********************************')
+                    print('\n\n NEW LONGEST CHAIN \n\n')
+                    print('********************************\n********************************\n\n')
+                    break
         return False
 
-    def rebuild_longest_chain(self, block):
+    def reorganize(self, new_tip) -> bool:
         """
-        Method to rebuild blockchain if a longer chain was found.
+        Switch the chain to the branch of the block tree ending in new_tip. The ledger is rolled back to the fork point
+        (costing O(blocks reverted)), then every block of the new branch is checked (link to its parent, proof of work,
+        transactions) and applied. If any block fails, it and its descendants are dropped from the tree and the old
+        branch is restored. Transactions of abandoned blocks that the new branch does not contain are kept in
+        returned_transactions for the node to put back in its queue.
+
+        :param new_tip: Block. Last block of the new branch, connected to the block tree.
+        :return: bool. True if the chain now ends in new_tip.
+        """
+        # walk back from the new tip to the fork point, the first block that is already on the chain
+        new_branch = collections.deque()
+        current_block = new_tip
+        while not self.tree.is_main(current_block.hash):
+            new_branch.appendleft(current_block)
+            current_block = self.find_block_from_hash(current_block.prevHash)
+            if current_block is None:
+                # drop the branch, or the fork choice keeps returning it
+                print('chain does not connect to the current chain, not reorganizing')
+                self.tree.discard(new_branch[0].hash)
+                return False
+        fork_index = current_block.index
+        old_branch = self.blockchain[fork_index + 1:]
+        print('reorganizing from fork at index', fork_index, ':', len(old_branch), 'blocks reverted,', len(new_branch),
+              'blocks applied')
+
+        self.ledger.rollback(fork_index)
+        prev_block = current_block
+        for block in new_branch:
+            if block.prevHash != prev_block.hash or block.index != prev_block.index + 1 \
+                    or block.hash > self.tree.target or not block.verify_proof_of_work():
+                print('Proof of work check not passed\nIndex = ', block.index, '\nHash = ', block.hash, '\n')
+                self.abort_reorganize(block, fork_index, old_branch)
+                return False
+            verified_bool, change = self.ledger.verify_transaction(block.transactions, block.index) \
+                if block.verify_merkle_root() else (False, [])
+            if not verified_bool:
+                print('Verify tx not passed\nIndex = ', block.index, '\nHash = ', block.hash, '\n')
+                self.abort_reorganize(block, fork_index, old_branch)
+                return False
+            self.ledger.add_balance_state(change[0], block.index)
+            prev_block = block
+
+        # the new branch is valid: replace the old one in the store, the index and the text file
+        del self.blockchain[fork_index + 1:]
+        self.index.truncate(fork_index + 1)
+        self.append_rollback_to_text_file(fork_index)
+        for block in new_branch:
+            self.blockchain.append(block)
+            self.index.add_block(block, self.ledger.block_changes[block.index])
+            self.append_to_text_file(block)
+        self.tree.set_tip(new_tip.hash)
+        if any(block.index % self.snapshot_interval == 0 for block in new_branch):
+            self.write_snapshot()
+
+        new_ids = set(tx.unique_id for block in new_branch for tx in block.transactions)
+        self.confirmed_transactions.extend(tx for block in new_branch for tx in block.transactions)
+        self.returned_transactions.extend(
+            tx for block in old_branch for tx in block.transactions if tx.unique_id not in new_ids
+        )
+        return True
+
+    def abort_reorganize(self, bad_block, fork_index, old_branch):
+        """
+        Undo a failed reorganize(): drop the invalid block and its descendants from the tree and restore the ledger
+        state of the old branch.
 
-        :param block: Last block of incoming longest chain. Used to backtrack to origin for rebuilding.
-        :return:
+        :param bad_block: Block. Block of the new branch that failed validation.
+        :param fork_index: int. Index of the fork point.
+        :param old_branch: list. Blocks of the current chain after the fork point.
+        :return: None
         """
-        current_block = block
-        build_new_chain = True
-        new_chain_stack = collections.deque()
-        new_chain_stack.append(current_block)
+        self.tree.discard(bad_block.hash)
+        self.ledger.rollback(fork_index)
+        for block in old_branch:
+            self.ledger.add_transactions(block.transactions, block.index)
 
-        while build_new_chain:
-            prev_block = self.find_block_from_hash(current_block.prevHash, self.saved_blocks)
-            if prev_block:
-                print('found previous block: ', prev_block[0].index, prev_block[0].hash)
-                new_chain_stack.append(prev_block[0])
-                current_block = prev_block[0]
-            else:
-                print('no more previous blocks found')
-                build_new_chain = False
+    def pop_reorg_transactions(self):
+        """
+        Returns the transactions returned from abandoned blocks and the transactions confirmed by adopted blocks since
+        the last call, and clears both lists.
 
-        while len(new_chain_stack) > 0:
-            next_block = new_chain_stack.pop()
-            print('block being replaced: ', next_block.index, next_block.hash)
-            self.add_block(next_block)
-            self.ledger.add_transactions(next_block.transactions, next_block.index)
-            # NEW LONGEST CHAIN!
+        :return: tuple (list, list).
+        """
+        returned, confirmed = self.returned_transactions, self.confirmed_transactions
+        self.returned_transactions, self.confirmed_transactions = [], []
+        return returned, confirmed
 
-    def find_block_from_hash(self, _hash, list_of_blocks):
+    def find_block_from_hash(self, _hash):
         """
         Find a specific block based on a hash.
 
         :param _hash: unique hash to find corresponding block
-        :param list_of_blocks: Blocks in which hash is contained.
-        :return: List containing Block that matches
+        :return: Block that matches, or None
         """
-        return [block for block in list_of_blocks if block.hash == _hash]
+        block = self.tree.get(_hash)
+        if block is None:  # blocks of the chain below the tree are only in the store
+            height = self.store.height_of(_hash)
+            if height is not None:
+                try:
+                    block = self.blockchain[height]
+                except IndexError:  # dropped by a reorganization meanwhile
+                    return None
+        return block
 
     def add_block(self, block):
         """
-        This method adds blocks to the chain and writes new chain to disk.
+        This method adds blocks to the chain and writes them to disk. Appending a block only writes that block. A block
+        replacing one already in the chain also drops every block after it, since those were built on the replaced one.
 
         :param block: Block. Block to be added to chain. Block is assumed to have been verified already
         :return: None
         """
         if block.index >= len(self.blockchain):
             self.blockchain.append(block)
+            self.append_to_text_file(block)
         else:
-            self.blockchain[block.index] = block
-        self.write_to_disk()
+            del self.blockchain[block.index:]
+            self.index.truncate(block.index)
+            self.append_rollback_to_text_file(block.index - 1)
+            self.blockchain.append(block)
+            self.append_to_text_file(block)
+        self.index.add_block(block, self.ledger.block_changes[block.index])
+        self.tree.add(block)
+        self.tree.set_tip(block.hash)
+        if block.index % self.snapshot_interval == 0:
+            self.write_snapshot()
 
     def get_last_block(self) -> Block:
         """
@@ -144,6 +261,39 @@ class BlockChain:
         """
         return self.blockchain[-1]
 
+    def update_index(self):
+        """
+        Bring the index in line with the chain at startup: drop indexed blocks the chain no longer holds, as after a
+        crash in the middle of a reorganization, then index the blocks it is missing, as for a chain written before
+        the index existed.
+
+        :return: None
+        """
+        height = min(self.index.tip(), len(self.blockchain) - 1)
+        while height >= 0 and self.index.block_hash(height) != self.store.hashes[height]:
+            height -= 1
+        self.index.truncate(height + 1)
+        if height + 1 == len(self.blockchain):
+            return
+        print('indexing blocks', height + 1, 'to', len(self.blockchain) - 1)
+        self.ledger.ensure_history(height)
+        changes = self.ledger.block_changes
+        for i in range(height + 1, len(self.blockchain)):
+            self.index.add_block(self.blockchain[i], changes[i] if i < len(changes) else {})
+        self.index.commit()
+
+    def write_snapshot(self):
+        """
+        Write a snapshot of the tip and the ledger state, see Snapshot. Skipped if the ledger is not at the tip.
+
+        :return: None
+        """
+        if len(self.ledger.block_changes) != len(self.blockchain):
+            return
+        last_block = self.get_last_block()
+        Snapshot.write_snapshot(self.data_dir, self.node_id, {'height': last_block.index, 'hash': last_block.hash,
+                                                              'ledger': self.ledger.snapshot_state()})
+
     def __str__(self) -> str:
         """
         Overrides native string representation of a BlockChain Object.
@@ -155,27 +305,36 @@ class BlockChain:
         for block in self.blockchain:
             stack.append(block)
         for i in range(0, len(stack)):
-            block = stack.pop()
-            blockchain_string += '-'*75 + '\n'
-            for k, v in block.__dict__.items():
-                if k == 'transactions':
-                    blockchain_string += k + ':\n'
-                    for tx in v:
-                        tx_short = Transaction(str(tx))
-                        tx_short_dict = tx_short.__dict__
-                        for k2, v2 in tx_short_dict.items():
-                            # "2020-05-12 18:20:25.659289"
-                            if k2 == 'timestamp':
-                                tx_short_dict[k2] = v2[11:22]
-                            elif k2 == 'unique_id':
-                                tx_short_dict[k2] = v2[:4] + '...'
-                        blockchain_string += '\t' + str(tx_short) + '\n'
-                else:
-                    blockchain_string += k + ': ' + str(v) + '\n'
-            blockchain_string += '-' * 75 + '\n'
+            blockchain_string += self.block_to_string(stack.pop())
         return blockchain_string
 
+    @staticmethod
+    def block_to_string(block) -> str:
+        """
+        Human readable representation of a single block, as used in the blockchain text file.
 
+        :param block: Block.
+        :return: str.
+        """
+        block_string = '-'*75 + '\n'
+        block_string += 'index: ' + str(block.index) + '\n'
+        block_string += 'prevHash: ' + block.prevHash + '\n'
+        block_string += 'timestamp: ' + str(block.timestamp) + '\n'
+        block_string += 'nonce: ' + str(block.nonce) + '\n'
+        block_string += 'transactions:\n'
+        for tx in block.transactions:
+            tx_short = {
+                'to_node': tx.to_node,
+                'from_node': tx.from_node,
+                'amount': tx.amount,
+                'timestamp': tx.timestamp[11:22],  # "2020-05-12 18:20:25.659289"
+                'unique_id': tx.unique_id[:4] + '...'
+            }
+            block_string += '\t' + json.dumps(tx_short) + '\n'
+        block_string += 'hash: ' + block.hash + '\n'
+        block_string += 'version: ' + str(block.version) + '\n'
+        block_string += '-' * 75 + '\n'
+        return block_string
 
     def create_or_read_file(self):
         """
@@ -183,16 +342,23 @@ class BlockChain:
         :return: None
         """
         # make sure the 'files' directory exists
-        if not os.path.isdir('../files'):
-            os.mkdir('../files')
+        if not os.path.isdir(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.store = BlockStore(self.store_path, self.store_index_path)
+        if len(self.store) > 0:
+            # the chain is read back from the block store as it is used
+            self.blockchain = StoredChain(self.store)
+            if not os.path.exists(self.file_path):
+                self.write_to_disk()
+            return
         try:
-            # try to read in files from disk if they exist
+            # chains written before the block store existed are pickled, move them into the store
             read_file = open(self.pickle_path, 'rb')
-            self.blockchain = pickle.load(read_file)
+            blocks = pickle.load(read_file)
             read_file.close()
         except FileNotFoundError:
             # if no blockchain exists, initialize one with the genesis block
-            self.blockchain = [  # Genesis block! as the first block in the chain the hashes are predetermined.
+            blocks = [  # Genesis block! as the first block in the chain the hashes are predetermined.
                 Block(
                     prevHash='0000000000000000000000000000000000000000000000000000000000000000',
                     timestamp=str(datetime.datetime.now()),
@@ -202,18 +368,43 @@ class BlockChain:
                     hash='000000000000000000000000000000000000000000000000000000000000000f'
                 )
             ]
-            self.write_to_disk()
+        self.blockchain = StoredChain(self.store)
+        for block in blocks:
+            self.blockchain.append(block)
+        self.write_to_disk()
 
     def write_to_disk(self):
         """
-        Write self to a human readable text file and dump contents of blockchain to a pickle
+        Rewrite the human readable text file from scratch, oldest block first. Blocks themselves are persisted by the
+        block store as they are added; this full rewrite is only needed at startup.
         :return: None
         """
         text_file = open(self.file_path, "w")
-        text_file.write(str(self))
+        text_file.write('Node ' + self.node_id + ' Blockchain: \n')
+        for block in self.blockchain:
+            text_file.write(self.block_to_string(block))
+        text_file.close()
+
+    def append_to_text_file(self, block):
+        """
+        Append a newly added block to the human readable text file
+        :param block: Block.
+        :return: None
+        """
+        text_file = open(self.file_path, "a")
+        text_file.write(self.block_to_string(block))
+        text_file.close()
+
+    def append_rollback_to_text_file(self, index):
+        """
+        Note in the human readable text file that the blocks after index were replaced, like the ledger text file does,
+        so replacing blocks costs O(blocks replaced) instead of a rewrite of the whole file.
+        :param index: int. Last block kept.
+        :return: None
+        """
+        text_file = open(self.file_path, "a")
+        text_file.write('rolled back to ' + str(index) + '\n')
         text_file.close()
-        # dump to pickle
-        pickle.dump(self.blockchain, open(self.pickle_path, "wb"))
 
 
 if __name__ == '__main__':
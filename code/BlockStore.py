@@ -0,0 +1,303 @@
+from Block import Block
+import Codec
+from threading import Lock
+import collections, os, struct
+
+LENGTH_PREFIX = struct.Struct('>I')  # length of a serialized block in the log
+INDEX_RECORD = struct.Struct('>QI32s')  # offset and length of a record in the log, raw 32 byte block hash
+
+
+class BlockStore:
+    """
+    Append-only on-disk block log. Each block is stored as a length prefixed serialized record in the log file, and a
+    compact index file holds one fixed size record (offset, length, hash) per height. Appending a block writes only
+    that block, so the cost of persisting block k no longer grows with k.
+
+    Attributes
+    ----------
+    log_path : str
+        path of the log file holding the length prefixed blocks
+    index_path : str
+        path of the index file, record i describes the block at height i
+    offsets : list
+        (offset, length) of the record at each height
+    heights : dict
+        hex block hash -> height
+
+    Methods
+    -------
+    append(block: Block)
+        write a block at the next height
+    truncate(height: int)
+        drop every block at or above height, used when a reorg replaces part of the chain
+    read(height: int)
+        read back the block at a height
+    height_of(_hash: str)
+        height of the block with the given hash, or None
+    """
+
+    def __init__(self, log_path: str, index_path: str, fsync: bool = False):
+        """
+        Constructor for the BlockStore. Opens (or creates) the log and index files and recovers from a crash that left
+        a torn record at the end of either file.
+
+        :param log_path: str. Path of the log file.
+        :param index_path: str. Path of the index file.
+        :param fsync: bool. Force every append to stable storage before returning.
+        """
+        self.log_path = log_path
+        self.index_path = index_path
+        self.fsync = fsync
+        self.offsets = []
+        self.heights = {}
+        self.hashes = []
+        self.lock = Lock()  # reads seek the shared log file, and peers' sync requests read from another thread
+        for path in (log_path, index_path):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+        self.log_file = open(log_path, 'r+b')
+        self.index_file = open(index_path, 'r+b')
+        self.recover()
+
+    def recover(self):
+        """
+        Load the index and make it agree with the log. Index records pointing past the end of the log are dropped,
+        complete log records missing from the index are indexed again, and a torn final log record is cut off.
+
+        :return: None
+        """
+        log_size = os.path.getsize(self.log_path)
+        index_bytes = self.index_file.read()
+        end = 0  # end of the last record known to be complete
+        for i in range(len(index_bytes) // INDEX_RECORD.size):
+            offset, length, raw_hash = INDEX_RECORD.unpack_from(index_bytes, i * INDEX_RECORD.size)
+            if offset != end or offset + LENGTH_PREFIX.size + length > log_size:
+                break
+            self._remember(offset, length, raw_hash.hex())
+            end = offset + LENGTH_PREFIX.size + length
+
+        # the index is written after the log, so the log may hold complete records the index never got
+        self.log_file.seek(end)
+        while end + LENGTH_PREFIX.size <= log_size:
+            length, = LENGTH_PREFIX.unpack(self.log_file.read(LENGTH_PREFIX.size))
+            if end + LENGTH_PREFIX.size + length > log_size:
+                break
+            try:
+                block = self.decode(self.log_file.read(length))
+            except (ValueError, KeyError, IndexError):  # length prefix survived but the record itself is garbage
+                break
+            self._remember(end, length, block.hash)
+            end += LENGTH_PREFIX.size + length
+
+        if end == log_size and len(index_bytes) == len(self.offsets) * INDEX_RECORD.size:
+            return  # clean shutdown, the index already matches the log
+        # cut off anything past the last complete record and rewrite the index to match
+        self.log_file.truncate(end)
+        self.index_file.seek(0)
+        self.index_file.truncate()
+        self.index_file.write(b''.join(
+            INDEX_RECORD.pack(offset, length, bytes.fromhex(_hash))
+            for (offset, length), _hash in zip(self.offsets, self.hashes)
+        ))
+        self.index_file.flush()
+
+    def _remember(self, offset: int, length: int, _hash: str):
+        self.offsets.append((offset, length))
+        self.hashes.append(_hash)
+        self.heights[_hash] = len(self.offsets) - 1
+
+    def append(self, block: Block):
+        """
+        Write a block at the next height. Block index is assumed to equal len(self).
+
+        :param block: Block.
+        :return: None
+        """
+        payload = self.encode(block)
+        with self.lock:
+            offset = self.offsets[-1][0] + LENGTH_PREFIX.size + self.offsets[-1][1] if self.offsets else 0
+            self.log_file.seek(offset)
+            self.log_file.write(LENGTH_PREFIX.pack(len(payload)) + payload)
+            self.log_file.flush()
+            self.index_file.seek(len(self.offsets) * INDEX_RECORD.size)
+            self.index_file.write(INDEX_RECORD.pack(offset, len(payload), bytes.fromhex(block.hash)))
+            self.index_file.flush()
+            if self.fsync:
+                os.fsync(self.log_file.fileno())
+                os.fsync(self.index_file.fileno())
+            self._remember(offset, len(payload), block.hash)
+
+    def truncate(self, height: int):
+        """
+        Drop every block at or above height.
+
+        :param height: int. First height to drop.
+        :return: None
+        """
+        with self.lock:
+            if height >= len(self.offsets):
+                return
+            # shrink the index first so a crash in between never leaves index records pointing at missing log records
+            self.index_file.truncate(height * INDEX_RECORD.size)
+            self.index_file.flush()
+            self.log_file.truncate(self.offsets[height][0])
+            self.log_file.flush()
+            for _hash in self.hashes[height:]:
+                del self.heights[_hash]
+            del self.offsets[height:]
+            del self.hashes[height:]
+
+    def read(self, height: int) -> Block:
+        """
+        Read back the block at a height.
+
+        :param height: int.
+        :return: Block.
+        """
+        with self.lock:
+            offset, length = self.offsets[height]
+            self.log_file.seek(offset + LENGTH_PREFIX.size)
+            payload = self.log_file.read(length)
+        return self.decode(payload)
+
+    def height_of(self, _hash: str):
+        """
+        Returns the height of the block with the given hash, or None if it is not stored.
+
+        :param _hash: str. Hex block hash.
+        :return: int or None.
+        """
+        return self.heights.get(_hash)
+
+    def encode(self, block: Block) -> bytes:
+        """
+        Serialize a block for the log in the compact binary format.
+
+        :param block: Block.
+        :return: bytes.
+        """
+        return block.to_bytes()
+
+    def decode(self, payload: bytes) -> Block:
+        """
+        Build a block back from a log record. Records written before the binary format existed are JSON.
+
+        :param payload: bytes.
+        :return: Block.
+        """
+        if payload[:1] == Codec.MAGIC:
+            return Block.from_bytes(payload)
+        return Block(payload.decode())
+
+    def close(self):
+        self.log_file.close()
+        self.index_file.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+class StoredChain:
+    """
+    The chain of blocks in a BlockStore, used like a list of Blocks. Appending or deleting blocks writes through to the
+    store. The last keep blocks are held in memory; older ones are read from the store when asked for, and the last
+    cache_size of those kept, so a node starts without reading its whole chain.
+
+    Attributes
+    ----------
+    store : BlockStore
+        the store holding every block of the chain
+    recent : dict
+        height -> Block, for the last keep blocks that were used
+    cache : OrderedDict
+        height -> Block, the older blocks read last, least recently used first
+    lock : Lock
+        guards recent and cache, which peers' sync requests fill from another thread than the one changing the chain
+    """
+
+    def __init__(self, store: BlockStore, keep: int = 1000, cache_size: int = 100):
+        """
+        Constructor for the StoredChain.
+
+        :param store: BlockStore.
+        :param keep: int. Number of blocks at the tip held in memory.
+        :param cache_size: int. Number of older blocks held in memory after being read.
+        """
+        self.store = store
+        self.keep = keep
+        self.cache_size = cache_size
+        self.recent = {}
+        self.cache = collections.OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[height] for height in range(*item.indices(len(self)))]
+        with self.lock:  # held while reading, so a block dropped meanwhile is not remembered
+            height = item + len(self) if item < 0 else item
+            if not 0 <= height < len(self):
+                raise IndexError('chain index out of range')
+            block = self.recent.get(height)
+            if block is None:
+                block = self.cache.pop(height, None)
+                if block is None:
+                    block = self.store.read(height)
+                self.remember(height, block)
+            return block
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def remember(self, height: int, block: Block):
+        # called with the lock held
+        if height >= len(self) - self.keep:
+            self.recent[height] = block
+        else:
+            self.cache[height] = block
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def append(self, block: Block):
+        """
+        Write a block at the next height.
+
+        :param block: Block.
+        :return: None
+        """
+        with self.lock:
+            self.store.append(block)
+            self.recent[len(self) - 1] = block
+            self.recent.pop(len(self) - 1 - self.keep, None)
+
+    def __delitem__(self, item):
+        """
+        Drop the blocks from a height on, as in del chain[height:]. Only this form is supported.
+        """
+        if not isinstance(item, slice) or item.stop is not None or item.step is not None:
+            raise TypeError('only the end of a stored chain can be deleted')
+        with self.lock:
+            height = item.indices(len(self))[0]
+            self.store.truncate(height)
+            for stored in (self.recent, self.cache):
+                for dropped in [h for h in stored if h >= height]:
+                    del stored[dropped]
+
+
+if __name__ == '__main__':
+    import tempfile, datetime, hashlib
+    directory = tempfile.mkdtemp()
+    store = BlockStore(os.path.join(directory, 'chain.blocks'), os.path.join(directory, 'chain.index'))
+    for i in range(5):
+        b = Block(prevHash='0' * 64, timestamp=str(datetime.datetime.now()), index=i)
+        b.hash = hashlib.sha256(b.hash_contents()).hexdigest()
+        store.append(b)
+    store.truncate(3)  # a reorg replacing blocks 3 and 4
+    store.close()
+    with open(os.path.join(directory, 'chain.blocks'), 'ab') as f:
+        f.write(LENGTH_PREFIX.pack(500) + b'{"index": 3')  # torn final record from a crash
+    store = BlockStore(os.path.join(directory, 'chain.blocks'), os.path.join(directory, 'chain.index'))
+    print(len(store), 'blocks after recovery, last index:', store.read(len(store) - 1).index)
@@ -0,0 +1,96 @@
+from Transaction import Transaction
+from Ledger import Ledger
+
+
+class BlockTemplate:
+    """
+    Chooses the transactions of the next block to mine. Transactions are taken oldest first and each one is checked
+    against a working copy of the balances that already includes the transactions chosen before it, so only a
+    transaction that would overdraw its sender is left out, not every transaction of that sender. Selection stops
+    when the block reaches its transaction count limit; a transaction that does not fit in the bytes left is skipped
+    for a smaller one, and one larger than the byte limit is rejected, as it never fits.
+
+    Attributes
+    ----------
+    ledger : Ledger
+        ledger holding the balances the block is built on
+    max_transactions : int
+        most transactions in a block
+    max_bytes : int
+        most bytes of serialized transactions in a block, None for no limit
+    wire_format : str
+        'binary' or 'json', the representation the transactions are counted in, the one the block is sent in
+
+    Methods
+    -------
+    build(transactions, index: int)
+        choose transactions for the block at index
+    """
+
+    def __init__(self, ledger: Ledger, max_transactions: int = 1000, max_bytes: int = None,
+                 wire_format: str = 'binary'):
+        """
+        Constructor for the BlockTemplate.
+
+        :param ledger: Ledger. Ledger holding the balances the block is built on.
+        :param max_transactions: int. Most transactions in a block.
+        :param max_bytes: int. Most bytes of serialized transactions in a block, None for no limit.
+        :param wire_format: str. 'binary' counts the transactions' Codec encoding, 'json' their JSON.
+        """
+        self.ledger = ledger
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.wire_format = wire_format
+
+    def build(self, transactions, index: int):
+        """
+        Choose the transactions for the block at index, oldest first.
+
+        :param transactions: iterable of Transaction objects, oldest first (a Mempool).
+        :param index: int. Index of the block being built.
+        :return: tuple (list, dict, list). The chosen transactions, the new balance of every account they touch (ready
+        for Ledger.add_balance_state) and the ids of transactions that can never be mined on this state because they
+        overdraw their sender, name an unknown account or are larger than the byte limit.
+        """
+        previous = self.ledger.balances if index - 1 == len(self.ledger.block_changes) - 1 \
+            else self.ledger.state_at(index - 1)
+        chosen = []
+        change = {}
+        rejected = []
+        block_bytes = 0
+        for tx in transactions:
+            if len(chosen) >= self.max_transactions:
+                break
+            if self.max_bytes is not None:
+                tx_bytes = len(tx.to_bytes() if self.wire_format == 'binary' else str(tx))
+                if tx_bytes > self.max_bytes:
+                    rejected.append(tx.unique_id)
+                    continue
+                if block_bytes + tx_bytes > self.max_bytes:
+                    continue
+            if tx.from_node not in previous or tx.to_node not in previous:
+                rejected.append(tx.unique_id)
+                continue
+            from_balance = (change[tx.from_node] if tx.from_node in change else previous[tx.from_node]) - tx.amount
+            if from_balance < 0:
+                rejected.append(tx.unique_id)
+                continue
+            # same order of operations as Ledger.apply_transactions, so the balances match exactly
+            change[tx.from_node] = from_balance
+            change[tx.to_node] = (change[tx.to_node] if tx.to_node in change else previous[tx.to_node]) + tx.amount
+            chosen.append(tx)
+            if self.max_bytes is not None:
+                block_bytes += tx_bytes
+        return chosen, change, rejected
+
+
+if __name__ == '__main__':
+    import tempfile
+    ledger = Ledger('0', tempfile.mkdtemp())
+    pending = [Transaction(_to='node1', _from='node2', amount=4),
+               Transaction(_to='node3', _from='node2', amount=7),  # would overdraw node2
+               Transaction(_to='node0', _from='node2', amount=5),
+               Transaction(_to='node2', _from='node1', amount=1)]
+    chosen, change, rejected = BlockTemplate(ledger, max_transactions=3).build(pending, 1)
+    print('chosen:', [(tx.from_node, tx.to_node, tx.amount) for tx in chosen])
+    print('rejected:', len(rejected), 'new balances:', change)
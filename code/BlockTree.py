@@ -0,0 +1,286 @@
+from Block import Block
+import collections
+
+
+class TreeEntry:
+    """
+    A block connected to the tree, with a link to its parent and the cumulative work of the branch ending in it. Its
+    height is counted from its parent, not read from the block, whose index a peer could set to anything.
+    """
+    __slots__ = ('block', 'parent', 'children', 'height', 'work', 'main')
+
+    def __init__(self, block: Block, parent, work: int):
+        self.block = block
+        self.parent = parent
+        self.children = []
+        self.height = parent.height + 1 if parent is not None else block.index
+        self.work = work
+        self.main = False  # True if the block is on the node's current chain
+
+
+class BlockTree:
+    """
+    All known blocks keyed by hash, linked to their parents. Every connected block knows its height and the
+    cumulative work of the branch it ends, so finding a block, its parent or the heaviest branch is a dictionary
+    lookup instead of a scan. Blocks whose parent is unknown wait in a bounded orphan pool until the parent arrives.
+    Only the last prune_depth blocks of the chain are kept, the oldest kept one becomes the root and keeps its height
+    and work, so the tree does not grow with the chain.
+    Only a block whose hash meets the difficulty target adds work, so a branch of unmined blocks never wins the fork
+    choice; whether the hash matches the block is checked when the branch is applied.
+
+    Attributes
+    ----------
+    entries : dict
+        hash -> TreeEntry, for every block connected to the tree
+    orphans : OrderedDict
+        hash -> Block, for blocks whose parent is unknown, oldest first
+    target : str
+        64 char hexadecimal hash, a block adds work only if its hash compares less than or equal to it
+    root : TreeEntry
+        the oldest block kept, on the current chain
+    best : TreeEntry
+        the connected block with the most cumulative work, the fork choice
+    tip : TreeEntry
+        the last block of the node's current chain
+    max_orphans : int
+        size of the orphan pool, the oldest orphan is evicted when a new one does not fit
+    prune_depth : int
+        chain blocks, side branch blocks and orphans this far below the tip are dropped
+
+    Methods
+    -------
+    add(block: Block)
+        add a block, connecting it (and any orphans waiting on it) if its parent is known
+    get(_hash: str)
+        block with the given hash, or None
+    parent(block: Block)
+        parent of a block, or None
+    set_tip(_hash: str)
+        mark the chain ending in a block as the node's current chain
+    discard(_hash: str)
+        drop a block and everything built on it, used for invalid blocks
+    """
+
+    def __init__(self, genesis: Block, difficulty: int = 0, max_orphans: int = 100, prune_depth: int = 100):
+        """
+        Constructor for the BlockTree.
+
+        :param genesis: Block. Root of the tree.
+        :param difficulty: int. Leading zeros required of a block hash, every block adds 16 ** difficulty work.
+        :param max_orphans: int. Size of the orphan pool.
+        :param prune_depth: int. How far below the tip blocks are kept.
+        """
+        self.block_work = 16 ** difficulty
+        self.target = '0' * difficulty + 'f' * (64 - difficulty)
+        self.max_orphans = max_orphans
+        self.prune_depth = prune_depth
+        self.entries = {}
+        self.orphans = collections.OrderedDict()
+        self.orphans_by_parent = collections.defaultdict(set)
+        self.side = set()  # hashes of connected blocks not on the current chain
+        root = TreeEntry(genesis, None, self.block_work)
+        root.main = True
+        self.entries[genesis.hash] = root
+        self.root = root
+        self.best = root
+        self.tip = root
+
+    def add(self, block: Block) -> bool:
+        """
+        Add a block to the tree. If its parent is known it is connected, together with any orphans that were waiting on
+        it; otherwise it goes to the orphan pool.
+
+        :param block: Block.
+        :return: bool. True if the block is connected to the tree.
+        """
+        if block.hash in self.entries:
+            return True
+        if block.prevHash not in self.entries:
+            self.add_orphan(block)
+            return False
+        connect = collections.deque([block])
+        while connect:
+            next_block = connect.popleft()
+            parent = self.entries[next_block.prevHash]
+            entry = TreeEntry(next_block, parent, parent.work + (self.block_work if next_block.hash <= self.target
+                                                                  else 0))
+            parent.children.append(entry)
+            self.entries[next_block.hash] = entry
+            self.side.add(next_block.hash)
+            if entry.work > self.best.work:
+                self.best = entry
+            # orphans waiting on this block can now be connected too
+            for orphan_hash in self.orphans_by_parent.pop(next_block.hash, ()):
+                connect.append(self.orphans.pop(orphan_hash))
+        return True
+
+    def add_orphan(self, block: Block):
+        """
+        Put a block whose parent is unknown in the orphan pool, evicting the oldest orphan if the pool is full.
+
+        :param block: Block.
+        :return: None
+        """
+        if block.hash in self.orphans:
+            return
+        self.orphans[block.hash] = block
+        self.orphans_by_parent[block.prevHash].add(block.hash)
+        while len(self.orphans) > self.max_orphans:
+            self.remove_orphan(next(iter(self.orphans)))
+
+    def remove_orphan(self, _hash: str):
+        block = self.orphans.pop(_hash)
+        waiting = self.orphans_by_parent[block.prevHash]
+        waiting.discard(_hash)
+        if not waiting:
+            del self.orphans_by_parent[block.prevHash]
+
+    def get(self, _hash: str):
+        """
+        Returns the block with the given hash, connected or orphaned, or None.
+
+        :param _hash: str.
+        :return: Block or None.
+        """
+        if _hash in self.entries:
+            return self.entries[_hash].block
+        return self.orphans.get(_hash)
+
+    def parent(self, block: Block):
+        """
+        Returns the parent of a connected block, or None.
+
+        :param block: Block.
+        :return: Block or None.
+        """
+        entry = self.entries.get(block.hash)
+        if entry is None or entry.parent is None:
+            return None
+        return entry.parent.block
+
+    def is_main(self, _hash: str) -> bool:
+        """
+        Returns True if the block with the given hash is on the node's current chain.
+
+        :param _hash: str.
+        :return: bool.
+        """
+        entry = self.entries.get(_hash)
+        return entry is not None and entry.main
+
+    def best_tip(self) -> Block:
+        """
+        Returns the last block of the branch with the most cumulative work.
+
+        :return: Block.
+        """
+        return self.best.block
+
+    def set_tip(self, _hash: str):
+        """
+        Mark the chain ending in the given connected block as the node's current chain. Costs O(blocks switched).
+
+        :param _hash: str.
+        :return: None
+        """
+        new_tip = self.entries[_hash]
+        # walk down the new chain to the first block already on the current chain: that is the fork point
+        fork = new_tip
+        newly_main = []
+        while not fork.main:
+            newly_main.append(fork)
+            fork = fork.parent
+        # blocks of the old chain above the fork point become a side branch
+        old = self.tip
+        while old is not fork and old.height > fork.height:
+            old.main = False
+            self.side.add(old.block.hash)
+            old = old.parent
+        for entry in newly_main:
+            entry.main = True
+            self.side.discard(entry.block.hash)
+        self.tip = new_tip
+        self.prune()
+
+    def prune(self):
+        """
+        Drop side branches forking off the chain more than prune_depth blocks below the tip, with every block built on
+        them, orphans that far below the tip, and the blocks of the chain below it, moving the root up.
+
+        :return: None
+        """
+        cutoff = self.tip.height - self.prune_depth
+        # the side blocks whose parent is on the chain are the roots of the side branches
+        for _hash in [h for h in self.side if self.entries[h].parent.main and self.entries[h].height < cutoff]:
+            self.remove_branch(self.entries[_hash])
+        for _hash in [h for h, block in self.orphans.items() if block.index < cutoff]:
+            self.remove_orphan(_hash)
+        while self.root.height < cutoff:
+            old_root = self.root
+            for child in list(old_root.children):
+                if child.main:
+                    self.root = child
+                else:
+                    self.remove_branch(child)
+            del self.entries[old_root.block.hash]
+            self.root.parent = None
+        if self.best.block.hash not in self.entries:
+            self.best = max(self.entries.values(), key=lambda e: e.work)
+
+    def discard(self, _hash: str):
+        """
+        Drop a block that is not on the current chain, and every block built on it. Used for blocks that failed
+        validation, so the fork choice does not keep returning them.
+
+        :param _hash: str.
+        :return: None
+        """
+        if _hash in self.orphans:
+            self.remove_orphan(_hash)
+            return
+        entry = self.entries.get(_hash)
+        if entry is None or entry.main:
+            return
+        self.remove_branch(entry)
+        if self.best.block.hash not in self.entries:
+            self.best = max(self.entries.values(), key=lambda e: e.work)
+
+    def remove_branch(self, entry: TreeEntry):
+        """
+        Remove a connected block that is not on the current chain and every block built on it.
+
+        :param entry: TreeEntry.
+        :return: None
+        """
+        entry.parent.children.remove(entry)
+        stack = [entry]
+        while stack:
+            removed = stack.pop()
+            del self.entries[removed.block.hash]
+            self.side.discard(removed.block.hash)
+            stack.extend(removed.children)
+
+    def __contains__(self, _hash: str) -> bool:
+        return _hash in self.entries or _hash in self.orphans
+
+    def __len__(self) -> int:
+        return len(self.entries) + len(self.orphans)
+
+
+if __name__ == '__main__':
+    def make_block(index, prev_hash, name):
+        return Block(index=index, prevHash=prev_hash, hash=name)
+
+    genesis = make_block(0, '', 'g')
+    tree = BlockTree(genesis, max_orphans=2)
+    tree.add(make_block(1, 'g', 'a1'))
+    tree.set_tip('a1')
+    tree.add(make_block(3, 'b2', 'b3'))  # orphan, b2 not seen yet
+    tree.add(make_block(2, 'b1', 'b2'))  # orphan
+    tree.add(make_block(1, 'g', 'b1'))  # connects b2 and b3
+    print('best tip:', tree.best_tip().hash, 'parent of b3:', tree.parent(tree.get('b3')).hash)
+    tree.set_tip('b3')
+    print('a1 on chain:', tree.is_main('a1'), 'b1 on chain:', tree.is_main('b1'))
+    for i in range(5):
+        tree.add(make_block(10 + i, 'missing' + str(i), 'orphan' + str(i)))
+    print('orphans kept:', list(tree.orphans))
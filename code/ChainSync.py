@@ -0,0 +1,422 @@
+from Block import Block
+from threading import Thread, Lock
+import Codec
+import collections, hashlib, json, struct, time
+
+MESSAGE_TYPES = ('GetTip', 'Tip', 'GetHeaders', 'Headers', 'GetBlocks', 'Blocks')
+HEADERS_PER_MESSAGE = 2000  # 2000 headers of 92 bytes fit in a 256 KB SQS message
+MAX_REPLY_BYTES = 200000  # a Blocks reply stops at the block that crosses this, so it fits in an SQS message
+
+
+class ChainSync:
+    """
+    Headers-first catch-up of a node that is behind its peers, after a restart or a partition. Nodes exchange their
+    tips (GetTip, answered by Tip). A node that learns of a longer chain asks that peer for the headers above the last
+    block they have in common (GetHeaders with a locator of its own chain, answered by Headers), checks the links and
+    proof of work of all of them at once, then requests the blocks in ranges of heights (GetBlocks, answered by Blocks)
+    spread over every peer whose tip is high enough, several ranges in flight at a time. Blocks that match the headers
+    are handed to the validation pipeline in height order, so the chain can apply them as they come. Requests that go
+    unanswered are sent again to another peer.
+
+    Messages carry the id of their sender, replies go to that peer only. Tips, locators and height ranges are JSON,
+    Headers and binary Blocks replies are Codec encoded.
+
+    Attributes
+    ----------
+    node : Node
+        the node being synced, its chain answers the peers' requests
+    peer_tips : dict
+        peer -> height of the tip it last reported
+    header_peer : str
+        peer headers are being downloaded from, None when not downloading headers
+    headers : list
+        (height, raw hash) of every downloaded header, from the fork point up, None for blocks older than MERKLE_VERSION
+    expected : dict
+        height -> raw hash of the blocks to download, from the headers, None for those downloaded body-first
+    queued : deque
+        [start height, count, peers that failed it] of the ranges waiting for a peer
+    in_flight : dict
+        start height -> [peer, count, peers that failed it, deadline] of the ranges requested
+    bodies : dict
+        height -> contents of downloaded blocks waiting for the blocks below them, None for blocks the node has
+    next_height : int
+        next height to hand to the validation pipeline, None when not downloading blocks
+
+    Methods
+    -------
+    start()
+        asks the peers for their tips and starts the thread retrying unanswered requests
+    stop()
+        stops that thread
+    tick()
+        retries unanswered requests, called every second
+    request_tips()
+        sends the node's tip to every peer, asking for theirs
+    handle(msg: dict)
+        handles a chain sync message
+    """
+
+    def __init__(self, node, blocks_per_request: int = 16, max_requests: int = 8, request_timeout: float = 10.0,
+                 tip_interval: float = 30.0):
+        """
+        Constructor for the ChainSync.
+
+        :param node: Node. Node being synced.
+        :param blocks_per_request: int. Most blocks asked for in one GetBlocks request.
+        :param max_requests: int. Most GetBlocks requests in flight.
+        :param request_timeout: float. Seconds after which an unanswered request is sent to another peer.
+        :param tip_interval: float. Seconds between two rounds of GetTip to every peer.
+        """
+        self.node = node
+        self.blocks_per_request = blocks_per_request
+        self.max_requests = max_requests
+        self.request_timeout = request_timeout
+        self.tip_interval = tip_interval
+        self.lock = Lock()
+        self.peer_tips = {}
+        self.header_peer = None
+        self.header_deadline = 0
+        self.headers = []
+        self.expected = {}
+        self.queued = collections.deque()
+        self.in_flight = {}
+        self.bodies = {}
+        self.next_height = None
+        self.last_tip_request = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Asks the peers for their tips and starts the thread retrying unanswered requests.
+
+        :return: None
+        """
+        self.running = True
+        self.thread = Thread(target=self.run, name='Chain Sync' + self.node.node_id, daemon=True)
+        self.thread.start()
+        self.request_tips()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        """
+        Retries unanswered requests and asks for the peers' tips every tip_interval seconds.
+
+        :return: None
+        """
+        while self.running:
+            time.sleep(min(1.0, self.request_timeout))
+            self.tick()
+
+    def tick(self):
+        """
+        Sends unanswered requests to another peer, and asks for the peers' tips if tip_interval seconds passed.
+
+        :return: None
+        """
+        now = time.time()
+        with self.lock:
+            if self.header_peer is not None and now > self.header_deadline:
+                print('chain sync: no headers from', self.header_peer)
+                self.reset()
+            for start, (peer, count, failed, deadline) in list(self.in_flight.items()):
+                if now > deadline:
+                    del self.in_flight[start]
+                    failed.add(peer)
+                    self.queued.append([start, count, failed])
+            self.schedule()
+        if now - self.last_tip_request > self.tip_interval:
+            self.request_tips()
+
+    def height(self) -> int:
+        return len(self.node.blockchain.blockchain) - 1
+
+    def tip(self) -> str:
+        """
+        :return: str. JSON of the height and hash of the node's tip, the contents of GetTip and Tip.
+        """
+        last_block = self.node.blockchain.get_last_block()
+        return json.dumps({'height': last_block.index, 'hash': last_block.hash})
+
+    def request_tips(self):
+        """
+        Sends the node's tip to every peer, asking for theirs. Calls within a second of the last are dropped, so the
+        node can call it for every block that shows it is behind.
+
+        :return: None
+        """
+        now = time.time()
+        if now - self.last_tip_request < 1:
+            return
+        self.last_tip_request = now
+        self.node.send_msg(self.tip(), 'GetTip')
+
+    def locator(self) -> list:
+        """
+        Hashes of blocks on the node's chain, the last ten then exponentially sparser down to the genesis block, so a
+        peer finds the last block the chains have in common in few steps however long ago they forked.
+
+        :return: list of str.
+        """
+        chain_hashes = list(self.node.blockchain.store.hashes)
+        height = len(chain_hashes) - 1
+        hashes = []
+        step = 1
+        while height > 0:
+            hashes.append(chain_hashes[height])
+            if len(hashes) >= 10:
+                step *= 2
+            height -= step
+        hashes.append(chain_hashes[0])
+        return hashes
+
+    def handle(self, msg: dict):
+        """
+        Handles a chain sync message, one of MESSAGE_TYPES. Messages without a sender cannot be answered and are
+        dropped.
+
+        :param msg: dict. Message attributes.
+        :return: None
+        """
+        peer = msg.get('sender')
+        if peer is None:
+            return
+        handler = {'GetTip': self.on_get_tip, 'Tip': self.on_tip, 'GetHeaders': self.on_get_headers,
+                   'Headers': self.on_headers, 'GetBlocks': self.on_get_blocks, 'Blocks': self.on_blocks}[msg['type']]
+        try:
+            handler(peer, msg['contents'])
+        except (ValueError, KeyError, IndexError, TypeError, struct.error) as e:
+            print('chain sync: malformed', msg['type'], 'from', peer, repr(e))
+
+    def on_get_tip(self, peer: str, contents: str):
+        self.node.send_to(peer, self.tip(), 'Tip')
+        self.on_tip(peer, contents)  # the request carries the peer's own tip
+
+    def on_tip(self, peer: str, contents: str):
+        """
+        Records a peer's tip and starts downloading its headers if it is ahead and the node is not syncing already.
+        """
+        tip = json.loads(contents)
+        with self.lock:
+            self.peer_tips[peer] = tip['height']
+            if tip['height'] <= self.height() or self.header_peer is not None or self.next_height is not None:
+                return
+            print('chain sync: peer', peer, 'is at height', tip['height'], 'downloading headers')
+            self.header_peer = peer
+            self.headers = []
+            self.request_headers(self.locator())
+
+    def request_headers(self, locator: list):
+        self.header_deadline = time.time() + self.request_timeout
+        self.node.send_to(self.header_peer, json.dumps({'locator': locator, 'count': HEADERS_PER_MESSAGE}),
+                          'GetHeaders')
+
+    def on_get_headers(self, peer: str, contents: str):
+        """
+        Replies with the headers of the blocks following the first locator hash on the node's chain.
+        """
+        request = json.loads(contents)
+        store = self.node.blockchain.store  # holds exactly the blocks of the node's chain
+        start = None
+        for _hash in request['locator']:
+            height = store.height_of(_hash)
+            if height is not None:
+                start = height + 1
+                break
+        chain = self.node.blockchain.blockchain
+        blocks = chain[start:start + min(request['count'], HEADERS_PER_MESSAGE)] if start is not None else []
+        self.node.send_to(peer, Codec.encode_header_entries([block.header_entry() for block in blocks]), 'Headers')
+
+    def on_headers(self, peer: str, contents: bytes):
+        """
+        Checks a batch of headers from the peer being downloaded from: each must link to the one before it, the first
+        to the node's chain or the previous batch, and the hash of every MERKLE_VERSION header must meet the
+        difficulty. Older blocks are listed with a hash the peer could have made up, so they are recorded without one
+        and downloaded body-first: any block at their height is taken and left to the validation pipeline. Asks for the
+        next batch, or once all are there, schedules the blocks.
+        """
+        entries = Codec.decode_header_entries(contents)
+        with self.lock:
+            if peer != self.header_peer:
+                return
+            if self.headers:
+                prev_height, prev_hash = self.headers[-1]
+            elif entries:
+                prev_height = self.node.blockchain.store.height_of(Codec.unpack_hash(entries[0]['prevHash']))
+                if prev_height is None:
+                    print('chain sync: headers from', peer, 'do not start on the chain')
+                    self.reset()
+                    return
+                prev_hash = entries[0]['prevHash']
+            difficulty = self.node.hash_difficulty
+            for entry in entries:
+                if 'header' in entry:
+                    _hash = hashlib.sha256(entry['header']).digest()
+                    if _hash.hex() > difficulty:
+                        print('chain sync: header', entry['index'], 'from', peer, 'does not meet the difficulty')
+                        self.reset()
+                        return
+                    proven = _hash
+                else:  # nothing proves the listed hash, the block is downloaded body-first
+                    _hash = entry['hash']
+                    proven = None
+                if entry['prevHash'] != prev_hash or entry['index'] != prev_height + 1:
+                    print('chain sync: header', entry['index'], 'from', peer, 'does not link to the one before')
+                    self.reset()
+                    return
+                self.headers.append((entry['index'], proven))
+                prev_height, prev_hash = entry['index'], _hash
+            if len(entries) == HEADERS_PER_MESSAGE:
+                self.request_headers([prev_hash.hex()] + self.locator())
+                return
+            self.header_peer = None
+            if not self.headers or self.headers[-1][0] <= self.height():
+                self.headers = []
+                return
+            released = self.schedule_blocks()
+        self.submit(released)
+
+    def schedule_blocks(self):
+        """
+        Splits the blocks of the downloaded headers the node does not have yet into ranges for GetBlocks.
+
+        :return: list. Contents of the blocks ready for the validation pipeline, see release().
+        """
+        tree = self.node.blockchain.tree
+        self.next_height = self.headers[0][0]
+        print('chain sync: downloading blocks', self.next_height, 'to', self.headers[-1][0])
+        self.expected = {}
+        for height, _hash in self.headers:
+            if _hash is not None and _hash.hex() in tree:
+                self.bodies[height] = None
+            else:
+                self.expected[height] = _hash
+        self.headers = []
+        for start in range(self.next_height, max(self.expected, default=self.next_height) + 1,
+                           self.blocks_per_request):
+            heights = [h for h in range(start, start + self.blocks_per_request) if h in self.expected]
+            if heights:
+                self.queued.append([heights[0], heights[-1] - heights[0] + 1, set()])
+        self.schedule()
+        return self.release()
+
+    def schedule(self):
+        """
+        Requests queued ranges from the least busy peers whose tip is high enough, up to max_requests in flight.
+        """
+        while self.queued and len(self.in_flight) < self.max_requests:
+            start, count, failed = self.queued[0]
+            able = [peer for peer, height in self.peer_tips.items() if height >= start + count - 1]
+            if not able:
+                return
+            if failed.issuperset(able):  # the headers are of a branch no peer has any more, start over from the tips
+                print('chain sync: no peer has blocks', start, 'to', start + count - 1)
+                self.reset()
+                self.last_tip_request = 0
+                return
+            busy = collections.Counter(request[0] for request in self.in_flight.values())
+            peer = min((peer for peer in able if peer not in failed), key=lambda p: busy[p])
+            self.queued.popleft()
+            self.in_flight[start] = [peer, count, failed, time.time() + self.request_timeout]
+            self.node.send_to(peer, json.dumps({'start': start, 'count': count}), 'GetBlocks')
+
+    def on_get_blocks(self, peer: str, contents: str):
+        """
+        Replies with the blocks of the node's chain in the requested range of heights, at most blocks_per_request of
+        them, stopping after MAX_REPLY_BYTES. Blocks are read one height at a time, so no more are loaded than sent.
+        """
+        request = json.loads(contents)
+        start = request['start']
+        chain = self.node.blockchain.blockchain
+        blocks = []
+        size = 0
+        for height in range(max(start, 0), min(start + min(request['count'], self.blocks_per_request), len(chain))):
+            try:
+                block = chain[height]
+            except IndexError:  # dropped by a reorganization meanwhile
+                break
+            blocks.append(self.node.encode(block))
+            size += len(blocks[-1])
+            if size >= MAX_REPLY_BYTES:
+                break
+        if self.node.wire_format == 'binary':
+            reply = Codec.encode_varint(start) + Codec.encode_list(blocks)
+        else:
+            reply = json.dumps({'start': start, 'blocks': blocks})
+        self.node.send_to(peer, reply, 'Blocks')
+
+    def on_blocks(self, peer: str, contents):
+        """
+        Keeps the blocks of a Blocks reply that match the headers, queues again the part of the range that is missing
+        and hands the blocks that are next in height order to the validation pipeline.
+        """
+        if isinstance(contents, bytes):
+            start, offset = Codec.decode_varint(contents, 0)
+            blocks = Codec.decode_list(contents[offset:])
+        else:
+            reply = json.loads(contents)
+            start, blocks = reply['start'], reply['blocks']
+        with self.lock:
+            request = self.in_flight.get(start)
+            if request is None or request[0] != peer:
+                return
+            del self.in_flight[start]
+            _, count, failed, _ = request
+            matched = 0
+            for block_contents in blocks:
+                if isinstance(block_contents, bytes):
+                    header = Codec.decode_block_header(block_contents)
+                    height, _hash = header['index'], Codec.pack_hash(header['hash'])
+                else:
+                    header = Block(block_contents)
+                    height, _hash = header.index, Codec.pack_hash(header.hash)
+                if height in self.expected and self.expected[height] in (None, _hash) and height not in self.bodies:
+                    self.bodies[height] = block_contents
+                    matched += 1
+            missing = [h for h in range(start, start + count) if h in self.expected and h not in self.bodies]
+            if missing:
+                if matched == 0:  # not only cut short by the reply size
+                    failed.add(peer)
+                self.queued.appendleft([missing[0], missing[-1] - missing[0] + 1, failed])
+            released = self.release()
+            self.schedule()
+        self.submit(released)
+
+    def release(self):
+        """
+        Takes the downloaded blocks that are next in height order, and finishes the sync once all are there. Called
+        with the lock held, the caller passes the blocks to submit() once it released the lock.
+
+        :return: list. Contents of the blocks, in height order.
+        """
+        released = []
+        while self.next_height in self.bodies:
+            contents = self.bodies.pop(self.next_height)
+            self.expected.pop(self.next_height, None)
+            if contents is not None:
+                released.append(contents)
+            self.next_height += 1
+        if not self.expected:
+            print('chain sync: downloaded every block up to', self.next_height - 1)
+            self.reset()
+            self.last_tip_request = 0  # check whether the peers moved on meanwhile
+        return released
+
+    def submit(self, released: list):
+        """
+        Hands released blocks to the validation pipeline, without the lock: submit() waits while the pipeline is
+        full, and the requests must go on being answered and retried meanwhile.
+        """
+        for contents in released:
+            self.node.validation.submit(contents)
+
+    def reset(self):
+        self.header_peer = None
+        self.headers = []
+        self.expected = {}
+        self.queued.clear()
+        self.in_flight = {}
+        self.bodies = {}
+        self.next_height = None
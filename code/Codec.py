@@ -0,0 +1,519 @@
+"""
+Compact binary encoding of Transactions, Blocks and messages.
+
+A block is MAGIC, the codec version, the nonce and the block hash, followed by its fields: block version, index,
+previous hash, timestamp and transactions. Integers are varints, hashes are their raw 32 bytes and timestamps are
+integer microseconds since 1970-01-01 (local time, as the text timestamps are). Every value is encoded so that decoding
+gives back exactly the original, so blocks whose hash covers their JSON form still verify after a round trip.
+
+From MERKLE_VERSION on, a block's fields start with a fixed size HEADER instead of the varint version, index, previous
+hash and timestamp. The version is its first field, little endian, so its first byte reads as the same varint.
+
+Blocks and Transactions keep hashes and timestamps in memory in the same packed forms, see pack_hash() and
+pack_timestamp().
+"""
+import datetime, struct
+
+MAGIC = b'\xb1'  # first byte of an encoded block, JSON starts with '{' instead
+CODEC_VERSION = 2  # 1 wrote the nonce and hash after the transactions, it is still read
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+TIMESTAMP_INT, TIMESTAMP_TEXT = 0, 1  # a timestamp that does not survive the conversion to an integer is kept as text
+AMOUNT_FLOAT, AMOUNT_INT = 0, 1  # JSON writes 12 and 12.0 differently, so the type is kept
+VALUE_TEXT, VALUE_BYTES = 0, 1
+DOUBLE = struct.Struct('>d')
+MERKLE_VERSION = 3  # blocks from this version on start their fields with a fixed size HEADER
+HEADER = struct.Struct('<IQ32sq32s')  # block version, index, previous hash, timestamp microseconds, Merkle root
+HEADER_ENTRY_SIZE = HEADER.size + 8  # the header and the 8 byte big endian nonce, what the block hash covers
+SHORT_ID_SIZE = 8  # bytes of a transaction id listed in a compact block
+
+
+def encode_varint(value: int) -> bytes:
+    """
+    Unsigned LEB128 varint.
+
+    :param value: int. Must not be negative.
+    :return: bytes.
+    """
+    if value < 0:
+        raise ValueError('varints must not be negative')
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(data: bytes, offset: int):
+    """
+    :return: tuple (value, offset after the varint).
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_signed(value: int) -> bytes:
+    return encode_varint(value << 1 if value >= 0 else (-value << 1) - 1)  # zigzag
+
+
+def decode_signed(data: bytes, offset: int):
+    value, offset = decode_varint(data, offset)
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), offset
+
+
+def encode_text(value: str) -> bytes:
+    raw = value.encode()
+    return encode_varint(len(raw)) + raw
+
+
+def decode_text(data: bytes, offset: int):
+    length, offset = decode_varint(data, offset)
+    return data[offset:offset + length].decode(), offset + length
+
+
+def pack_hash(value):
+    """
+    The in-memory form of a hash: a 64 character lowercase hex hash as its raw 32 bytes, anything else (such as the
+    empty hash of a block not mined yet) unchanged.
+
+    :param value: str, or bytes already packed.
+    :return: bytes or str.
+    """
+    if isinstance(value, bytes) or len(value) != 64:
+        return value
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return value
+    return raw if raw.hex() == value else value
+
+
+def unpack_hash(value) -> str:
+    """
+    :param value: bytes or str. A hash as returned by pack_hash().
+    :return: str.
+    """
+    return value.hex() if isinstance(value, bytes) else value
+
+
+def encode_hash(value) -> bytes:
+    """
+    A 64 character lowercase hex hash as its raw 32 bytes.
+
+    :param value: str, or its raw 32 bytes.
+    :return: bytes.
+    """
+    raw = pack_hash(value)
+    if not isinstance(raw, bytes) or len(raw) != 32:
+        raise ValueError('not a 64 character lowercase hex hash: ' + repr(value))
+    return raw
+
+
+def decode_raw_hash(data: bytes, offset: int):
+    return data[offset:offset + 32], offset + 32
+
+
+def decode_hash(data: bytes, offset: int):
+    return data[offset:offset + 32].hex(), offset + 32
+
+
+def pack_timestamp(value):
+    """
+    The in-memory form of a timestamp: a str(datetime) timestamp as integer microseconds, or unchanged if that would
+    not give back the same string.
+
+    :param value: str, or int already packed.
+    :return: int or str.
+    """
+    if isinstance(value, int):
+        return value
+    try:
+        parsed = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S')
+        if str(parsed) == value:
+            return (parsed - EPOCH) // MICROSECOND
+    except ValueError:
+        pass
+    return value
+
+
+def unpack_timestamp(value) -> str:
+    """
+    :param value: int or str. A timestamp as returned by pack_timestamp().
+    :return: str.
+    """
+    return str(EPOCH + value * MICROSECOND) if isinstance(value, int) else value
+
+
+def encode_timestamp(value) -> bytes:
+    """
+    A str(datetime) timestamp as integer microseconds, or as text if that would not give back the same string.
+
+    :param value: str, or as returned by pack_timestamp().
+    :return: bytes.
+    """
+    packed = pack_timestamp(value)
+    if isinstance(packed, int):
+        return bytes([TIMESTAMP_INT]) + encode_signed(packed)
+    return bytes([TIMESTAMP_TEXT]) + encode_text(packed)
+
+
+def decode_raw_timestamp(data: bytes, offset: int):
+    """
+    :return: tuple (timestamp as returned by pack_timestamp(), offset after the timestamp).
+    """
+    if data[offset] == TIMESTAMP_INT:
+        return decode_signed(data, offset + 1)
+    return decode_text(data, offset + 1)
+
+
+def decode_timestamp(data: bytes, offset: int):
+    value, offset = decode_raw_timestamp(data, offset)
+    return unpack_timestamp(value), offset
+
+
+def encode_amount(value) -> bytes:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('amount must be a number: ' + repr(value))
+    if isinstance(value, int):
+        return bytes([AMOUNT_INT]) + encode_signed(value)
+    return bytes([AMOUNT_FLOAT]) + DOUBLE.pack(value)
+
+
+def decode_amount(data: bytes, offset: int):
+    if data[offset] == AMOUNT_INT:
+        return decode_signed(data, offset + 1)
+    return DOUBLE.unpack_from(data, offset + 1)[0], offset + 1 + DOUBLE.size
+
+
+def encode_transaction(to_node: str, from_node: str, amount, timestamp, unique_id) -> bytes:
+    """
+    :param timestamp: str, or as returned by pack_timestamp().
+    :param unique_id: str, or its raw 32 bytes.
+    :return: bytes.
+    """
+    return encode_text(to_node) + encode_text(from_node) + encode_amount(amount) + encode_timestamp(timestamp) + \
+        encode_hash(unique_id)
+
+
+def decode_transaction(data: bytes, offset: int = 0):
+    """
+    :return: tuple (dict of Transaction constructor arguments, offset after the transaction). The timestamp and
+    unique_id are in their packed in-memory forms.
+    """
+    to_node, offset = decode_text(data, offset)
+    from_node, offset = decode_text(data, offset)
+    amount, offset = decode_amount(data, offset)
+    timestamp, offset = decode_raw_timestamp(data, offset)
+    unique_id, offset = decode_raw_hash(data, offset)
+    return {'_to': to_node, '_from': from_node, 'amount': amount, 'timestamp': timestamp,
+            'unique_id': unique_id}, offset
+
+
+def decode_transactions(data: bytes, offset: int, count: int) -> list:
+    """
+    :return: list of dicts of Transaction constructor arguments, for the count transactions starting at offset.
+    """
+    transactions = []
+    for _ in range(count):
+        tx, offset = decode_transaction(data, offset)
+        transactions.append(tx)
+    return transactions
+
+
+def encode_header(version: int, index: int, prev_hash, timestamp, merkle_root: bytes) -> bytes:
+    """
+    The fixed size header of a MERKLE_VERSION block, without the nonce. This is its hash prefix.
+
+    :param prev_hash: str, or its raw 32 bytes.
+    :param timestamp: str, or as returned by pack_timestamp(). Must convert to integer microseconds.
+    :param merkle_root: bytes. Raw Merkle root of the transaction ids.
+    :return: bytes.
+    """
+    packed = pack_timestamp(timestamp)
+    if not isinstance(packed, int):
+        raise ValueError('timestamp does not fit a block header: ' + repr(timestamp))
+    return HEADER.pack(version, index, encode_hash(prev_hash), packed, merkle_root)
+
+
+def decode_header(data: bytes, offset: int = 0):
+    """
+    :return: tuple (dict with the version, index, prevHash, timestamp and merkleRoot of a HEADER, with hashes and the
+    timestamp packed, offset after the header).
+    """
+    version, index, prev_hash, timestamp, merkle_root = HEADER.unpack_from(data, offset)
+    return {'version': version, 'index': index, 'prevHash': prev_hash, 'timestamp': timestamp,
+            'merkleRoot': merkle_root}, offset + HEADER.size
+
+
+def encode_block_fields(version: int, index: int, prev_hash, timestamp, transactions: list,
+                        merkle_root: bytes = None) -> bytes:
+    """
+    Every field of a block except the nonce and the hash. This is the hash prefix of binary hashed blocks.
+
+    :param prev_hash: str, or its raw 32 bytes.
+    :param timestamp: str, or as returned by pack_timestamp().
+    :param transactions: list of Transaction objects.
+    :param merkle_root: bytes. Required from MERKLE_VERSION on, where the fields start with the header.
+    :return: bytes.
+    """
+    if version >= MERKLE_VERSION:
+        head = encode_header(version, index, prev_hash, timestamp, merkle_root)
+    else:
+        head = encode_varint(version) + encode_varint(index) + encode_hash(prev_hash) + encode_timestamp(timestamp)
+    return head + encode_varint(len(transactions)) + b''.join(tx.to_bytes() for tx in transactions)
+
+
+def encode_block(nonce: int, _hash, fields: bytes) -> bytes:
+    """
+    The nonce and hash go ahead of the fields, so a reader can take the header of a block without walking its
+    transactions.
+
+    :param _hash: str, or its raw 32 bytes.
+    :param fields: bytes. As returned by encode_block_fields().
+    :return: bytes.
+    """
+    return MAGIC + encode_varint(CODEC_VERSION) + encode_varint(nonce) + encode_hash(_hash) + fields
+
+
+def decode_block_header(data: bytes) -> dict:
+    """
+    Decodes everything but the transactions of an encoded block.
+
+    :param data: bytes. An encoded block.
+    :return: dict of Block constructor arguments without the transactions, with the prevHash and hash packed, plus
+    'fields_offset' (where the encode_block_fields() bytes start), 'transactions_offset' and 'transaction_count', and
+    'merkleRoot' from MERKLE_VERSION on. Blocks encoded by codec version 1 have their transactions decoded into
+    'transactions', as the hash follows them.
+    """
+    if data[:1] != MAGIC:
+        raise ValueError('not an encoded block')
+    codec_version, offset = decode_varint(data, 1)
+    if codec_version not in (1, CODEC_VERSION):
+        raise ValueError('unknown codec version {}'.format(codec_version))
+    header = {}
+    if codec_version == CODEC_VERSION:
+        header['nonce'], offset = decode_varint(data, offset)
+        header['hash'], offset = decode_raw_hash(data, offset)
+    header['fields_offset'] = offset
+    version, _ = decode_varint(data, offset)
+    if version >= MERKLE_VERSION:
+        fixed, offset = decode_header(data, offset)
+        header.update(fixed)
+    else:
+        header['version'], offset = decode_varint(data, offset)
+        header['index'], offset = decode_varint(data, offset)
+        header['prevHash'], offset = decode_raw_hash(data, offset)
+        header['timestamp'], offset = decode_raw_timestamp(data, offset)
+    header['transaction_count'], offset = decode_varint(data, offset)
+    header['transactions_offset'] = offset
+    if codec_version == 1:  # nonce and hash last
+        header['transactions'] = []
+        for _ in range(header['transaction_count']):
+            tx, offset = decode_transaction(data, offset)
+            header['transactions'].append(tx)
+        header['nonce'], offset = decode_varint(data, offset)
+        header['hash'], offset = decode_raw_hash(data, offset)
+    return header
+
+
+def decode_block(data: bytes) -> dict:
+    """
+    :param data: bytes. An encoded block.
+    :return: dict of Block constructor arguments, with transactions as dicts of Transaction constructor arguments.
+    """
+    header = decode_block_header(data)
+    if 'transactions' not in header:
+        header['transactions'] = decode_transactions(data, header['transactions_offset'], header['transaction_count'])
+    for key in ('fields_offset', 'transactions_offset', 'transaction_count', 'merkleRoot'):
+        header.pop(key, None)
+    return header
+
+
+def encode_header_entry(version: int, index: int, prev_hash, _hash, header: bytes = None) -> bytes:
+    """
+    A block as listed in a chain sync Headers message. From MERKLE_VERSION on this is the HEADER and nonce the block
+    hash is computed over (see Block.hash_contents()), so its proof of work can be checked without the transactions.
+    Older blocks are listed by their version, index, previous hash and hash, which are only checked once the block
+    itself arrives.
+
+    :param prev_hash: str, or its raw 32 bytes.
+    :param _hash: str, or its raw 32 bytes.
+    :param header: bytes. Required from MERKLE_VERSION on.
+    :return: bytes.
+    """
+    if version >= MERKLE_VERSION:
+        if len(header) != HEADER_ENTRY_SIZE:
+            raise ValueError('a block header is {} bytes, not {}'.format(HEADER_ENTRY_SIZE, len(header)))
+        return bytes(header)
+    return encode_varint(version) + encode_varint(index) + encode_hash(prev_hash) + encode_hash(_hash)
+
+
+def encode_header_entries(entries: list) -> bytes:
+    """
+    :param entries: list of bytes. As returned by encode_header_entry().
+    :return: bytes.
+    """
+    return encode_varint(len(entries)) + b''.join(entries)
+
+
+def decode_header_entries(data: bytes) -> list:
+    """
+    :param data: bytes. As returned by encode_header_entries().
+    :return: list of dicts with the version, index and prevHash of every entry, with 'header' (the hashed bytes) from
+    MERKLE_VERSION on and the raw 'hash' before.
+    """
+    entries = []
+    count, offset = decode_varint(data, 0)
+    for _ in range(count):
+        version, _ = decode_varint(data, offset)
+        if version >= MERKLE_VERSION:
+            header = data[offset:offset + HEADER_ENTRY_SIZE]
+            if len(header) != HEADER_ENTRY_SIZE:
+                raise ValueError('truncated block header')
+            entry, offset = decode_header(data, offset)
+            entry['header'] = header
+            offset += HEADER_ENTRY_SIZE - HEADER.size
+        else:
+            entry = {}
+            entry['version'], offset = decode_varint(data, offset)
+            entry['index'], offset = decode_varint(data, offset)
+            entry['prevHash'], offset = decode_raw_hash(data, offset)
+            entry['hash'], offset = decode_raw_hash(data, offset)
+        entries.append(entry)
+    return entries
+
+
+def encode_list(items: list) -> bytes:
+    """
+    Length prefixed byte strings, such as the encoded blocks of a chain sync Blocks message.
+
+    :param items: list of bytes.
+    :return: bytes.
+    """
+    return encode_varint(len(items)) + b''.join(encode_varint(len(item)) + item for item in items)
+
+
+def decode_list(data: bytes) -> list:
+    count, offset = decode_varint(data, 0)
+    items = []
+    for _ in range(count):
+        length, offset = decode_varint(data, offset)
+        items.append(data[offset:offset + length])
+        offset += length
+    return items
+
+
+def encode_inventory(inventory: dict) -> bytes:
+    """
+    The ids of a relay Inv or GetData message, as two lists of raw 32 byte hashes.
+
+    :param inventory: dict. 'Block' -> list of block hashes, 'Transaction' -> list of transaction unique_ids.
+    :return: bytes.
+    """
+    return encode_list([b''.join(encode_hash(_id) for _id in inventory.get(key, []))
+                        for key in ('Block', 'Transaction')])
+
+
+def decode_inventory(data: bytes) -> dict:
+    inventory = {}
+    for key, ids in zip(('Block', 'Transaction'), decode_list(data)):
+        if len(ids) % 32:
+            raise ValueError('inventory is not a list of hashes')
+        inventory[key] = [ids[i:i + 32].hex() for i in range(0, len(ids), 32)]
+    return inventory
+
+
+def short_id(unique_id) -> bytes:
+    """
+    The id a compact block lists a transaction by: the first SHORT_ID_SIZE bytes of its raw unique_id.
+
+    :param unique_id: str, or its raw 32 bytes.
+    :return: bytes.
+    """
+    return encode_hash(unique_id)[:SHORT_ID_SIZE]
+
+
+def encode_compact_block(nonce: int, header: bytes, short_ids: list) -> bytes:
+    """
+    A MERKLE_VERSION block as sent in a CompactBlock message: its nonce, its header and the short ids of its
+    transactions in block order. The receiver computes the hash from the header and nonce.
+
+    :param header: bytes. The block's HEADER, its hash prefix.
+    :param short_ids: list of bytes.
+    :return: bytes.
+    """
+    return encode_varint(nonce) + bytes(header) + encode_varint(len(short_ids)) + b''.join(short_ids)
+
+
+def decode_compact_block(data: bytes):
+    """
+    :return: tuple (nonce, raw header, dict of the decoded header as returned by decode_header(), list of short ids).
+    """
+    nonce, offset = decode_varint(data, 0)
+    header = data[offset:offset + HEADER.size]
+    fields, offset = decode_header(data, offset)
+    count, offset = decode_varint(data, offset)
+    if len(data) != offset + count * SHORT_ID_SIZE:
+        raise ValueError('compact block has {} bytes of short ids for {} transactions'.format(len(data) - offset,
+                                                                                             count))
+    return nonce, header, fields, [data[i:i + SHORT_ID_SIZE] for i in range(offset, len(data), SHORT_ID_SIZE)]
+
+
+def encode_block_transactions_request(_hash, indexes: list) -> bytes:
+    """
+    Contents of a GetBlockTxn message: the hash of a block and the positions of the transactions asked for.
+    """
+    return encode_hash(_hash) + encode_varint(len(indexes)) + b''.join(encode_varint(i) for i in indexes)
+
+
+def decode_block_transactions_request(data: bytes):
+    """
+    :return: tuple (block hash str, list of positions).
+    """
+    _hash, offset = decode_hash(data, 0)
+    count, offset = decode_varint(data, offset)
+    indexes = []
+    for _ in range(count):
+        index, offset = decode_varint(data, offset)
+        indexes.append(index)
+    return _hash, indexes
+
+
+def encode_message(message: dict) -> bytes:
+    """
+    A message dict whose values are str or bytes, as sent by the Messenger.
+
+    :param message: dict.
+    :return: bytes.
+    """
+    out = [encode_varint(len(message))]
+    for key, value in message.items():
+        out.append(encode_text(key))
+        if isinstance(value, bytes):
+            out.append(bytes([VALUE_BYTES]) + encode_varint(len(value)) + value)
+        else:
+            out.append(bytes([VALUE_TEXT]) + encode_text(value))
+    return b''.join(out)
+
+
+def decode_message(data: bytes) -> dict:
+    count, offset = decode_varint(data, 0)
+    message = {}
+    for _ in range(count):
+        key, offset = decode_text(data, offset)
+        if data[offset] == VALUE_BYTES:
+            length, offset = decode_varint(data, offset + 1)
+            message[key] = data[offset:offset + length]
+            offset += length
+        else:
+            message[key], offset = decode_text(data, offset + 1)
+    return message
@@ -0,0 +1,160 @@
+from Block import Block, MERKLE_VERSION, binary_nonce_tail
+from Transaction import Transaction
+from threading import Lock
+import Codec
+import collections, hashlib, struct
+
+MESSAGE_TYPES = ('CompactBlock', 'GetBlockTxn', 'BlockTxn')
+
+
+class CompactRelay:
+    """
+    Compact block relay. Peers usually hold most of a new block's transactions in their mempool already, so instead of
+    the full block a node sends its header, nonce and the short ids of its transactions (CompactBlock, see
+    Codec.encode_compact_block()). The receiver rebuilds the block from its mempool and asks the sender only for the
+    transactions it is missing, by position (GetBlockTxn, answered by BlockTxn). A rebuilt block must pass the same
+    proof of work, Merkle root and duplicate checks as a received one before it goes to the chain, so a short id
+    matching the wrong transaction only costs a request for the full list. Blocks older than MERKLE_VERSION have no
+    fixed header and are always sent in full.
+
+    Attributes
+    ----------
+    node : Node
+        the node relaying, its mempool rebuilds blocks and its block tree answers GetBlockTxn
+    partial : OrderedDict
+        block hash -> (header fields, nonce, list of its transactions with None where missing) of the last
+        max_partial blocks waiting for transactions
+    rebuilt, requested, failed : int
+        numbers of blocks rebuilt, transactions requested and blocks that failed their checks once rebuilt
+
+    Methods
+    -------
+    encode(block: Block)
+        contents and type of the message sending a block, compact when it can be
+    handle(msg: dict)
+        handles a compact block message
+    """
+
+    def __init__(self, node, max_partial: int = 16):
+        """
+        Constructor for the CompactRelay.
+
+        :param node: Node. Node relaying.
+        :param max_partial: int. Most blocks kept waiting for missing transactions.
+        """
+        self.node = node
+        self.max_partial = max_partial
+        self.lock = Lock()
+        self.partial = collections.OrderedDict()
+        self.rebuilt = self.requested = self.failed = 0
+
+    @staticmethod
+    def encode(block: Block):
+        """
+        Contents and type of the message sending a block: a CompactBlock from MERKLE_VERSION on, else the full Block.
+
+        :param block: Block.
+        :return: tuple (bytes, str).
+        """
+        if block.version < MERKLE_VERSION:
+            return block.to_bytes(), 'Block'
+        return Codec.encode_compact_block(block.nonce, block.hash_prefix(),
+                                          [Codec.short_id(tx.unique_id) for tx in block.transactions]), 'CompactBlock'
+
+    def handle(self, msg: dict):
+        """
+        Handles a CompactBlock, GetBlockTxn or BlockTxn message. Messages without a sender cannot be answered and are
+        dropped.
+
+        :param msg: dict. Message attributes.
+        :return: None
+        """
+        peer = msg.get('sender')
+        if peer is None:
+            return
+        handler = {'CompactBlock': self.on_compact_block, 'GetBlockTxn': self.on_get_block_txn,
+                   'BlockTxn': self.on_block_txn}[msg['type']]
+        try:
+            handler(peer, msg['contents'])
+        except (ValueError, KeyError, IndexError, TypeError, struct.error) as e:
+            print('compact relay: malformed', msg['type'], 'from', peer, repr(e))
+
+    def on_compact_block(self, peer: str, contents: bytes):
+        """
+        Rebuilds a block from the mempool, or asks the sender for the transactions the mempool does not have.
+        """
+        nonce, header, fields, short_ids = Codec.decode_compact_block(contents)
+        _hash = hashlib.sha256(header + binary_nonce_tail(nonce)).hexdigest()
+        relay = self.node.relay
+        if relay is not None and not relay.seen(_hash, peer):
+            return
+        if self.node.blockchain.find_block_from_hash(_hash) is not None:
+            return
+        mempool = self.node.transaction_queue
+        transactions = [mempool.get_short(short_id) for short_id in short_ids]
+        missing = [i for i, tx in enumerate(transactions) if tx is None]
+        if missing:
+            self.request(peer, _hash, fields, nonce, transactions, missing)
+        else:
+            self.complete(peer, fields, nonce, transactions)
+
+    def request(self, peer: str, _hash: str, fields: dict, nonce: int, transactions: list, missing: list):
+        """
+        Keeps a block waiting for its missing transactions and asks the sender for them.
+        """
+        with self.lock:
+            self.partial[_hash] = (fields, nonce, transactions)
+            while len(self.partial) > self.max_partial:
+                self.partial.popitem(last=False)
+            self.requested += len(missing)
+        self.node.send_to(peer, Codec.encode_block_transactions_request(_hash, missing), 'GetBlockTxn')
+
+    def on_get_block_txn(self, peer: str, contents: bytes):
+        """
+        Replies with the requested transactions of a block, the block hash followed by the encoded transactions.
+        """
+        _hash, indexes = Codec.decode_block_transactions_request(contents)
+        block = self.node.blockchain.find_block_from_hash(_hash)
+        if block is None:
+            return
+        transactions = block.transactions
+        self.node.send_to(peer, Codec.encode_hash(_hash) + Codec.encode_list([transactions[i].to_bytes()
+                                                                              for i in indexes]), 'BlockTxn')
+
+    def on_block_txn(self, peer: str, contents: bytes):
+        """
+        Fills the missing transactions of a block waiting for them, in order of position, and checks it.
+        """
+        _hash, offset = Codec.decode_hash(contents, 0)
+        with self.lock:
+            entry = self.partial.pop(_hash, None)
+        if entry is None:
+            return
+        fields, nonce, transactions = entry
+        received = Codec.decode_list(contents[offset:])
+        missing = [i for i, tx in enumerate(transactions) if tx is None]
+        if len(received) != len(missing):
+            raise ValueError('{} transactions for {} missing'.format(len(received), len(missing)))
+        for i, tx_bytes in zip(missing, received):
+            transactions[i] = Transaction.from_bytes(tx_bytes)
+        self.complete(peer, fields, nonce, transactions, len(missing) == len(transactions))
+
+    def complete(self, peer: str, fields: dict, nonce: int, transactions: list, full: bool = False):
+        """
+        Checks a rebuilt block and hands it to the chain. A block that fails with transactions from the mempool is
+        asked for again with every transaction.
+
+        :param full: bool. Every transaction came from the sender.
+        :return: None
+        """
+        block = Block.from_header(fields, nonce, transactions)
+        if block.verify_proof_of_work() and block.verify_merkle_root() and \
+                len(set(tx.unique_id for tx in transactions)) == len(transactions):
+            block.mark_verified()
+            self.rebuilt += 1
+            self.node.receive_block(block)
+        elif not full:
+            self.request(peer, block.hash, fields, nonce, [None] * len(transactions), list(range(len(transactions))))
+        else:
+            print('compact relay: block', block.hash, 'from', peer, 'failed its checks')
+            self.failed += 1
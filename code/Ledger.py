@@ -1,42 +1,107 @@
 from Transaction import Transaction
-import pickle, os, copy
+import Snapshot
+import pickle, os
+
+
+CHECKPOINT_INTERVAL = 100  # a full copy of the balances is kept every this many blocks
+SNAPSHOT_CHANGES = 100  # blocks a ledger started from a snapshot can be undone by without reading the journal
+
+
+class BalanceHistory:
+    """
+    Read-only list-like view of the balance state after every block, rebuilt on demand from the Ledger's checkpoints
+    and per block changes. ledger.blockchain_balances[i] returns a new {account: balance} dict.
+    """
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+
+    def __len__(self) -> int:
+        return len(self.ledger.block_changes)
+
+    def __getitem__(self, index: int) -> dict:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('ledger index out of range')
+        return self.ledger.state_at(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
 
 
 class Ledger:
     """
-    This class is designed to hold a list of balance states of the blockchain network where each state corresponds to
-    the state of the network after the transactions within its associated block were applied to the network balances.
-    BlockChain[1] -> Ledger[1]
+    This class holds the balance state of the blockchain network. Only the current balances are kept in full; every
+    block adds a record of the balances it changed (old and new value, so it can be undone), and a full checkpoint of
+    the balances is kept every CHECKPOINT_INTERVAL blocks. The state after any block can still be looked up through
+    blockchain_balances. BlockChain[1] -> Ledger[1]
+
+    A ledger started from a snapshot holds the changes of the last SNAPSHOT_CHANGES blocks before it only; the older
+    ones are None until a lookup or rollback reaches them, which replays the whole journal once.
 
     Attributes
     ----------
-    blockchain_balances : list.
-        This list holds all balance states of the blockchain, each state corresponds to a new block added to the chain.
+    balances : dict.
+        current balance of every account, the state after the last block
+    block_changes : list.
+        one {account: (old balance, new balance)} dict per block, for the accounts that block changed
+    checkpoints : dict.
+        block index -> full copy of the balances after that block
+    blockchain_balances : BalanceHistory.
+        list-like view of the balance state after each block
+    history_start : int.
+        first block whose changes are in block_changes, 0 unless the ledger started from a snapshot
+    snapshot : dict.
+        the snapshot the ledger started from, or None
 
     Methods
     ----------
-    verify_and_add_transaction(transactions: list of Transaction objects, index: int)
+    verify_transaction(transactions: list of Transaction objects, index: int)
         Takes transaction objects and applies them to the ledger at index. If any balance is negative return false.
     add_balance_state(balance: dict, index: int)
-        Adds a ledger state (in form of dictionary of peers and balances) to the ledger list at index.
+        Applies the balances changed by the block at index, rolling back any later blocks first.
+    add_transactions(transactions: list, index: int)
+        Applies transactions at index without verifying them.
+    rollback(index: int)
+        Undo every block after index.
+    state_at(index: int)
+        Returns the full balance state after the block at index.
     get_curr_balance_for_node(node: str)
         Returns current balance of a given node (as defined in last entry in ledger)
     get_total_currency_in_chain()
         Returns sum of all member balances (represents coin in circulation)
+    snapshot_state()
+        Returns the ledger part of a snapshot of the current state.
+    load_history()
+        Rebuilds the changes of every block from the journal, for a ledger started from a snapshot.
     create_or_read_file()
         Check for existing Ledger on disk, else create Ledger
-    write_to_file()
-        dump ledger contents to pickle on disk
     """
 
-    def __init__(self, node_id):
+    def __init__(self, node_id, data_dir: str = '../files', initial_balances: dict = None):
         """
         Constructor for the Ledger. Initializes balance of genesis block to introduce init currency into blockchain.
+
+        :param node_id: str. Name of the node the ledger belongs to, used in its file names.
+        :param data_dir: str. Directory the ledger files are kept in.
+        :param initial_balances: dict. Balances of the genesis block if no ledger is on disk yet, None for 10 each for
+        node0 to node3.
         """
         self.node_id = node_id
-        self.file_path = '../files/ledger' + node_id + '.txt'
-        self.pickle_path = '../files/ledger' + node_id + '.pickle'
-        self.blockchain_balances = [{}]  # initial bc balance
+        self.data_dir = data_dir
+        self.initial_balances = initial_balances
+        filename = os.path.join(data_dir, 'ledger' + node_id)
+        self.file_path = filename + '.txt'
+        self.pickle_path = filename + '.pickle'  # ledgers written before the journal existed
+        self.journal_path = filename + '.journal'
+        self.balances = {}
+        self.block_changes = []
+        self.checkpoints = {}
+        self.history_start = 0
+        self.snapshot = None
+        self.blockchain_balances = BalanceHistory(self)
         self.create_or_read_file()
 
     def verify_transaction(self, transactions, index):
@@ -45,14 +110,14 @@ class Ledger:
 
         :param transactions: list. List of Transaction objects to verify
         :param index: int. index at which the transactions are applied (equal to block index)
-        :return: bool, list. Return True, [new balance dict] if all valid, otherwise return false, [bad transactions] if
-        transactions cause any balance to go negative.
+        :return: bool, list. Return True, [changed balances dict] if all valid, otherwise return false,
+        [bad transactions] if transactions cause any balance to go negative or name an unknown account.
         """
-
-        change = copy.deepcopy(self.blockchain_balances[index-1])  # get previous state
-        for tx in transactions:  # apply all transactions to that state
-            change[tx.from_node] -= tx.amount
-            change[tx.to_node] += tx.amount
+        try:
+            change = self.apply_transactions(transactions, index)
+        except KeyError as e:
+            print('unknown account', e)
+            return False, [tx.unique_id for tx in transactions if e.args[0] in (tx.from_node, tx.to_node)]
         all_bad_tx = []
         for node, balance in change.items():
             if balance < 0:
@@ -64,19 +129,50 @@ class Ledger:
         else:
             return True, [change]
 
+    def apply_transactions(self, transactions, index) -> dict:
+        """
+        Apply transactions on top of the state after block index - 1, touching only the accounts involved.
+
+        :param transactions: list. List of Transaction objects.
+        :param index: int. index at which the transactions are applied
+        :return: dict. New balance of every account the transactions touch.
+        """
+        # the previous state is normally the current one, which can be read directly
+        previous = self.balances if index - 1 == len(self.block_changes) - 1 else self.state_at(index - 1)
+        change = {}
+        for tx in transactions:  # apply all transactions to that state
+            change[tx.from_node] = (change[tx.from_node] if tx.from_node in change else previous[tx.from_node]) \
+                - tx.amount
+            change[tx.to_node] = (change[tx.to_node] if tx.to_node in change else previous[tx.to_node]) + tx.amount
+        return change
+
     def add_balance_state(self, balance, index):
         """
-        Adds a ledger state (in form of dictionary of peers and balances) to the ledger list at index.
+        Applies the balances changed by the block at index. If the ledger already holds a state at index, that state
+        and every later one are rolled back first.
 
-        :param balance: dict. Dictionary of peer keys and balance values.
+        :param balance: dict. Dictionary of peer keys and their new balance values (only changed peers need be present).
         :param index: int.
         :return: None
         """
-        if index >= len(self.blockchain_balances):
-            self.blockchain_balances.append(balance)
-        else:
-            self.blockchain_balances[index] = balance
-        self.write_to_disk()
+        if index < len(self.block_changes):
+            self.rollback(index - 1)
+        self.apply_balance_state(balance, index)
+        self.write_record(('block', index, balance))
+        self.append_to_text_file(str(index) + ': ' + str(balance))
+
+    def apply_balance_state(self, balance, index):
+        """
+        Applies new balances as the state after the block at index, which must be the next index.
+
+        :param balance: dict. Dictionary of peer keys and their new balance values.
+        :param index: int.
+        :return: None
+        """
+        self.block_changes.append({node: (self.balances.get(node), value) for node, value in balance.items()})
+        self.balances.update(balance)
+        if index % CHECKPOINT_INTERVAL == 0:
+            self.checkpoints[index] = dict(self.balances)
 
     def add_transactions(self, transactions: list, index):
         """
@@ -86,11 +182,116 @@ class Ledger:
         :param index: int. index at which tx are applied
         :return: None
         """
-        change = copy.deepcopy(self.blockchain_balances[index - 1])  # get previous state
-        for tx in transactions:  # apply all transactions to that state
-            change[tx.from_node] -= tx.amount
-            change[tx.to_node] += tx.amount
-        self.add_balance_state(change, index)
+        self.add_balance_state(self.apply_transactions(transactions, index), index)
+
+    def rollback(self, index):
+        """
+        Undo every block after index, so that the current balances are the state after the block at index.
+
+        :param index: int. Last block to keep.
+        :return: None
+        """
+        if index >= len(self.block_changes) - 1:
+            return
+        self.undo_to(index)
+        self.write_record(('rollback', index))
+        self.append_to_text_file('rolled back to ' + str(index))
+
+    def undo_to(self, index):
+        """
+        Undo the block changes after index in memory.
+
+        :param index: int. Last block to keep.
+        :return: None
+        """
+        self.ensure_history(index)
+        while len(self.block_changes) - 1 > index:
+            for node, (old, new) in self.block_changes.pop().items():
+                if old is None:
+                    del self.balances[node]
+                else:
+                    self.balances[node] = old
+            self.checkpoints.pop(len(self.block_changes), None)
+
+    def state_at(self, index) -> dict:
+        """
+        Returns the full balance state after the block at index. It is rebuilt from the closest checkpoint below index,
+        or by undoing blocks from the current state, whichever touches fewer blocks.
+
+        :param index: int.
+        :return: dict.
+        """
+        self.ensure_history(index)
+        tip = len(self.block_changes) - 1
+        checkpoint = max((i for i in self.checkpoints if i <= index), default=None)
+        state = dict(self.balances) if checkpoint is None or tip - index < index - checkpoint else None
+        if state is not None:
+            for changes in self.block_changes[tip:index:-1]:  # undo blocks tip .. index + 1
+                for node, (old, new) in changes.items():
+                    if old is None:
+                        del state[node]
+                    else:
+                        state[node] = old
+        else:
+            state = dict(self.checkpoints[checkpoint])
+            for changes in self.block_changes[checkpoint + 1:index + 1]:
+                for node, (old, new) in changes.items():
+                    state[node] = new
+        return state
+
+    def ensure_history(self, index):
+        """
+        Makes sure the state after the block at index can be rebuilt from memory, loading the full history if the
+        ledger started from a snapshot taken after it.
+
+        :param index: int.
+        :return: None
+        """
+        if index < self.history_start - 1:
+            self.load_history()
+
+    def load_history(self):
+        """
+        Rebuilds the changes of every block by replaying the whole journal, for a ledger started from a snapshot. The
+        current balances come out the same.
+
+        :return: None
+        """
+        print('Loading the full ledger history')
+        self.balances = {}
+        self.block_changes = []
+        self.checkpoints = {}
+        self.history_start = 0
+        self.replay_journal()
+
+    def snapshot_state(self) -> dict:
+        """
+        Returns the ledger part of a snapshot: the current balances, the changes of the last SNAPSHOT_CHANGES blocks
+        with the checkpoints among them, and the size of the journal, whose records after that are replayed on top.
+
+        :return: dict.
+        """
+        start = max(self.history_start, len(self.block_changes) - SNAPSHOT_CHANGES)
+        return {
+            'height': len(self.block_changes) - 1,
+            'balances': dict(self.balances),
+            'changes': self.block_changes[start:],
+            'checkpoints': {i: state for i, state in self.checkpoints.items() if i >= start - 1},
+            'journal_offset': os.path.getsize(self.journal_path)
+        }
+
+    def restore_snapshot(self, state: dict):
+        """
+        Sets the ledger to the state returned by snapshot_state().
+
+        :param state: dict.
+        :return: None
+        """
+        self.history_start = state['height'] + 1 - len(state['changes'])
+        self.block_changes = [None] * self.history_start + list(state['changes'])
+        self.balances = dict(state['balances'])
+        self.checkpoints = dict(state['checkpoints'])
+        self.checkpoints[state['height']] = dict(self.balances)
 
     def get_curr_balance_for_node(self, node) -> float:
         """
@@ -99,7 +300,7 @@ class Ledger:
         :param node: str. Name of node in question
         :return: float.
         """
-        return self.blockchain_balances[-1][node]
+        return self.balances[node]
 
     def get_total_currency_in_chain(self) -> float:
         """
@@ -107,45 +308,87 @@ class Ledger:
         :return: float.
         """
         _sum = 0
-        for v in self.blockchain_balances[-1].values():
+        for v in self.balances.values():
             _sum += v
         return _sum
 
     def create_or_read_file(self):
         """
-        Check for existing Ledger on disk, else create Ledger
+        Check for existing Ledger on disk, else create Ledger. The ledger is rebuilt by replaying its journal.
         :return: None
         """
         # make sure the 'files' directory exists
-        if not os.path.isdir('../files'):
-            os.mkdir('../files')
+        if not os.path.isdir(self.data_dir):
+            os.makedirs(self.data_dir)
+        if os.path.exists(self.journal_path):
+            # start from the latest snapshot the journal reaches, and replay only the records written after it
+            journal_size = os.path.getsize(self.journal_path)
+            self.snapshot = Snapshot.latest_snapshot(self.data_dir, self.node_id,
+                                                     lambda s: s['ledger']['journal_offset'] <= journal_size)
+            if self.snapshot is not None:
+                self.restore_snapshot(self.snapshot['ledger'])
+                self.replay_journal(self.snapshot['ledger']['journal_offset'])
+                print('Ledger loaded from snapshot at height', self.snapshot['height'])
+            else:
+                self.replay_journal()
+                print('Ledger loaded from file')
+            return
         try:
-            # try to read in file from disk if it exists
+            # ledgers written before the journal existed are a pickled list of full states, replay them as changes
             read_file = open(self.pickle_path, 'rb')
-            self.blockchain_balances = pickle.load(read_file)
+            states = pickle.load(read_file)
             read_file.close()
-            print('Ledger loaded from file')
         except FileNotFoundError:
             # if no ledger exists, initialize one with the initial balances
-            self.blockchain_balances = [{'node0': 10, 'node1': 10, 'node2': 10, 'node3': 10}]
-            self.write_to_disk()
+            states = [self.initial_balances or {'node0': 10, 'node1': 10, 'node2': 10, 'node3': 10}]
+        for index, state in enumerate(states):
+            previous = states[index - 1] if index > 0 else {}
+            self.add_balance_state({node: v for node, v in state.items() if previous.get(node) != v}, index)
 
-    def write_to_disk(self):
+    def replay_journal(self, offset: int = 0):
         """
-        dump ledger contents to pickle on disk
+        Rebuild the ledger from the journal of block and rollback records. A torn record left at the end of the
+        journal by a crash is cut off.
+        :param offset: int. Where in the journal to start, the end of the records a snapshot already covers.
         :return: None
         """
-        # dump to pickle
-        ledger_string = 'Ledger: \n'
-        for entry in self.blockchain_balances:
-            #print(entry)
-            ledger_string += str(entry) + '\n'
+        journal = open(self.journal_path, 'r+b')
+        journal.seek(offset)
+        good_end = offset
+        while True:
+            try:
+                record = pickle.load(journal)
+            except (EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError, IndexError):
+                break
+            if record[0] == 'block':
+                if record[1] < len(self.block_changes):
+                    self.undo_to(record[1] - 1)
+                self.apply_balance_state(record[2], record[1])
+            else:
+                self.undo_to(record[1])
+            good_end = journal.tell()
+        journal.truncate(good_end)
+        journal.close()
 
-        text_file = open(self.file_path, "w")
-        text_file.write(ledger_string)
-        text_file.close()
+    def write_record(self, record: tuple):
+        """
+        Append a block or rollback record to the journal on disk
+        :param record: tuple.
+        :return: None
+        """
+        journal = open(self.journal_path, 'ab')
+        pickle.dump(record, journal)
+        journal.close()
 
-        pickle.dump(self.blockchain_balances, open(self.pickle_path, "wb"))
+    def append_to_text_file(self, line: str):
+        """
+        Append a line to the human readable ledger file
+        :param line: str.
+        :return: None
+        """
+        text_file = open(self.file_path, "a")
+        text_file.write(line + '\n')
+        text_file.close()
 
 
 if __name__ == '__main__':
@@ -153,11 +396,11 @@ if __name__ == '__main__':
                     Transaction(_to='node3', _from='node1', amount=0.5)]
     nodes = ['node0', 'node1', 'node2', 'node3']
     L = Ledger('0')
-    print(L.blockchain_balances)
+    print(L.blockchain_balances[-1])
     verify_boolean, change = L.verify_transaction(transactions, 1)
     if verify_boolean:
         L.add_balance_state(change[0], 1)
     for node in nodes:
         print('Balance: ', node, ': ', L.get_curr_balance_for_node(node))
-    print(L.blockchain_balances)
+    print(list(L.blockchain_balances))
     print("total currency: ", L.get_total_currency_in_chain())
\ No newline at end of file
@@ -0,0 +1,62 @@
+from Ledger import Ledger
+from VectorLedger import VectorLedger
+from Transaction import Transaction
+import os, random, shutil, sys, tempfile, time
+
+ACCOUNTS = 1000
+
+
+def make_transactions(count: int, seed: int) -> list:
+    """
+    Random transfers between ACCOUNTS accounts.
+
+    :return: list of Transaction objects.
+    """
+    rng = random.Random(seed)
+    return [Transaction(_to='acct' + str(rng.randrange(ACCOUNTS)), _from='acct' + str(rng.randrange(ACCOUNTS)),
+                        amount=round(rng.uniform(0, 2), 2)) for _ in range(count)]
+
+
+def time_verify(ledger_class, transactions: list, repeat: int):
+    """
+    Time ledger_class.verify_transaction() on a block of transactions, with every account starting at a balance of
+    100.
+
+    :return: tuple (best seconds of repeat runs, verify_transaction() result).
+    """
+    data_dir = tempfile.mkdtemp()
+    try:
+        ledger = ledger_class('bench', data_dir)
+        ledger.add_balance_state({'acct' + str(i): 100 for i in range(ACCOUNTS)}, 1)
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = ledger.verify_transaction(transactions, 2)
+            best = min(best, time.perf_counter() - start)
+        return best, result
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 10000, 100000]
+    results = []
+    stdout = sys.stdout
+    for size in sizes:
+        transactions = make_transactions(size, size)
+        repeat = max(3, 100000 // size)
+        sys.stdout = open(os.devnull, 'w')  # the ledgers print every overdraft they find
+        try:
+            loop_time, loop_result = time_verify(Ledger, transactions, repeat)
+            vector_time, vector_result = time_verify(VectorLedger, transactions, repeat)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if loop_result[0] != vector_result[0] or (not loop_result[0] and loop_result[1] != vector_result[1]) or \
+                (loop_result[0] and loop_result[1][0] != vector_result[1][0]):
+            raise AssertionError('ledgers disagree on a block of {} transactions'.format(size))
+        results.append((size, loop_time, vector_time, loop_result[0]))
+    print('block size | Ledger (ms) | VectorLedger (ms) | speedup | accepted')
+    for size, loop_time, vector_time, accepted in results:
+        print('{:>10} | {:>11.3f} | {:>17.3f} | {:>6.1f}x | {}'.format(size, loop_time * 1000, vector_time * 1000,
+                                                                       loop_time / vector_time, accepted))
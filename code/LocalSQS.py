@@ -0,0 +1,87 @@
+from threading import Condition
+import collections, itertools, time
+
+
+class LocalSQS:
+    """
+    In-process stand-in for the parts of the boto3 SQS client the Messenger uses, so the SQS transport can be run and
+    measured without AWS. Queues are created on first use and keyed by URL. A received message stays in flight until it
+    is deleted; unlike SQS it is never made visible again. Every call is counted in api_calls.
+
+    Methods
+    -------
+    send_message(QueueUrl, MessageBody, MessageAttributes, MessageGroupId)
+    send_message_batch(QueueUrl, Entries)
+    receive_message(QueueUrl, MaxNumberOfMessages, MessageAttributeNames, WaitTimeSeconds)
+    delete_message(QueueUrl, ReceiptHandle)
+    delete_message_batch(QueueUrl, Entries)
+    """
+
+    def __init__(self):
+        self.queues = collections.defaultdict(collections.deque)
+        self.in_flight = {}  # receipt handle -> message
+        self.receipts = itertools.count()
+        self.api_calls = collections.Counter()
+        self.condition = Condition()
+
+    def send_message(self, QueueUrl: str, MessageBody: str, MessageAttributes: dict = None, **kwargs) -> dict:
+        self.api_calls['send_message'] += 1
+        with self.condition:
+            self.queues[QueueUrl].append({'Body': MessageBody, 'MessageAttributes': MessageAttributes or {}})
+            self.condition.notify_all()
+        return {}
+
+    def send_message_batch(self, QueueUrl: str, Entries: list) -> dict:
+        self.api_calls['send_message_batch'] += 1
+        if len(Entries) > 10:
+            raise ValueError('at most 10 entries per batch')
+        with self.condition:
+            for entry in Entries:
+                self.queues[QueueUrl].append({
+                    'Body': entry['MessageBody'],
+                    'MessageAttributes': entry.get('MessageAttributes', {})
+                })
+            self.condition.notify_all()
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+    def receive_message(self, QueueUrl: str, MaxNumberOfMessages: int = 1, WaitTimeSeconds: int = 0,
+                        **kwargs) -> dict:
+        self.api_calls['receive_message'] += 1
+        deadline = time.time() + WaitTimeSeconds
+        with self.condition:
+            queue = self.queues[QueueUrl]
+            while not queue and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            messages = []
+            while queue and len(messages) < MaxNumberOfMessages:
+                message = dict(queue.popleft())
+                message['ReceiptHandle'] = str(next(self.receipts))
+                self.in_flight[message['ReceiptHandle']] = message
+                messages.append(message)
+        return {'Messages': messages} if messages else {}
+
+    def delete_message(self, QueueUrl: str, ReceiptHandle: str) -> dict:
+        self.api_calls['delete_message'] += 1
+        self.in_flight.pop(ReceiptHandle, None)
+        return {}
+
+    def delete_message_batch(self, QueueUrl: str, Entries: list) -> dict:
+        self.api_calls['delete_message_batch'] += 1
+        for entry in Entries:
+            self.in_flight.pop(entry['ReceiptHandle'], None)
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+
+if __name__ == '__main__':
+    from Messenger import SQSTransport
+    from TransactionGenerator import Tx_Generator
+    sqs = LocalSQS()
+    generator = Tx_Generator(sqs)
+    transport = SQSTransport('0', sqs=sqs, wait_seconds=1)
+    for i in range(100):
+        generator.send({'contents': generator.make_tx(), 'type': 'Transaction'}, '0')
+    generator.sender.flush()
+    received = []
+    while len(received) < 100:
+        received.extend(transport.receive())
+    print(len(received), 'transactions received using', dict(sqs.api_calls))
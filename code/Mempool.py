@@ -0,0 +1,162 @@
+from Transaction import Transaction
+import Codec
+import collections, threading
+
+
+class Mempool:
+    """
+    Transactions waiting to be mined, keyed by unique_id in arrival order, with an index of the transactions of every
+    sender. Adding, removing and membership checks are O(1), and a transaction received from several peers is only
+    kept once. When the pool is full the oldest transaction is evicted.
+
+    Attributes
+    ----------
+    max_size : int
+        most transactions kept at once
+    transactions : OrderedDict
+        unique_id -> Transaction, oldest first
+    by_sender : dict
+        from_node -> OrderedDict of unique_id -> Transaction, for the transactions of each sender
+    by_short_id : dict
+        first Codec.SHORT_ID_SIZE bytes of a raw unique_id -> Transaction, for rebuilding compact blocks
+    evicted : int
+        number of transactions evicted because the pool was full
+
+    Methods
+    -------
+    add(tx: Transaction)
+        add a transaction unless it is already in the pool
+    remove(unique_id: str)
+        remove a transaction by id
+    remove_transactions(transactions: list)
+        remove every transaction of a block, O(block size)
+    remove_ids(unique_ids: list)
+        remove transactions by id
+    from_sender(sender: str)
+        transactions of one sender, oldest first
+    get_short(short_id: bytes)
+        the transaction with a short id
+    """
+
+    def __init__(self, max_size: int = 10000):
+        """
+        Constructor for the Mempool.
+
+        :param max_size: int. Most transactions kept at once.
+        """
+        self.max_size = max_size
+        self.transactions = collections.OrderedDict()
+        self.by_sender = {}
+        self.by_short_id = {}
+        self.evicted = 0
+        self.lock = threading.Lock()  # the Messenger thread adds while the mining thread reads and removes
+
+    def add(self, tx: Transaction) -> bool:
+        """
+        Add a transaction unless it is already in the pool. Evicts the oldest transaction if the pool is full.
+
+        :param tx: Transaction.
+        :return: bool. True if the transaction was added.
+        """
+        with self.lock:
+            if tx.unique_id in self.transactions:
+                return False
+            self.transactions[tx.unique_id] = tx
+            self.by_sender.setdefault(tx.from_node, collections.OrderedDict())[tx.unique_id] = tx
+            self.by_short_id[Codec.short_id(tx.unique_id)] = tx
+            while len(self.transactions) > self.max_size:
+                self._remove(next(iter(self.transactions)))
+                self.evicted += 1
+            return True
+
+    def remove(self, unique_id: str):
+        """
+        Remove a transaction by id.
+
+        :param unique_id: str.
+        :return: Transaction or None if it was not in the pool.
+        """
+        with self.lock:
+            return self._remove(unique_id)
+
+    def _remove(self, unique_id: str):
+        tx = self.transactions.pop(unique_id, None)
+        if tx is not None:
+            sender_transactions = self.by_sender[tx.from_node]
+            del sender_transactions[unique_id]
+            if not sender_transactions:
+                del self.by_sender[tx.from_node]
+            short_id = Codec.short_id(unique_id)
+            if self.by_short_id.get(short_id) is tx:
+                del self.by_short_id[short_id]
+        return tx
+
+    def remove_transactions(self, transactions: list):
+        """
+        Remove every transaction in a list, typically the transactions of a block. O(len(transactions)).
+
+        :param transactions: list of Transaction objects.
+        :return: None
+        """
+        self.remove_ids([tx.unique_id for tx in transactions])
+
+    def remove_ids(self, unique_ids: list):
+        """
+        Remove every transaction with an id in a list.
+
+        :param unique_ids: list of str.
+        :return: None
+        """
+        with self.lock:
+            for unique_id in unique_ids:
+                self._remove(unique_id)
+
+    def from_sender(self, sender: str) -> list:
+        """
+        Returns the transactions of one sender, oldest first.
+
+        :param sender: str.
+        :return: list of Transaction objects.
+        """
+        with self.lock:
+            return list(self.by_sender.get(sender, {}).values())
+
+    def get_short(self, short_id: bytes):
+        """
+        Returns the transaction whose raw unique_id starts with short_id. Of two such transactions only the last added
+        is found, a block rebuilt with the wrong one fails its Merkle root check.
+
+        :param short_id: bytes.
+        :return: Transaction or None.
+        """
+        return self.by_short_id.get(short_id)
+
+    def __contains__(self, tx) -> bool:
+        """
+        Membership by Transaction or by unique_id.
+        """
+        unique_id = tx if isinstance(tx, str) else tx.unique_id
+        return unique_id in self.transactions
+
+    def __iter__(self):
+        """
+        Iterates over a snapshot of the pool, oldest first.
+        """
+        with self.lock:
+            return iter(list(self.transactions.values()))
+
+    def __len__(self) -> int:
+        return len(self.transactions)
+
+    def __str__(self) -> str:
+        return str([str(tx) for tx in self])
+
+
+if __name__ == '__main__':
+    pool = Mempool(max_size=3)
+    txs = [Transaction(_to='node1', _from='node' + str(i % 2 + 2), amount=0.5) for i in range(4)]
+    for tx in txs + txs[2:]:  # the last two arrive twice
+        pool.add(tx)
+    print(len(pool), 'transactions kept,', pool.evicted, 'evicted, first one still there:', txs[0] in pool)
+    pool.remove_transactions(txs[1:3])
+    print('left:', [tx.unique_id[:6] for tx in pool], 'from node3:', len(pool.from_sender('node3')))
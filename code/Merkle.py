@@ -0,0 +1,100 @@
+"""
+Merkle trees over transaction ids.
+
+The leaves are sha256(0x00 + id) of the raw 32 byte unique_ids of a block's transactions, in block order. Each level
+pairs neighbouring nodes and hashes sha256(0x01 + left + right); an odd node at the end of a level is carried up
+unchanged rather than paired with a copy of itself. Leaves and inner nodes hash under different prefixes, so an inner
+node is never accepted as a transaction id and two different transaction lists never share a root. The root of no
+transactions is 32 zero bytes.
+
+An inclusion proof lists, from the leaf up, the sibling of every node on the path to the root together with the side
+it is on. A light consumer holding a transaction, its block header and a proof can check the transaction is in the
+block without the other transactions.
+"""
+import hashlib
+
+EMPTY_ROOT = bytes(32)
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'  # inner nodes are never the same bytes as a leaf
+LEFT, RIGHT = 'L', 'R'  # side of the sibling in a proof step
+
+
+def hash_leaf(unique_id: bytes) -> bytes:
+    return hashlib.sha256(LEAF_PREFIX + unique_id).digest()
+
+
+def hash_pair(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def next_level(level: list) -> list:
+    """
+    :param level: list of bytes.
+    :return: list of bytes. The level above, half the size rounded up.
+    """
+    parents = [hash_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        parents.append(level[-1])
+    return parents
+
+
+def merkle_root(leaves: list) -> bytes:
+    """
+    :param leaves: list of bytes. Raw 32 byte transaction ids.
+    :return: bytes.
+    """
+    if not leaves:
+        return EMPTY_ROOT
+    level = [hash_leaf(leaf) for leaf in leaves]
+    while len(level) > 1:
+        level = next_level(level)
+    return level[0]
+
+
+def merkle_proof(leaves: list, position: int) -> list:
+    """
+    :param leaves: list of bytes. Raw 32 byte transaction ids.
+    :param position: int. Position of the leaf to prove.
+    :return: list of [side, sibling hash as hex] pairs, from the leaf up. Plain lists and strings, so a proof can be
+    sent as JSON.
+    """
+    proof = []
+    level = [hash_leaf(leaf) for leaf in leaves]
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append([LEFT if sibling < position else RIGHT, level[sibling].hex()])
+        level = next_level(level)
+        position //= 2
+    return proof
+
+
+def verify_proof(unique_id: str, proof: list, root) -> bool:
+    """
+    Checks that the transaction with unique_id is a leaf of the tree with the given root.
+
+    :param unique_id: str. Hex transaction id.
+    :param proof: list. As returned by merkle_proof().
+    :param root: str or bytes. Merkle root, hex or raw.
+    :return: bool.
+    """
+    try:
+        node = hash_leaf(bytes.fromhex(unique_id))
+        for side, sibling in proof:
+            sibling = bytes.fromhex(sibling)
+            node = hash_pair(sibling, node) if side == LEFT else hash_pair(node, sibling)
+        return node == (bytes.fromhex(root) if isinstance(root, str) else root)
+    except (TypeError, ValueError):
+        return False
+
+
+if __name__ == '__main__':
+    ids = [hashlib.sha256(str(i).encode()).digest() for i in range(5)]
+    root = merkle_root(ids)
+    print('root:', root.hex())
+    for i, leaf in enumerate(ids):
+        p = merkle_proof(ids, i)
+        print(i, len(p), 'steps, verified:', verify_proof(leaf.hex(), p, root))
+    print('wrong leaf verified:', verify_proof(ids[0].hex(), merkle_proof(ids, 1), root))
+    inner = hash_pair(hash_leaf(ids[0]), hash_leaf(ids[1]))
+    print('inner node verified as a leaf:', verify_proof(inner.hex(), merkle_proof(ids, 0)[1:], root))
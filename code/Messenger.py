@@ -1,7 +1,8 @@
-from time import sleep, clock
+from time import sleep, time
 from datetime import datetime
-from threading import Thread
-import boto3, botocore
+from threading import Thread, Condition
+from Transport import Transport
+from SeenCache import SeenCache
 
 message_queue_URLs = {
 	'0': 'https://sqs.us-east-1.amazonaws.com/000000000000/0.fifo',
@@ -10,37 +11,245 @@ message_queue_URLs = {
 	'3': 'https://sqs.us-east-1.amazonaws.com/000000000000/3.fifo',
 	}
 
+MAX_BATCH = 10  # most messages SQS accepts in one receive or batch call
+MAX_BATCH_BYTES = 256 * 1024  # most bytes of message bodies and attributes SQS accepts in one batch call
+SEND_ATTEMPTS = 3  # tries of a batch call before its messages are given up
+DEDUPE_TYPES = ('Transaction', 'Block', 'CompactBlock')  # requests and replies may legitimately repeat
+
+def format_for_SQS(message:dict) -> dict:
+	SQSmsg = {}
+	for key, value in message.items():
+		if isinstance(value, bytes):
+			SQSmsg[key] = {
+				'DataType': 'Binary',
+				'BinaryValue': value
+				}
+		else:
+			SQSmsg[key] = {
+				'DataType': 'String',
+				'StringValue': value
+				}
+	return SQSmsg
+
+def entry_size(entry: dict) -> int:
+	'''bytes a batch entry counts towards MAX_BATCH_BYTES: its body, attribute names, types and values'''
+	size = len(entry['MessageBody'].encode())
+	for key, value in entry['MessageAttributes'].items():
+		data = value['BinaryValue'] if 'BinaryValue' in value else value['StringValue'].encode()
+		size += len(key.encode()) + len(value['DataType']) + len(data)
+	return size
+
+def reduce_message(SQSmessage:dict) -> dict:
+	msg = {}
+	for key, value in SQSmessage.items():
+		msg[key] = value['BinaryValue'] if 'BinaryValue' in value else value['StringValue']
+	return msg
+
+class SQSBatchSender:
+	"""
+	Coalesces outgoing messages per destination queue and sends them with
+	send_message_batch. A destination's buffer is flushed as soon as it
+	holds MAX_BATCH messages, before it would go over MAX_BATCH_BYTES, or
+	max_delay seconds after its oldest message was buffered, by a background
+	flush thread. A batch call that raises, or messages SQS reports failed
+	through no fault of the sender, are tried again up to SEND_ATTEMPTS
+	times, so a throttled or dropped call does not lose the batch or stop
+	the flush thread.
+
+	methods:
+		send(message: dict, destination: str) : buffer a message
+		flush() : send everything buffered now
+	"""
+
+	def __init__(self, sqs, queue_URLs: dict, sender: str, max_delay: float=0.05):
+		self.sqs = sqs
+		self.queue_URLs = queue_URLs
+		self.sender = sender
+		self.max_delay = max_delay
+		self.msg_count = 0
+		self.buffers = {} # destination -> list of (time buffered, batch entry)
+		self.buffer_bytes = {} # destination -> entry_size() of its buffer
+		self.condition = Condition()
+		self.flush_thread = Thread(
+			target=self.flush_when_due,
+			name=('SQS Flush Thread'+sender),
+			daemon=True
+			)
+		self.flush_thread.start()
+
+	def send(self, message: dict, destination: str):
+		with self.condition:
+			# used to uniquely identify messages:
+			self.msg_count += 1
+			# included to ensure all messages have a different non-duplication hash:
+			timestamp = str(datetime.now())
+			entry = {
+				'Id': str(self.msg_count),
+				'MessageBody': 'Message # {} from {}. {}'.format(self.msg_count, self.sender, timestamp),
+				'MessageAttributes': format_for_SQS(message),
+				'MessageGroupId': 'queue'
+			}
+			size = entry_size(entry)
+			batches = []
+			if self.buffer_bytes.get(destination, 0) + size > MAX_BATCH_BYTES and destination in self.buffers:
+				batches.append(self.take(destination))
+			buffer = self.buffers.setdefault(destination, [])
+			buffer.append((time(), entry))
+			self.buffer_bytes[destination] = self.buffer_bytes.get(destination, 0) + size
+			if len(buffer) >= MAX_BATCH:
+				batches.append(self.take(destination))
+			else:
+				self.condition.notify()
+		for batch in batches:
+			self.send_batch(destination, batch)
+
+	def take(self, destination: str) -> list:
+		'''removes and returns a destination's buffer, called with the condition held'''
+		del self.buffer_bytes[destination]
+		return self.buffers.pop(destination)
+
+	def flush_when_due(self):
+		"""flush thread: sends each buffer max_delay seconds after its oldest message"""
+		while True:
+			with self.condition:
+				while not self.buffers:
+					self.condition.wait()
+				due = min(buffer[0][0] for buffer in self.buffers.values()) + self.max_delay
+				if time() < due:
+					self.condition.wait(due - time())
+					continue
+				now = time()
+				batches = [(destination, self.take(destination))
+					for destination in list(self.buffers)
+					if self.buffers[destination][0][0] + self.max_delay <= now]
+			for destination, batch in batches:
+				self.send_batch(destination, batch)
+
+	def flush(self):
+		with self.condition:
+			batches = list(self.buffers.items())
+			self.buffers = {}
+			self.buffer_bytes = {}
+		for destination, batch in batches:
+			self.send_batch(destination, batch)
+
+	def send_batch(self, destination: str, batch: list):
+		entries = [entry for _, entry in batch]
+		for attempt in range(SEND_ATTEMPTS):
+			if attempt > 0:
+				sleep(0.1 * 2 ** attempt)  # back off, the call may have been throttled
+			try:
+				response = self.sqs.send_message_batch(
+					QueueUrl=self.queue_URLs[destination],
+					Entries=entries
+				)
+			except Exception as e:  # boto raises ClientError or a connection error, keep the flush thread alive
+				print('batch to {} failed: {}'.format(destination, repr(e)))
+				continue
+			failed = {failure['Id']: failure for failure in response.get('Failed', [])}
+			for failure in failed.values():
+				if failure.get('SenderFault', True):
+					print('message to {} not sent: {}'.format(destination, failure.get('Message', failure)))
+			entries = [entry for entry in entries
+				if entry['Id'] in failed and not failed[entry['Id']].get('SenderFault', True)]
+			if not entries:
+				return
+		print('{} messages to {} given up after {} attempts'.format(len(entries), destination, SEND_ATTEMPTS))
+
+class SQSTransport(Transport):
+	"""
+	Transport over the hardcoded SQS queues. Every node receives from its
+	own queue and sends to the queues of its peers. Receives long poll for
+	up to MAX_BATCH messages at a time and delete them in one batch call;
+	sends are coalesced by an SQSBatchSender.
+	"""
+
+	def __init__(self, id: str, sqs=None, wait_seconds: int=20, max_delay: float=0.05):
+		"""
+		sqs is the client to use, a boto3 SQS client by default (LocalSQS
+		works too). wait_seconds is the long polling time of a receive call,
+		max_delay how long an outgoing message may wait to fill a batch.
+		"""
+		if sqs is None:
+			import boto3  # only needed when messages actually go through SQS
+			sqs = boto3.client('sqs') # make a new SQS object
+		self.id = id
+		self.sqs = sqs
+		self.wait_seconds = wait_seconds
+		self.incoming_queue_URL = message_queue_URLs[self.id] # store URL of queue for self
+		self.sender = SQSBatchSender(sqs, message_queue_URLs, id, max_delay)
+
+	def receive(self, timeout: float = 0.1) -> list:
+		# response stores results of receive call from SQS, waits until a message arrives or wait_seconds pass
+		response = self.sqs.receive_message(
+			QueueUrl=self.incoming_queue_URL,
+			MaxNumberOfMessages=MAX_BATCH,
+			MessageAttributeNames=['All'],
+			WaitTimeSeconds=self.wait_seconds
+		)
+
+		# check if a message was received. if no message, try again
+		if not response.get('Messages'):
+			return []
+
+		messages = response['Messages']
+
+		# receipt handles are required to delete the messages from queue, delete them after receiving
+		delete_response = self.sqs.delete_message_batch(
+			QueueUrl=self.incoming_queue_URL,
+			Entries=[{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+				for i, message in enumerate(messages)]
+		)
+		for failure in delete_response.get('Failed', []):
+			print("Receipt Handle Expired")
+		# print('\n',self.id,' Received and deleted messages : \n\"{}\"'.format(messages))
+		return [reduce_message(message['MessageAttributes']) for message in messages]
+
+	def send(self, message: dict, destination: str):
+		self.sender.send(message, destination)
+
+	def close(self):
+		self.sender.flush()
+
 class Messenger:
 	"""
-	This class is a generic message handler using hardcoded SQS queues to 
-	communicate with other nodes. The nodes accessible using this class are  
-	'0', '1', '2', '3'
+	This class is a generic message handler. Messages travel over a
+	Transport, by default the hardcoded SQS queues; a SocketTransport
+	connects nodes directly over TCP or Unix domain sockets instead.
+	The nodes accessible using SQS are '0', '1', '2', '3'
+	With a SeenCache, transactions and blocks delivered more than once are
+	dropped before they reach the target, and so before they are parsed.
 	** This class requires the handle_incoming_message(message) interface **
 
 	methods:
-		__init__(id, target) : constructor
+		__init__(id, target, run, transport, seen, listen) : constructor
 		start_incoming_message_thread() : starts a 'receive message' thread
 		listen_for_messages() : receive messages, pass to parent target
+		is_duplicate(msg: dict) : whether the SeenCache saw a message before
 
-		send(message: dict, destination: str) : <-must be formatted correctly for SQS
+		send(message: dict, destination: str) : <-values must be str or bytes
 	"""
 
-	def __init__(self, id: str, target, run: bool=True):
+	def __init__(self, id: str, target, run: bool=True, transport: Transport=None, seen: SeenCache=None,
+			listen: bool=True):
 		"""
 		Messenger constructor. Takes id from list
 		'0', '1', '2', '3'.
 		Constructor must be passed a reference to the class that is using it.
 		That class must implement handle_incoming_message(message: dict)
+		Messages go through SQS unless another transport is given.
+		Duplicates are only dropped if a SeenCache is given.
+		Without listen no thread is started, the owner starts it or
+		receives from the transport itself.
 		"""
 		self.id = id #id of self in system
 		self.run = run
-		self.sqs = boto3.client('sqs') # make a new SQS object
-		self.incoming_queue_URL = message_queue_URLs[self.id] # store URL of queue for self
+		self.transport = transport if transport is not None else SQSTransport(id)
 		self.target = target    # store class that is using this messenger
+		self.seen = seen
 
-		# start a thread to pull incoming messages from queue
-		self.incoming_message_thread = self.start_incoming_message_thread()
-		self.msg_count = 0
+		# start a thread to pull incoming messages from the transport
+		self.incoming_message_thread = self.start_incoming_message_thread() if listen else None
 
 	def start_incoming_message_thread(self):
 		"""this method threads @listen_for_messages()"""
@@ -59,7 +268,7 @@ class Messenger:
 		self.run = True
 
 	def listen_for_messages(self):
-		''' loop that pulls messages from given SQS queue
+		''' loop that pulls messages from the transport
 
 		messages attributes are kept in dictionary form and represent the
 		message intended to be received. Messages are then passed to the
@@ -67,75 +276,25 @@ class Messenger:
 		'''
 		while True:
 			while self.run:
-				# response stores results of receive call from SQS
-				response = self.sqs.receive_message(
-					QueueUrl=self.incoming_queue_URL,
-					MaxNumberOfMessages=1,
-					MessageAttributeNames=['All'],
-					WaitTimeSeconds=0
-				)
-
-				# check if a message was received. if no message, try again
-				if 'Messages' not in response:
-					continue
-				else:
-					message = response['Messages'][0]['MessageAttributes']
-
-				# this receipt handle is required to delete the  message from queue
-				receipt_handle = response['Messages'][0]['ReceiptHandle']
-				# delete the message after receiving
-				try:
-					self.sqs.delete_message(
-						QueueUrl=self.incoming_queue_URL,
-						ReceiptHandle=receipt_handle
-					)
-				except botocore.exceptions.ClientError:
-					print("Receipt Handle Expired")
-				# print('\n',self.id,' Received and deleted message : \n\"{}\"'.format(message))
-
 				# this calls on the holding class to handle the messages,
+				for msg in self.transport.receive():
+					if not self.is_duplicate(msg):  # drop repeats unparsed
+						self.target.handle_incoming_message(msg)
+			sleep(0.1)
 
-				msg = self.reduce_message(message)
-
-				self.target.handle_incoming_message(msg)
-
-
-	def reduce_message(self, SQSmessage:dict) -> dict:
-		msg = {}
-		for key, value in SQSmessage.items():
-			msg[key] = value['StringValue']
-		return msg
-
-	def format_for_SQS(self, message:dict) -> dict:
-		SQSmsg = {}
-		for key, value in message.items():
-			SQSmsg[key] = {
-				'DataType': 'String',
-				'StringValue': value
-				}
-		return SQSmsg
+	def is_duplicate(self, msg: dict) -> bool:
+		'''
+		records a received message in the SeenCache, True if it was
+		delivered before. Only transactions and blocks are checked.
+		'''
+		return self.seen is not None and msg.get('type') in DEDUPE_TYPES and \
+			self.seen.check(msg['type'], msg['contents'])
 
 	def send(self, message: dict, destination: str):
 		'''
-		send a message to the given destination queue.
-		destination string should exist in the queue_suffixes list.
+		send a message to the given destination node.
 		'''
-		# used to uniquely identify messages:
-		self.msg_count += 1
-		# included to ensure all messages have a different non-duplication hash:
-		timestamp = str(datetime.now())
-
-		message_body = 'Message # {} from {}. {}'.format(self.msg_count, self.id, timestamp)
-		#print("message from {} to {}: ".format(self.id, destination), message)
-		SQSmsg = self.format_for_SQS(message)
-
-		# response stores confirmation data from SQS
-		response = self.sqs.send_message(
-			QueueUrl=message_queue_URLs[destination],
-			MessageAttributes=SQSmsg,
-			MessageGroupId='queue',
-			MessageBody=message_body
-		)
+		self.transport.send(message, destination)
 
 
 if __name__ == '__main__':
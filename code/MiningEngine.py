@@ -0,0 +1,211 @@
+import hashlib, multiprocessing, queue
+
+
+class MiningEngine:
+    """
+    Searches the nonce space of a block for a hash that meets the hash difficulty. The part of the block that does not
+    change between attempts is hashed once; every attempt copies that precomputed SHA-256 state and only hashes the
+    short nonce tail, so the hash rate does not depend on how many transactions the block holds.
+
+    Attributes
+    ----------
+    hash_difficulty : str
+        64 char hexadecimal hash, a mined hash must compare less than or equal to it
+    check_interval : int
+        number of nonces tried between checks of the stop condition
+    verbose : bool
+        print a progress line every 5000 attempts
+
+    Methods
+    -------
+    mine(prefix: bytes, nonce_tail, start_nonce: int, step: int, should_stop)
+        search nonces start_nonce, start_nonce + step, ... until a winning hash is found or should_stop() is True
+    shutdown()
+        release resources held by the engine, nothing to do for the single threaded search
+    """
+
+    def __init__(self, hash_difficulty: str, check_interval: int = 1000, verbose: bool = True):
+        """
+        Constructor for the MiningEngine.
+
+        :param hash_difficulty: str. 64 char hexadecimal hash representing the difficulty target.
+        :param check_interval: int. How many nonces to try between checks of the stop condition.
+        :param verbose: bool. Print a progress line every 5000 attempts, like the original mining loop.
+        """
+        self.hash_difficulty = hash_difficulty
+        self.check_interval = check_interval
+        self.verbose = verbose
+
+    def mine(self, prefix: bytes, nonce_tail, start_nonce: int = 0, step: int = 1, should_stop=lambda: False):
+        """
+        Search for a nonce whose hash meets the difficulty.
+
+        :param prefix: bytes. Block bytes hashed ahead of the nonce (Block.hash_prefix()).
+        :param nonce_tail: function. Maps a nonce to the bytes hashed after the prefix (Block.nonce_tail()).
+        :param start_nonce: int. First nonce to try.
+        :param step: int. Distance between nonces tried, used to split the nonce space between workers.
+        :param should_stop: function. Polled every check_interval attempts, the search is abandoned when it returns True.
+        :return: tuple (nonce, hash) of the winning nonce, or None if the search was stopped.
+        """
+        midstate = hashlib.sha256(prefix)
+        hash_difficulty = self.hash_difficulty
+        nonce = start_nonce
+        attempts = 0
+        while True:
+            for _ in range(self.check_interval):
+                sha = midstate.copy()
+                sha.update(nonce_tail(nonce))
+                _hash = sha.hexdigest()
+                if _hash <= hash_difficulty:
+                    return nonce, _hash
+                nonce += step
+            attempts += self.check_interval
+            if self.verbose and attempts % 5000 == 0:
+                print('Computing Hash: ', _hash[:10], '...')  # Show every 5000th hash to show functionality
+            if should_stop():
+                return None
+
+    def shutdown(self):
+        """
+        Release resources held by the engine. The single threaded search holds none.
+
+        :return: None
+        """
+        pass
+
+
+def _mining_worker(job_queue, result_queue, generation, hash_difficulty: str, check_interval: int):
+    """
+    Body of a ParallelMiningEngine worker process. Takes search jobs off its job queue and reports winning nonces on the
+    shared result queue. A job is abandoned as soon as the shared generation counter no longer matches its id.
+
+    :return: None
+    """
+    engine = MiningEngine(hash_difficulty, check_interval, verbose=False)
+    while True:
+        job = job_queue.get()
+        if job is None:  # shutdown request
+            return
+        job_id, prefix, nonce_tail, start_nonce, step = job
+        result = engine.mine(prefix, nonce_tail, start_nonce, step, should_stop=lambda: generation.value != job_id)
+        if result:
+            result_queue.put((job_id,) + result)
+
+
+class ParallelMiningEngine:
+    """
+    Splits the nonce search across a set of worker processes so a node can use more than one core. Worker i of n tries
+    nonces start + i, start + i + n, start + i + 2n, ... The first winning nonce cancels the other workers, as does the
+    should_stop condition, which is polled every poll_interval seconds. Workers are started once and reused for
+    every block.
+
+    Attributes
+    ----------
+    hash_difficulty : str
+        64 char hexadecimal hash, a mined hash must compare less than or equal to it
+    workers : int
+        number of worker processes
+    poll_interval : float
+        seconds between checks of the stop condition while workers are searching
+
+    Methods
+    -------
+    mine(prefix: bytes, nonce_tail, start_nonce: int, step: int, should_stop)
+        same contract as MiningEngine.mine(), the search is spread over all workers
+    shutdown()
+        stop the worker processes
+    """
+
+    def __init__(self, hash_difficulty: str, workers: int = 0, check_interval: int = 1000,
+                 poll_interval: float = 0.001):
+        """
+        Constructor for the ParallelMiningEngine. Starts the worker processes.
+
+        :param hash_difficulty: str. 64 char hexadecimal hash representing the difficulty target.
+        :param workers: int. Number of worker processes, 0 uses one per core.
+        :param check_interval: int. How many nonces a worker tries between checks for cancellation.
+        :param poll_interval: float. Seconds between checks of the should_stop condition.
+        """
+        self.hash_difficulty = hash_difficulty
+        self.workers = workers or multiprocessing.cpu_count()
+        self.poll_interval = poll_interval
+        self.job_id = 0
+        # id of the job workers should be searching for, any other value cancels the search in progress
+        self.generation = multiprocessing.RawValue('l', 0)
+        self.result_queue = multiprocessing.Queue()
+        self.job_queues = [multiprocessing.Queue() for _ in range(self.workers)]
+        self.processes = []
+        for i, job_queue in enumerate(self.job_queues):
+            p = multiprocessing.Process(
+                target=_mining_worker,
+                args=(job_queue, self.result_queue, self.generation, hash_difficulty, check_interval),
+                name='Mining Worker ' + str(i),
+                daemon=True
+            )
+            p.start()
+            self.processes.append(p)
+
+    def mine(self, prefix: bytes, nonce_tail, start_nonce: int = 0, step: int = 1, should_stop=lambda: False):
+        """
+        Search for a nonce whose hash meets the difficulty using every worker process.
+
+        :param prefix: bytes. Block bytes hashed ahead of the nonce (Block.hash_prefix()).
+        :param nonce_tail: function. Module level function mapping a nonce to the bytes hashed after the prefix.
+        :param start_nonce: int. First nonce to try.
+        :param step: int. Distance between nonces tried.
+        :param should_stop: function. Polled every poll_interval seconds, the search is cancelled when it returns True.
+        :return: tuple (nonce, hash) of the winning nonce, or None if the search was stopped.
+        """
+        self.job_id += 1
+        job_id = self.job_id
+        self.generation.value = job_id
+        for i, job_queue in enumerate(self.job_queues):
+            job_queue.put((job_id, prefix, nonce_tail, start_nonce + i * step, step * self.workers))
+        try:
+            while True:
+                try:
+                    result = self.result_queue.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    if should_stop():
+                        return None
+                    continue
+                if result[0] == job_id:  # results of earlier, cancelled jobs are discarded
+                    return result[1], result[2]
+        finally:
+            self.generation.value = 0  # cancel all workers still searching
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+
+        :return: None
+        """
+        self.generation.value = 0
+        for job_queue in self.job_queues:
+            job_queue.put(None)
+        for p in self.processes:
+            p.join(timeout=1)
+
+
+if __name__ == '__main__':
+    from Block import Block, MIDSTATE_VERSION
+    from Transaction import Transaction
+    import datetime, time
+
+    engine = MiningEngine('0000' + 'f' * 60, verbose=False)
+    parallel_engine = ParallelMiningEngine('00000' + 'f' * 59)
+    for tx_count in [0, 10, 1000]:
+        b = Block(prevHash='0' * 64, timestamp=str(datetime.datetime.now()), index=1, version=MIDSTATE_VERSION,
+                  transactions=[Transaction(_to='node1', _from='node2', amount=0.5) for _ in range(tx_count)])
+        start = time.perf_counter()
+        b.nonce, b.hash = engine.mine(b.hash_prefix(), b.nonce_tail())
+        elapsed = time.perf_counter() - start
+        print(tx_count, 'transactions:', round((b.nonce + 1) / elapsed), 'hashes/sec, verified:',
+              Block(str(b)).verify_proof_of_work())
+        start = time.perf_counter()
+        b.nonce, b.hash = parallel_engine.mine(b.hash_prefix(), b.nonce_tail())
+        print('\t', parallel_engine.workers, 'workers found nonce', b.nonce, 'in', round(time.perf_counter() - start, 3),
+              'seconds, verified:', Block(str(b)).verify_proof_of_work())
+    # cancellation: a search that cannot succeed is stopped by should_stop
+    print('cancelled search returned', parallel_engine.mine(b'x', b.nonce_tail(), should_stop=lambda: True))
+    parallel_engine.shutdown()
@@ -2,9 +2,19 @@ from Ledger import *
 from Transaction import Transaction
 from Ledger import Ledger
 from BlockChain import BlockChain
-from Block import Block
+from Block import Block, MERKLE_VERSION
+from MiningEngine import MiningEngine, ParallelMiningEngine
+from Mempool import Mempool
+from BlockTemplate import BlockTemplate
 from Messenger import Messenger
-from threading import Thread, enumerate
+from SeenCache import SeenCache
+from ValidationPipeline import ValidationPipeline
+from ChainSync import ChainSync, MESSAGE_TYPES as SYNC_MESSAGE_TYPES
+from Relay import Relay, MESSAGE_TYPES as RELAY_MESSAGE_TYPES
+from CompactRelay import CompactRelay, MESSAGE_TYPES as COMPACT_MESSAGE_TYPES
+from Transport import SocketTransport
+from QueryServer import QueryServer
+from threading import Thread, Condition, enumerate
 from time import sleep
 import datetime, json, hashlib, copy, collections, sys, random
 
@@ -21,6 +31,9 @@ class Node:
         indicates hash difficulty for mining blocks, integer represents number of leading 0s required
     hash_difficulty : str
         reference for hash difficulty as represented by a 64 char hexadecimal hash
+    mining_engine : MiningEngine or ParallelMiningEngine
+        nonce search used by hash_block(), hashes the fixed part of a block only once per block. With more than one
+        mining worker the nonce space is split across that many processes.
     node_id : str
         name of node (in this case '0', '1', '2', or '3'
     ledger : Ledger
@@ -28,56 +41,165 @@ class Node:
     blockchain : BlockChain
         this is the node's copy of the blockchain for reference and updating
     messenger : Messenger
-        a messaging layer used by the node to send and receive blocks and transactions from other miners
+        a messaging layer used by the node to send and receive blocks and transactions from other miners. Its
+        SeenCache drops transactions and blocks delivered more than once before they are parsed.
     peers : list
         a list of peer nodes, members of the BlockChain network
-    transaction_queue : list
-        a list of incoming transactions to be mined into a block
+    transaction_queue : Mempool
+        incoming transactions to be mined into a block, indexed by unique_id and deduplicated
+    block_template : BlockTemplate
+        chooses a bounded set of valid transactions from the queue for each new block
     reset_mine_function : bool
         flag for when a new block is discovered, when true node resets flag and begins mining on new block instead
     stop_mine_function : bool
         flag for stopping the mining thread
+    transactions_received : int
+        number of transactions queued, the mining thread waits for it to change when no queued transaction fits a block
+    work_available : Condition
+        the idle mining thread waits on it, notified when a transaction or block arrives or mining is stopped. The
+        validation pipeline waits on it for room in received_blocks.
+    validation : ValidationPipeline
+        decodes and checks received blocks in parallel before they reach received_blocks
+    sync : ChainSync
+        catches the node up with a longer chain of its peers, headers first, and answers their sync requests
+    relay : Relay
+        announces new blocks and transactions to a few peers and fetches the ones peers announce, None to send them
+        in full to every peer
+    compact : CompactRelay
+        sends blocks as their header and short transaction ids and rebuilds received ones from the mempool, None to
+        send blocks in full
+    query_server : QueryServer
+        local HTTP endpoint for balance, transaction and account history queries, None unless a query port is given
     mine_thread : thread
         a stored reference to the mining thread for accessing the thread if necessary
 
     Methods
     -------
+    start()
+        starts receiving messages, mining and chain sync, called by the constructor
     start_mining_thread()
         Starts the thread that continually mines new blocks to add to the chain.
+    stop()
+        Stops the mining thread.
     handle_incoming_message()
         interface required for the Messenger class, handles incoming messages from the Messenger class.
+    queue_transaction(tx: Transaction)
+        adds a received transaction to the queue and wakes the miner
+    receive_block(incoming_block: Block)
+        queues a block that passed the validation pipeline for the mining thread
     mining_thread()
         continually mines new blocks on current blockchain, resets function when new block received
+    next_template()
+        chooses the transactions of the next block to mine
+    add_mined_block(new_block: Block, change: dict)
+        adds a newly mined block to the ledger and chain and sends it to the peers
     hash_block()
         the actual function that generates a hash for a new block to add to the blockchain
-    send_block(block: str)
-        sends newly mined blocks to all peers
+    encode(item)
+        serializes a Block or Transaction for sending in the node's wire format
+    decode_transaction(contents)
+        builds a Transaction from received binary or JSON contents
+    send_msg(contents, type: str)
+        sends a message to all peers
+    send_to(peer: str, contents, type: str)
+        sends a message to one peer
 
     """
 
-    def __init__(self, node_id: str):
+    def __init__(self, node_id: str, mining_workers: int = 1, mempool_size: int = 10000,
+                 max_block_transactions: int = 1000, max_block_bytes: int = None, transport=None,
+                 wire_format: str = 'binary', vector_ledger: bool = False, validation_workers: int = 0,
+                 max_received_blocks: int = 64, query_port: int = None, peers: list = None,
+                 data_dir: str = '../files', difficulty: int = 5, initial_balances: dict = None,
+                 relay_fanout: int = None, compact_blocks: bool = False, seen_messages: int = 100000,
+                 seen_bloom: bool = False):
         """
         Constructor for the Node class.
 
         :param str node_id: one of '0', '1', '2', or '3', the possible nodes in network
+        :param int mining_workers: number of processes searching for nonces. 1 mines in the mining thread itself.
+        :param int mempool_size: most transactions kept waiting to be mined, the oldest are evicted beyond that
+        :param int max_block_transactions: most transactions mined into one block
+        :param int max_block_bytes: most bytes of transactions mined into one block, counted in wire_format, None for
+        no limit
+        :param Transport transport: medium messages travel over, None for the SQS queues
+        :param str wire_format: 'binary' sends blocks and transactions in the compact binary format, 'json' as JSON.
+        Both formats are accepted on receipt.
+        :param bool vector_ledger: apply blocks to the ledger with NumPy (see VectorLedger), requires numpy
+        :param int validation_workers: processes checking received blocks ahead of the chain, 0 checks them in a
+        single thread of the validation pipeline
+        :param int max_received_blocks: most received blocks waiting in each stage of the validation pipeline and for
+        the chain
+        :param int query_port: local port to answer JSON queries on (see QueryServer), None for no query endpoint
+        :param list peers: ids of the nodes blocks and transactions are sent to, None for the other nodes of '0' to '3'
+        :param str data_dir: directory the chain, ledger and index files are kept in
+        :param int difficulty: number of leading zeros required of a block hash
+        :param dict initial_balances: balances of the genesis block for a new ledger, None for the default accounts
+        :param int relay_fanout: number of peers new blocks and transactions are announced to and relayed through (see
+        Relay), None to send them in full to every peer without relaying
+        :param bool compact_blocks: send blocks as compact blocks that peers rebuild from their mempool (see
+        CompactRelay)
+        :param int seen_messages: most received transactions and blocks remembered to drop duplicates unparsed, 0 to
+        keep none
+        :param bool seen_bloom: remember them in Bloom filters, fixed memory for very high volume (see SeenCache)
         """
         ##############################################
-        self.difficulty = 5
+        self.difficulty = difficulty
         _max = 'f' * 64
         self.hash_difficulty = _max.replace('f', '0', self.difficulty)
+        if mining_workers > 1:
+            self.mining_engine = ParallelMiningEngine(self.hash_difficulty, mining_workers)
+        else:
+            self.mining_engine = MiningEngine(self.hash_difficulty)
 
         self.node_id = node_id
-        self.file_path = '../files/blockchain' + node_id + '.txt'
-        self.ledger = Ledger(node_id)
-        self.blockchain = BlockChain(self.node_id, self.ledger)
+        self.wire_format = wire_format
+        if vector_ledger:
+            from VectorLedger import VectorLedger  # numpy is only needed in this mode
+            self.ledger = VectorLedger(node_id, data_dir, initial_balances)
+        else:
+            self.ledger = Ledger(node_id, data_dir, initial_balances)
+        self.blockchain = BlockChain(self.node_id, self.ledger, data_dir, difficulty=difficulty)
+        self.block_template = BlockTemplate(self.ledger, max_block_transactions, max_block_bytes, wire_format)
 
-        self.messenger = Messenger(self.node_id, self)
-        self.peers = [peer for peer in ['0', '1', '2', '3'] if peer != self.node_id]
-        self.transaction_queue = []
+        if peers is None:
+            peers = ['0', '1', '2', '3']
+        self.peers = [peer for peer in peers if peer != self.node_id]
+        self.transaction_queue = Mempool(mempool_size)
         self.reset_mine_function = False
         self.stop_mine_function = False
         self.received_blocks = collections.deque()  # d.append() to add, d.popleft() to remove as queue
+        self.max_received_blocks = max_received_blocks
+        self.transactions_received = 0
+        self.work_available = Condition()
+        self.validation = self.create_validation(validation_workers, max_received_blocks)
+        self.sync = ChainSync(self)
+        self.relay = Relay(self, relay_fanout) if relay_fanout is not None else None
+        self.compact = CompactRelay(self) if compact_blocks else None
+        self.query_server = QueryServer(self, query_port) if query_port is not None else None
+        # only listen once self.messenger is set, the handlers may answer through it
+        seen = SeenCache(seen_messages, bloom=seen_bloom) if seen_messages else None
+        self.messenger = Messenger(self.node_id, self, transport=transport, seen=seen, listen=False)
+        self.mine_thread = None
+        self.start()
+
+    def create_validation(self, workers: int, queue_size: int):
+        """
+        :return: ValidationPipeline handing the blocks that pass to receive_block().
+        """
+        return ValidationPipeline(self.receive_block, workers, queue_size)
+
+    def start(self):
+        """
+        Starts the Messenger's receive thread, the mining thread, and the chain sync and relay threads.
+
+        :return: None
+        """
+        self.messenger.incoming_message_thread = self.messenger.start_incoming_message_thread()
         self.mine_thread = self.start_mining_thread()
+        self.sync.start()
+        if self.relay is not None:
+            self.relay.start()
 
     def start_mining_thread(self) -> Thread:
         """
@@ -92,6 +214,22 @@ class Node:
         t.start()
         return t
 
+    def stop(self):
+        """
+        Stops the mining thread, waking it up if it is idle.
+
+        :return: None
+        """
+        with self.work_available:
+            self.stop_mine_function = True
+            self.work_available.notify_all()
+        self.sync.stop()
+        if self.relay is not None:
+            self.relay.stop()
+        self.validation.close()
+        if self.query_server is not None:
+            self.query_server.close()
+
     def handle_incoming_message(self, msg: dict):
         """
         Handles incoming messages from the Messenger class in dictionary format.
@@ -100,138 +238,249 @@ class Node:
         :return: None
         """
         if msg['type'] == 'Transaction':  # if transaction append to tx queue
-            self.transaction_queue.append(Transaction(msg['contents']))
+            tx = self.decode_transaction(msg['contents'])
+            if self.relay is not None and not self.relay.seen(tx.unique_id, msg.get('sender')):
+                return
+            self.queue_transaction(tx)
+            if self.relay is not None:
+                self.relay.announce('Transaction', tx.unique_id)
+            elif msg.get('sender') is None:  # a client's transaction goes to every peer, peers do not forward it
+                self.send_msg(self.encode(tx), 'Transaction')
+
+        elif msg['type'] == 'Block':  # blocks go through the validation pipeline, which calls receive_block()
+            if self.relay is not None and not self.relay.seen_block(msg['contents'], msg.get('sender')):
+                return
+            self.validation.submit(msg['contents'])
 
-        elif msg['type'] == 'Block':  # if block process and reset mine function if valid
-            incoming_block = Block(msg['contents'])
-            print("\nIncoming Block received: \n", "Index: ", incoming_block.index, '\n', "Previous Hash: ",
-                  incoming_block.prevHash, '\n', "Hash: ", incoming_block.hash, '\n')
-            # Nodes must always mine on the longest chain, so any mining in progress needs to be reset
+        elif msg['type'] in SYNC_MESSAGE_TYPES:
+            self.sync.handle(msg)
+
+        elif msg['type'] in RELAY_MESSAGE_TYPES and self.relay is not None:
+            self.relay.handle(msg)
+
+        elif msg['type'] in COMPACT_MESSAGE_TYPES and self.compact is not None:
+            self.compact.handle(msg)
+
+    def queue_transaction(self, tx: Transaction):
+        """
+        Adds a received transaction to the queue and wakes the mining thread.
+
+        :return: None
+        """
+        with self.work_available:
+            self.transaction_queue.add(tx)
+            self.transactions_received += 1
+            self.work_available.notify_all()
+
+    def receive_block(self, incoming_block: Block):
+        """
+        Last stage of the validation pipeline: queues a block that passed the stateless checks for the mining thread,
+        which applies it to the ledger and chain. Waits while max_received_blocks blocks are queued.
+
+        :param incoming_block: Block.
+        :return: None
+        """
+        print("\nIncoming Block received: \n", "Index: ", incoming_block.index, '\n', "Previous Hash: ",
+              incoming_block.prevHash, '\n', "Hash: ", incoming_block.hash, '\n')
+        if self.relay is not None:
+            self.relay.relay_block(incoming_block)
+        # Nodes must always mine on the longest chain, so any mining in progress needs to be reset
+        with self.work_available:
+            while len(self.received_blocks) >= self.max_received_blocks and not self.stop_mine_function:
+                self.work_available.wait()
             self.received_blocks.append(incoming_block)
             self.reset_mine_function = True
-            print('reset mining true')
+            self.work_available.notify_all()
+        print('reset mining true')
 
     def process_incoming_block(self):
-        incoming_block = self.received_blocks.popleft()
+        with self.work_available:
+            incoming_block = self.received_blocks.popleft()
+            self.work_available.notify_all()  # room for the validation pipeline to queue another block
+        gap = incoming_block.index - len(self.blockchain.blockchain)
+        if self.relay is not None and 0 <= gap <= self.relay.max_depth:
+            # a block whose parent is missing was relayed a few blocks ahead, ask the peer it came from for the parent
+            if self.blockchain.find_block_from_hash(incoming_block.prevHash) is None \
+                    and not self.relay.request_parent(incoming_block):
+                self.sync.request_tips()
+        elif gap > 0:  # a peer is more than a block ahead, catch up
+            self.sync.request_tips()
         # process block returns true if it is valid and added to blockchain and ledger
         if self.blockchain.verify_block(incoming_block):
             # if the block is valid, then we need to remove all transactions from our own tx queue
-            delete_transactions = copy.deepcopy(incoming_block.transactions)
-            self.transaction_queue = [x for x in self.transaction_queue if x not in delete_transactions]
+            self.transaction_queue.remove_transactions(incoming_block.transactions)
+            if self.relay is not None:
+                self.relay.seen_transactions(incoming_block.transactions)
+        # a reorganization confirms the transactions of the new branch and returns those of abandoned blocks
+        returned, confirmed = self.blockchain.pop_reorg_transactions()
+        self.transaction_queue.remove_transactions(confirmed)
+        if self.relay is not None:
+            self.relay.seen_transactions(confirmed)
+        for tx in returned:
+            self.transaction_queue.add(tx)
 
     def mining_thread(self):
         """
-        Function to be threaded. Continually mines new blocks on current blockchain, watches for new blocks to mine on
+        Function to be threaded. Continually mines new blocks on current blockchain, watches for new blocks to mine on.
+        With nothing to do it sleeps until a transaction or block arrives or mining is stopped.
 
         :return: None
         """
-        count = 0
         while not self.stop_mine_function:  # always run unless stop flag is true
+            with self.work_available:
+                while not (self.stop_mine_function or self.received_blocks or self.transaction_queue):
+                    self.work_available.wait()
+            if self.stop_mine_function:
+                break
             if len(self.received_blocks) > 0:
                 self.process_incoming_block()
 
             elif self.transaction_queue:  # check if tx queue is empty
-                tx_to_mine = copy.deepcopy(self.transaction_queue) # gram transactions to mine
-                next_index = self.blockchain.get_last_block().index + 1 # designate next index
-                # verify transactions!
-                verified_bool, return_value = self.ledger.verify_transaction(tx_to_mine, next_index)
-                if verified_bool:
-                    # verified_bool returns True with new balance
-                    new_block_json = self.hash_block(tx_to_mine, next_index)
-                    # hash_block() returns empty ('false') string if mining was interrupted by discovery of new block
-                    if new_block_json:  # mining was not interrupted
-                        new_block = Block(new_block_json)
-                        # last check before adding to blockchain that mined block is indeed the longest:
-                        if len(self.received_blocks) > 0 and self.received_blocks[0].index >= new_block.index:
-                            print('block already exists at that index! discarding mined block')
-                        else:
-                            self.ledger.add_balance_state(return_value[0], new_block.index)
-                            self.blockchain.add_block(new_block)
-                            self.send_msg(new_block_json, 'Block')
-                            print("\nmined a new block and added to blockchain!: \n", "Index: ", new_block.index, '\n',
-                                  "Previous Hash: ",
-                                  new_block.prevHash, '\n', "Hash: ", new_block.hash, '\n')
+                received = self.transactions_received
+                tx_to_mine, change, next_index = self.next_template()
+                if not tx_to_mine:
+                    # nothing queued fits a block on this chain, sleep until a transaction or block arrives
+                    with self.work_available:
+                        while received == self.transactions_received and \
+                                not (self.stop_mine_function or self.received_blocks):
+                            self.work_available.wait()
+                else:
+                    # change holds the new balance of every account the chosen transactions touch
+                    new_block = self.hash_block(tx_to_mine, next_index)
+                    # hash_block() returns None if mining was interrupted by discovery of new block
+                    if new_block:  # mining was not interrupted
+                        self.add_mined_block(new_block, change)
                     else:
                         # this will only occur if mining had been interrupted, so we need to reset flag and start again
                         self.reset_mine_function = False
                         continue
-                else:
-                    #  if not valid, verified_bool returns False with list of bad transaction IDs. Delete bad tx
-                    self.transaction_queue = [tx for tx in self.transaction_queue if tx.unique_id not in return_value]
-            else:
-                pass
-            count += 1
-            if count > 500000:
-                text_file = open(self.file_path, "a")
-                text_file.write(str(self.transaction_queue))
-                text_file.close()
-                count = 0
+        self.mining_engine.shutdown()
+
+    def next_template(self):
+        """
+        Chooses valid transactions from the queue for the next block, up to the block size limit. Transactions that
+        overdraw their sender or name unknown accounts are deleted from the queue.
+
+        :return: tuple (list of Transaction objects, dict of balance changes, index of the next block).
+        """
+        next_index = self.blockchain.get_last_block().index + 1 # designate next index
+        tx_to_mine, change, bad_tx = self.block_template.build(self.transaction_queue, next_index)
+        self.transaction_queue.remove_ids(bad_tx)
+        return tx_to_mine, change, next_index
+
+    def add_mined_block(self, new_block: Block, change: dict):
+        """
+        Adds a newly mined block to the ledger and chain and sends it to the peers, unless a received block at the same
+        height is waiting.
+
+        :param change: dict. New balance of every account the block's transactions touch.
+        :return: None
+        """
+        # last check before adding to blockchain that mined block is indeed the longest:
+        if len(self.received_blocks) > 0 and self.received_blocks[0].index >= new_block.index:
+            print('block already exists at that index! discarding mined block')
+            return
+        # clear mined transactions from queue, a discarded block leaves them queued for the next one
+        self.transaction_queue.remove_transactions(new_block.transactions)
+        self.ledger.add_balance_state(change, new_block.index)
+        self.blockchain.add_block(new_block)
+        if self.relay is not None:
+            self.relay.seen(new_block.hash)
+            self.relay.seen_transactions(new_block.transactions)
+            self.relay.push_block(new_block)
+        elif self.compact is not None:
+            self.send_msg(*self.compact.encode(new_block))
+        else:
+            self.send_msg(self.encode(new_block), 'Block')
+        print("\nmined a new block and added to blockchain!: \n", "Index: ", new_block.index, '\n',
+              "Previous Hash: ",
+              new_block.prevHash, '\n', "Hash: ", new_block.hash, '\n')
 
-    def hash_block(self, transactions, index) -> str:
+    def hash_block(self, transactions, index) -> Block:
         """
         the actual function that generates a hash for a new block to add to the blockchain
 
-        :return: str. Returns empty string if interrupted, otherwise JSON string representation of a newly mined block
+        :return: Block. Returns None if interrupted, otherwise the newly mined block
         """
         last_block = self.blockchain.get_last_block()
-        #  make a new block with everything but the hash
-        new_block = {
-            'index': index,
-            'prevHash': last_block.hash,
-            'timestamp': str(datetime.datetime.now()),
-            'nonce': 0,
-            'transactions': transactions
-        }
-        # change the transaction objects into strings so it can be dumped into JSON format
-        new_block['transactions'] = [str(tx) for tx in new_block['transactions']]
-
-        # Hash the JSON representation of the new block
-        _hash = hashlib.sha256(json.dumps(new_block).encode()).hexdigest()
-
-        # keep hashing the block until the hash meets the required difficulty
-        count = 0
-        while _hash > self.hash_difficulty:
-            count +=1
-            if not self.reset_mine_function:  # keep hashing unless a new block was received
-                if count > 5000:
-                    print('Computing Hash: ', _hash[:10], '...')  # Show every 5000th hash to show functionality
-                    count = 0
-                new_block['nonce'] += 1
-                _hash = hashlib.sha256(json.dumps(new_block).encode()).hexdigest()
-            else:  # if a new block was received, break and exit the function, returning an empty string (falsy)
-                _hash = ''
-                break
+        #  make a new block with everything but the nonce and hash
+        new_block = Block(
+            index=index,
+            prevHash=last_block.hash,
+            timestamp=str(datetime.datetime.now()),
+            nonce=0,
+            transactions=transactions,
+            version=MERKLE_VERSION
+        )
+
+        # keep hashing the block until the hash meets the required difficulty, unless a new block was received
+        result = self.mining_engine.mine(
+            new_block.hash_prefix(),
+            new_block.nonce_tail(),
+            should_stop=lambda: self.reset_mine_function or self.stop_mine_function
+        )
 
-        if _hash:  # finished mine function uninterrupted, successfully mined new block
-            new_block['hash'] = _hash
-            new_block_json = json.dumps(new_block)
-            # clear mined transactions from queue
-            self.transaction_queue = [x for x in self.transaction_queue if x not in transactions]
+        if result:  # finished mine function uninterrupted, successfully mined new block
+            new_block.nonce, new_block.hash = result
             if self.reset_mine_function:
-                return ''
+                return None
             else:
-                return new_block_json  # this string will be sent to other nodes
-        else:  # mine function interrupted, returning empty string.
-            return _hash
+                return new_block  # this block will be sent to other nodes
+        else:  # mine function interrupted, returning None.
+            return None
+
+    def encode(self, item):
+        """
+        Serializes a Block or Transaction in the node's wire format.
+
+        :param item: Block or Transaction.
+        :return: bytes in the binary wire format, str in the JSON one.
+        """
+        return item.to_bytes() if self.wire_format == 'binary' else str(item)
+
+    @staticmethod
+    def decode_transaction(contents) -> Transaction:
+        """
+        Builds a Transaction from received contents, binary (bytes) or JSON (str).
 
-    def send_msg(self, contents: str, type: str):
+        :return: Transaction.
+        """
+        return Transaction.from_bytes(contents) if isinstance(contents, bytes) else Transaction(contents)
+
+    def send_msg(self, contents, type: str):
         """
         sends msgs to all peers
 
-        :param contents: str. Newly mined blocks or new transactions in JSON string representation.
-        :param type: str. indicates type of msg. 'Block' or 'Transaction'
+        :param contents: bytes or str. Newly mined blocks or new transactions, in binary or JSON representation.
+        :param type: str. indicates type of msg. 'Block', 'Transaction' or one of the chain sync messages
         :return: None
         """
         # send block to all known peers
-        msg_dict = {'contents': contents, 'type': type}
+        msg_dict = {'contents': contents, 'type': type, 'sender': self.node_id}
         for peer in self.peers:
             self.messenger.send(msg_dict, peer)
 
+    def send_to(self, peer: str, contents, type: str):
+        """
+        sends a msg to one peer, such as the reply to a chain sync request
+
+        :param peer: str. id of the receiving node
+        :param contents: bytes or str.
+        :param type: str. indicates type of msg
+        :return: None
+        """
+        self.messenger.send({'contents': contents, 'type': type, 'sender': self.node_id}, peer)
+
 
 if __name__ == '__main__':
     arg = sys.argv[1]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    # an optional JSON file of node addresses connects the nodes directly instead of through SQS
+    transport = SocketTransport.from_file(arg, sys.argv[3]) if len(sys.argv) > 3 else None
+    # the nodes of the file are the peers, without one the hardcoded four
+    peers = list(transport.addresses) if transport is not None else None
 
-    n = Node(arg)
+    n = Node(arg, workers, transport=transport, peers=peers)
 
 
 
@@ -0,0 +1,133 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+from urllib.parse import urlsplit, parse_qs, unquote
+import json
+
+MAX_PAGE = 500
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class QueryServer:
+    """
+    Small local HTTP endpoint answering JSON queries about a node's chain from its TxIndex. Every query is a B-tree
+    lookup, O(log n) in the length of the chain.
+
+    GET /tip                                        height and hash of the last block
+    GET /balance/<account>?height=<h>               balance after block h, the tip by default
+    GET /tx/<unique_id>                             block height, position and contents of a transaction
+    GET /account/<account>/history?limit=&before=   a page of an account's transactions, newest first. The reply holds
+                                                    the cursor to pass as before for the next page, null after the last
+    GET /stats/messages                             hits and misses of the node's SeenCache of received messages
+
+    Attributes
+    ----------
+    node : Node
+        node whose chain is queried
+    httpd : HTTPServer
+        server handling each request in its own thread
+
+    Methods
+    -------
+    close()
+        stops the server
+    """
+
+    def __init__(self, node, port: int, host: str = '127.0.0.1'):
+        """
+        Constructor for the QueryServer. Starts serving in a background thread.
+
+        :param node: Node. Node whose chain is queried.
+        :param port: int. Port to listen on, 0 picks a free one.
+        :param host: str. Address to listen on, only the local machine by default.
+        """
+        self.node = node
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server.answer(self.path)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass  # the node's output is its block log
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = Thread(target=self.httpd.serve_forever, name='Query Server', daemon=True)
+        self.thread.start()
+
+    def answer(self, path: str):
+        """
+        :param path: str. Request path with its query string.
+        :return: tuple (HTTP status, JSON serializable body).
+        """
+        url = urlsplit(path)
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            if parts == ['tip']:
+                return self.tip()
+            if parts == ['stats', 'messages']:
+                return self.message_stats()
+            if len(parts) == 2 and parts[0] == 'balance':
+                return self.balance(parts[1], int(query['height']) if 'height' in query else None)
+            if len(parts) == 2 and parts[0] == 'tx':
+                return self.transaction(parts[1])
+            if len(parts) == 3 and parts[0] == 'account' and parts[2] == 'history':
+                return self.history(parts[1], min(int(query.get('limit', 50)), MAX_PAGE),
+                                    int(query['before']) if 'before' in query else None)
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        return 404, {'error': 'unknown query ' + url.path}
+
+    def tip(self):
+        last_block = self.node.blockchain.get_last_block()
+        return 200, {'height': last_block.index, 'hash': last_block.hash}
+
+    def message_stats(self):
+        seen = self.node.messenger.seen
+        if seen is None:
+            return 404, {'error': 'the node keeps no seen messages'}
+        return 200, seen.stats()
+
+    def balance(self, account: str, height):
+        tip = self.node.blockchain.index.tip()
+        height = tip if height is None else height
+        if not 0 <= height <= tip:
+            return 404, {'error': 'no block at height {}'.format(height)}
+        balance = self.node.blockchain.index.balance_at(account, height)
+        if balance is None:
+            return 404, {'error': 'unknown account ' + account}
+        return 200, {'account': account, 'height': height, 'balance': balance}
+
+    def transaction(self, unique_id: str):
+        found = self.node.blockchain.index.find_transaction(unique_id)
+        if found is None:
+            return 404, {'error': 'unknown transaction ' + unique_id}
+        height, position = found
+        try:
+            block = self.node.blockchain.store.read(height)
+            tx = block.transactions[position]
+        except IndexError:  # dropped by a reorganization since the lookup
+            return 404, {'error': 'unknown transaction ' + unique_id}
+        if tx.unique_id != unique_id:  # the block at that height was replaced since the lookup
+            return 404, {'error': 'unknown transaction ' + unique_id}
+        return 200, {'height': height, 'position': position, 'block_hash': block.hash,
+                     'transaction': json.loads(str(tx))}
+
+    def history(self, account: str, limit: int, before):
+        page, cursor = self.node.blockchain.index.account_history(account, limit, before)
+        return 200, {'account': account, 'transactions': page, 'next': cursor}
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,371 @@
+from threading import Thread, Lock
+import Codec
+import collections, json, random, struct, time
+
+MESSAGE_TYPES = ('Inv', 'GetData')
+
+
+def block_id(contents) -> str:
+    """
+    Hash of a received block, read from its binary or JSON representation without decoding its transactions.
+
+    :param contents: bytes or str.
+    :return: str.
+    """
+    if isinstance(contents, bytes):
+        return Codec.unpack_hash(Codec.decode_block_header(contents)['hash'])
+    return json.loads(contents)['hash']
+
+
+class Relay:
+    """
+    Gossip relay of blocks and transactions. Instead of sending every item in full to every peer, a node announces the
+    ids of new items (block hashes and transaction unique_ids) in an Inv message to fanout random peers that are not
+    known to have them. A peer that has not seen an item asks the announcer for it (GetData), which replies with the
+    usual Block or Transaction message, and once it has checked the item announces it onward in turn. Every node
+    receives each item in full about once and sends fanout small announcements for it, so the bandwidth per item
+    grows with the fanout instead of the size of the cluster, and the peers need not form a full mesh.
+
+    Blocks are announced at once. A block the node mined itself is sent in full to fanout peers instead, as no peer
+    can have it yet and the announcement would only add a round trip. A received block is announced onward as soon as
+    it passed the stateless checks, if it is higher than the node's tip, and served from the relay until the mining
+    thread applied it; stale fork blocks are not relayed. A block whose parent is missing makes the node ask the peer
+    it came from for the parent. Transaction announcements are collected per peer and sent together every
+    trickle_interval seconds, so a busy node sends one Inv per peer per interval rather than one per transaction, and
+    a transaction mined before its announcement went out is not announced: the origin node usually mines it alone.
+    Inv and GetData contents are Codec encoded inventories, lists of raw 32 byte ids.
+
+    Attributes
+    ----------
+    node : Node
+        the node relaying, its chain and mempool answer GetData
+    fanout : int
+        number of peers each item is announced to
+    max_depth : int
+        blocks more than this far below the node's tip are not relayed, peers get those from a chain sync
+    known : OrderedDict
+        id -> set of peers known to have the item, of the last max_known items the node has seen or requested
+    senders : dict
+        id -> peer the node received the item from, of the items in known
+    blocks : OrderedDict
+        hash -> Block of the last max_blocks blocks announced onward, to serve them before they are applied
+    requested : dict
+        id -> [time after which the item is requested from another announcer, type, peers asked] of the items awaited
+    pending : dict
+        peer -> transaction unique_ids waiting for the next trickle to that peer
+    announced, requested_count, served : int
+        numbers of ids announced, requested and served
+
+    Methods
+    -------
+    start()
+        starts the thread sending the transaction announcements
+    stop()
+        stops that thread
+    flush()
+        sends the collected transaction announcements
+    retry()
+        asks another announcer for the items requested but not received in time
+    seen(_id: str, peer: str)
+        records that the node received an item, returns True the first time
+    seen_block(contents, peer: str)
+        seen() for the contents of a received block
+    seen_transactions(transactions: list)
+        records the transactions of an accepted block as seen
+    announce(type: str, _id: str)
+        announces an item to fanout peers that are not known to have it
+    push_block(block: Block)
+        sends a block the node mined to fanout peers
+    relay_block(block: Block)
+        announces a received block higher than the node's tip onward
+    request_parent(block: Block)
+        asks a peer that relayed a block for its missing parent
+    handle(msg: dict)
+        handles an Inv or GetData message
+    """
+
+    def __init__(self, node, fanout: int = 3, max_known: int = 100000, request_timeout: float = 5.0,
+                 max_depth: int = 6, trickle_interval: float = 2.0, max_blocks: int = 32):
+        """
+        Constructor for the Relay.
+
+        :param node: Node. Node relaying.
+        :param fanout: int. Number of peers each item is announced to.
+        :param max_known: int. Most item ids remembered.
+        :param request_timeout: float. Seconds after which an item requested but not received is asked of another
+        announcer.
+        :param max_depth: int. Blocks more than this far below the node's tip are not relayed.
+        :param trickle_interval: float. Seconds between two rounds of transaction announcements.
+        :param max_blocks: int. Most received blocks kept to serve them before they are applied.
+        """
+        self.node = node
+        self.fanout = fanout
+        self.max_known = max_known
+        self.request_timeout = request_timeout
+        self.max_depth = max_depth
+        self.trickle_interval = trickle_interval
+        self.max_blocks = max_blocks
+        self.lock = Lock()
+        self.known = collections.OrderedDict()
+        self.senders = {}
+        self.blocks = collections.OrderedDict()
+        self.requested = {}
+        self.pending = {}
+        self.announced = self.requested_count = self.served = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.run, name='Relay' + self.node.node_id, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        """
+        Sends the collected transaction announcements every trickle_interval seconds, and asks again for the items
+        that did not arrive.
+
+        :return: None
+        """
+        while self.running:
+            time.sleep(self.trickle_interval)
+            self.flush()
+            self.retry()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for peer, unique_ids in pending.items():
+            # transactions mined since they were queued are no longer announced, the peers get them in the block
+            unique_ids = [unique_id for unique_id in unique_ids if unique_id in self.node.transaction_queue]
+            if unique_ids:
+                self.node.send_to(peer, Codec.encode_inventory({'Transaction': unique_ids}), 'Inv')
+
+    def retry(self):
+        """
+        Asks for every item requested more than request_timeout seconds ago and not received, from a peer that
+        announced it and was not asked yet. Items no other peer announced wait for a new announcement.
+
+        :return: None
+        """
+        wanted = {}
+        now = time.time()
+        with self.lock:
+            for _id, request in self.requested.items():
+                deadline, type, asked = request
+                if deadline >= now:
+                    continue
+                others = [peer for peer in self.known.get(_id, ()) if peer not in asked]
+                if not others:
+                    continue
+                peer = random.choice(others)
+                asked.add(peer)
+                request[0] = now + self.request_timeout
+                wanted.setdefault(peer, {}).setdefault(type, []).append(_id)
+                self.requested_count += 1
+        for peer, inventory in wanted.items():
+            self.node.send_to(peer, Codec.encode_inventory(inventory), 'GetData')
+
+    def holders(self, _id: str) -> set:
+        """
+        Peers known to have an item, remembering the item if it is new. Called with the lock held.
+
+        :return: set, None if the item is new.
+        """
+        peers = self.known.get(_id)
+        if peers is None:
+            self.known[_id] = set()
+            while len(self.known) > self.max_known:
+                oldest = self.known.popitem(last=False)[0]
+                self.requested.pop(oldest, None)
+                self.senders.pop(oldest, None)
+        return peers
+
+    def seen(self, _id: str, peer: str = None) -> bool:
+        """
+        Records that the node received an item, from a peer or, with peer None, from a client or its own miner.
+
+        :return: bool. True the first time the node receives the item, False for a duplicate.
+        """
+        with self.lock:
+            new = self.holders(_id) is None or _id in self.requested
+            self.requested.pop(_id, None)
+            if peer is not None:
+                self.known[_id].add(peer)
+                if new:
+                    self.senders[_id] = peer
+            return new
+
+    def seen_block(self, contents, peer: str = None) -> bool:
+        """
+        seen() for received block contents. Malformed contents count as new, the validation pipeline rejects them.
+
+        :return: bool. False for a duplicate.
+        """
+        try:
+            _id = block_id(contents)
+        except (ValueError, KeyError, IndexError, TypeError, struct.error):
+            return True
+        return self.seen(_id, peer)
+
+    def seen_transactions(self, transactions: list):
+        """
+        Records the transactions of a block the node accepted as seen, so that later announcements of them are not
+        requested and those awaited are no longer asked of other peers.
+
+        :param transactions: list of Transaction objects.
+        :return: None
+        """
+        with self.lock:
+            for tx in transactions:
+                self.holders(tx.unique_id)
+                self.requested.pop(tx.unique_id, None)
+
+    def announce(self, type: str, _id: str):
+        """
+        Announces an item to fanout random peers that are not known to have it, a block at once, a transaction with
+        the next trickle.
+
+        :param type: str. 'Block' or 'Transaction'.
+        :param _id: str. Block hash or transaction unique_id.
+        :return: None
+        """
+        with self.lock:
+            self.holders(_id)
+            holders = self.known[_id]
+            candidates = [peer for peer in self.node.peers if peer not in holders]
+            chosen = random.sample(candidates, min(self.fanout, len(candidates)))
+            holders.update(chosen)
+            self.announced += len(chosen)
+            if type == 'Transaction':
+                for peer in chosen:
+                    self.pending.setdefault(peer, []).append(_id)
+                return
+        contents = Codec.encode_inventory({type: [_id]})
+        for peer in chosen:
+            self.node.send_to(peer, contents, 'Inv')
+
+    def push_block(self, block):
+        """
+        Sends a block in full to fanout random peers that are not known to have it.
+
+        :param block: Block.
+        :return: None
+        """
+        with self.lock:
+            self.holders(block.hash)
+            holders = self.known[block.hash]
+            candidates = [peer for peer in self.node.peers if peer not in holders]
+            chosen = random.sample(candidates, min(self.fanout, len(candidates)))
+            holders.update(chosen)
+            self.announced += len(chosen)
+        for peer in chosen:
+            self.send_block(peer, block)
+
+    def relay_block(self, block):
+        """
+        Announces a block received through the relay that passed the stateless checks and is higher than the node's
+        tip, without waiting for the mining thread to apply it. Blocks from a chain sync are not relayed.
+
+        :param block: Block.
+        :return: None
+        """
+        with self.lock:
+            if block.hash not in self.senders or block.index < len(self.node.blockchain.blockchain) - 1:
+                return
+            self.blocks[block.hash] = block
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+        self.announce('Block', block.hash)
+
+    def request_parent(self, block) -> bool:
+        """
+        Asks the peer the node received a block from for the block's parent, which the node lacks, unless the parent
+        was requested less than request_timeout seconds ago. A short gap is closed this way without a chain sync.
+
+        :param block: Block.
+        :return: bool. False if the block did not come from a peer, for the node to fall back to a chain sync.
+        """
+        with self.lock:
+            request = self.requested.get(block.prevHash)
+            if request is not None and request[0] >= time.time():
+                return True
+            peer = self.senders.get(block.hash)
+            if peer is None:
+                return False
+            self.holders(block.prevHash)
+            self.known[block.prevHash].add(peer)
+            self.requested[block.prevHash] = [time.time() + self.request_timeout, 'Block',
+                                              {peer} | (request[2] if request is not None else set())]
+            self.requested_count += 1
+        self.node.send_to(peer, Codec.encode_inventory({'Block': [block.prevHash]}), 'GetData')
+        return True
+
+    def send_block(self, peer: str, block):
+        if self.node.compact is not None:
+            self.node.send_to(peer, *self.node.compact.encode(block))
+        else:
+            self.node.send_to(peer, self.node.encode(block), 'Block')
+
+    def handle(self, msg: dict):
+        """
+        Handles an Inv or GetData message. Messages without a sender cannot be answered and are dropped.
+
+        :param msg: dict. Message attributes.
+        :return: None
+        """
+        peer = msg.get('sender')
+        if peer is None:
+            return
+        try:
+            inventory = Codec.decode_inventory(msg['contents'])
+        except (ValueError, IndexError, TypeError) as e:
+            print('relay: malformed', msg['type'], 'from', peer, repr(e))
+            return
+        if msg['type'] == 'Inv':
+            self.on_inv(peer, inventory)
+        else:
+            self.on_get_data(peer, inventory)
+
+    def on_inv(self, peer: str, inventory: dict):
+        """
+        Asks the announcing peer for the announced items the node has not seen and is not waiting for, or has waited
+        for longer than request_timeout.
+        """
+        wanted = {}
+        now = time.time()
+        with self.lock:
+            for type in ('Block', 'Transaction'):
+                for _id in inventory.get(type, []):
+                    holders = self.holders(_id)
+                    self.known[_id].add(peer)
+                    request = self.requested.get(_id)
+                    if holders is None or (request is not None and request[0] < now):
+                        asked = request[2] if request is not None else set()
+                        asked.add(peer)
+                        self.requested[_id] = [now + self.request_timeout, type, asked]
+                        wanted.setdefault(type, []).append(_id)
+                        self.requested_count += 1
+        if wanted:
+            self.node.send_to(peer, Codec.encode_inventory(wanted), 'GetData')
+
+    def on_get_data(self, peer: str, inventory: dict):
+        """
+        Sends the requested items the node has, blocks from its block tree and transactions from its mempool.
+        """
+        for _hash in inventory.get('Block', []):
+            with self.lock:
+                block = self.blocks.get(_hash)
+            if block is None:
+                block = self.node.blockchain.find_block_from_hash(_hash)
+            if block is not None:
+                self.send_block(peer, block)
+                self.served += 1
+        for unique_id in inventory.get('Transaction', []):
+            tx = self.node.transaction_queue.transactions.get(unique_id)
+            if tx is not None:
+                self.node.send_to(peer, self.node.encode(tx), 'Transaction')
+                self.served += 1
@@ -0,0 +1,70 @@
+from Block import Block, MIDSTATE_VERSION
+from BlockChain import BlockChain
+from Ledger import Ledger
+from Transaction import Transaction
+import datetime, hashlib, os, shutil, sys, tempfile, time
+
+
+def make_block(index: int, prev_hash: str, transactions: list) -> Block:
+    """
+    Build a block with a valid hash, there is no difficulty to meet in the benchmark.
+
+    :return: Block.
+    """
+    block = Block(index=index, prevHash=prev_hash, timestamp=str(datetime.datetime.now()), transactions=transactions,
+                  version=MIDSTATE_VERSION)
+    block.hash = hashlib.sha256(block.hash_contents()).hexdigest()
+    return block
+
+
+def make_transactions(count: int, seed: int) -> list:
+    """
+    Small transfers between the four genesis accounts, too small to ever overdraw.
+
+    :return: list of Transaction objects.
+    """
+    return [Transaction(_to='node' + str((seed + i) % 4), _from='node' + str((seed + i + 1) % 4), amount=0.0001)
+            for i in range(count)]
+
+
+def time_reorg(depth: int, base_length: int = 10, tx_per_block: int = 10) -> float:
+    """
+    Build a chain of base_length + depth blocks, then a competing branch forking at base_length that is one block
+    longer, and time how long the BlockChain takes to switch to it.
+
+    :param depth: int. Number of blocks reverted by the reorganization.
+    :param base_length: int. Blocks shared by both branches.
+    :param tx_per_block: int. Transactions in every block.
+    :return: float. Seconds spent in reorganize().
+    """
+    data_dir = tempfile.mkdtemp()
+    try:
+        blockchain = BlockChain('bench', Ledger('bench', data_dir), data_dir)
+        for i in range(base_length + depth):
+            blockchain.verify_block(make_block(len(blockchain.blockchain), blockchain.get_last_block().hash,
+                                               make_transactions(tx_per_block, i)))
+        prev_block = blockchain.blockchain[base_length]
+        for i in range(depth + 1):
+            prev_block = make_block(prev_block.index + 1, prev_block.hash, make_transactions(tx_per_block, i + 1))
+            blockchain.tree.add(prev_block)
+        start = time.perf_counter()
+        assert blockchain.reorganize(prev_block)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    depths = [int(arg) for arg in sys.argv[1:]] or [1, 2, 4, 8, 16, 32, 64]  # at most TREE_DEPTH
+    results = []
+    stdout = sys.stdout
+    for depth in depths:
+        sys.stdout = open(os.devnull, 'w')  # the chain classes print every block they handle
+        try:
+            results.append((depth, time_reorg(depth)))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    print('reorg depth | latency (ms) | ms per block reverted')
+    for depth, seconds in results:
+        print('{:>11} | {:>12.2f} | {:>8.3f}'.format(depth, seconds * 1000, seconds * 1000 / depth))
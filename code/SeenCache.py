@@ -0,0 +1,144 @@
+from threading import Lock
+import collections, hashlib, math, time
+
+
+class BloomFilter:
+    """
+    Fixed size set of byte strings with no false negatives and a false positive rate set by its size. Positions are
+    taken from the bytes of the key, which is expected to be a hash already.
+
+    Attributes
+    ----------
+    bits : bytearray
+        the filter
+    size : int
+        number of bits
+    hashes : int
+        number of bits set per key
+    count : int
+        number of keys added
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        Constructor for the BloomFilter, sized for capacity keys at the given false positive rate.
+
+        :param capacity: int. Keys the filter is sized for.
+        :param error_rate: float. False positive rate at capacity.
+        """
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: bytes):
+        # double hashing: position i is h1 + i * h2, both read from the key
+        h1 = int.from_bytes(key[:8], 'big')
+        h2 = int.from_bytes(key[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: bytes):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class SeenCache:
+    """
+    Bounded, time expiring set of the messages a node received, keyed by a hash of their type and contents, so a
+    message delivered again is dropped before it is parsed. Keys are kept in arrival order and forgotten after ttl
+    seconds or once max_size newer ones arrived.
+
+    For very high volume, bloom mode keeps the keys in two Bloom filters of max_size keys each instead: new keys go
+    into the current one, and it replaces the previous one when it is full or ttl seconds old, so a key is remembered
+    for between one and two generations. Memory is fixed at about 1.8 bytes per key for a 0.1% false positive rate,
+    and a false positive drops a new message, which the node gets again later through a block or a chain sync.
+
+    Attributes
+    ----------
+    max_size : int
+        most keys remembered, or in bloom mode keys per filter
+    ttl : float
+        seconds a key is remembered
+    seen : OrderedDict
+        key -> time it was added, None in bloom mode
+    current, previous : BloomFilter
+        the filters in bloom mode, None otherwise
+    hits, misses : int
+        numbers of duplicates found and of new messages
+
+    Methods
+    -------
+    key(type: str, contents)
+        the key of a message
+    check(type: str, contents)
+        records a message, returns True if it was seen before
+    stats()
+        the counters as a dict
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 600.0, bloom: bool = False, error_rate: float = 0.001):
+        """
+        Constructor for the SeenCache.
+
+        :param max_size: int. Most keys remembered, or in bloom mode keys per filter.
+        :param ttl: float. Seconds a key is remembered.
+        :param bloom: bool. Keep the keys in Bloom filters instead of a dict.
+        :param error_rate: float. False positive rate of each Bloom filter when full.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.error_rate = error_rate
+        self.lock = Lock()
+        self.seen = None if bloom else collections.OrderedDict()
+        self.current = BloomFilter(max_size, error_rate) if bloom else None
+        self.previous = BloomFilter(max_size, error_rate) if bloom else None
+        self.generation_start = time.time()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(type: str, contents) -> bytes:
+        """
+        :param contents: bytes or str.
+        :return: bytes. 16 byte hash of the type and contents.
+        """
+        digest = hashlib.blake2b(type.encode(), digest_size=16)
+        digest.update(contents if isinstance(contents, bytes) else contents.encode())
+        return digest.digest()
+
+    def check(self, type: str, contents) -> bool:
+        """
+        Records a message.
+
+        :param type: str. Message type.
+        :param contents: bytes or str. Message contents.
+        :return: bool. True if the same message was seen within ttl seconds.
+        """
+        key = self.key(type, contents)
+        now = time.time()
+        with self.lock:
+            if self.seen is None:
+                if self.current.count >= self.max_size or now - self.generation_start > self.ttl:
+                    self.previous, self.current = self.current, BloomFilter(self.max_size, self.error_rate)
+                    self.generation_start = now
+                duplicate = key in self.current or key in self.previous
+                if not duplicate:
+                    self.current.add(key)
+            else:
+                while self.seen and (len(self.seen) >= self.max_size or next(iter(self.seen.values())) < now - self.ttl):
+                    self.seen.popitem(last=False)
+                duplicate = key in self.seen
+                if not duplicate:
+                    self.seen[key] = now
+            if duplicate:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return duplicate
+
+    def stats(self) -> dict:
+        size = len(self.seen) if self.seen is not None else self.current.count + self.previous.count
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
@@ -0,0 +1,410 @@
+"""
+In-process cluster simulator: N Nodes in one process, talking over an in-memory network with configurable per-link
+latency, jitter, loss and partitions, mining at a scaled-down difficulty under a seeded transaction load. It reports
+confirmed transactions per second, block propagation percentiles, fork and orphan rates and the time the nodes take to
+agree on one tip once the load stops.
+
+    python3 Simulator.py --nodes 16 --duration 10 --rate 50 --latency 0.05 --loss 0.01 --partition 2,5
+"""
+from Node import Node
+from AsyncNode import AsyncNode
+from Transaction import Transaction
+from Transport import Transport
+import Codec
+from threading import Thread, Condition, Lock
+import argparse, collections, heapq, itertools, os, queue, random, shutil, sys, tempfile, time
+
+
+class SimNetwork:
+    """
+    In-memory network between simulated nodes. Every message is delayed by its link's latency plus a uniform random
+    jitter, dropped with the link's loss probability, and dropped if a partition separates its ends. With a duplicate
+    probability a message is delivered twice, as SQS may. A scheduler thread delivers messages to the inbox of their
+    destination when they are due.
+
+    Attributes
+    ----------
+    latency, jitter, loss : float
+        defaults for every link, in seconds and as a probability
+    duplicate : float
+        probability that a message is delivered twice
+    links : dict
+        (source, destination) -> (latency, jitter, loss) of links that differ from the defaults
+    groups : dict
+        node id -> partition it is in, None when the network is whole
+    sent, dropped, delivered : int
+        message counts
+    bytes_sent : int
+        size of every message sent, encoded as on a socket connection
+    bytes_by_source : Counter
+        source -> size of the messages it sent
+
+    Methods
+    -------
+    transport(node_id: str)
+        a Transport for a node on this network
+    set_link(source: str, destination: str, latency: float, jitter: float, loss: float)
+        change one direction of one link
+    partition(*groups)
+        split the network, messages between different groups are dropped
+    heal()
+        join the partitions again
+    """
+
+    def __init__(self, latency: float = 0.01, jitter: float = 0.0, loss: float = 0.0, seed: int = 0,
+                 duplicate: float = 0.0):
+        """
+        Constructor for the SimNetwork. Starts the scheduler thread.
+
+        :param latency: float. Seconds every message takes by default.
+        :param jitter: float. Most extra seconds added at random to the latency.
+        :param loss: float. Probability that a message is dropped.
+        :param seed: int. Seed of the random choices.
+        :param duplicate: float. Probability that a message is delivered twice.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.duplicate = duplicate
+        self.rng = random.Random(seed)
+        self.links = {}
+        self.groups = None
+        self.inboxes = {}
+        self.pending = []  # heap of (due time, sequence number, destination, message)
+        self.sequence = itertools.count()
+        self.condition = Condition()
+        self.sent = self.dropped = self.delivered = self.bytes_sent = 0
+        self.bytes_by_source = collections.Counter()
+        self.thread = Thread(target=self.deliver, name='Sim Network', daemon=True)
+        self.thread.start()
+
+    def transport(self, node_id: str):
+        self.inboxes[node_id] = queue.Queue()
+        return SimTransport(self, node_id)
+
+    def set_link(self, source: str, destination: str, latency: float = None, jitter: float = None,
+                 loss: float = None):
+        default = self.links.get((source, destination), (self.latency, self.jitter, self.loss))
+        self.links[source, destination] = (default[0] if latency is None else latency,
+                                           default[1] if jitter is None else jitter,
+                                           default[2] if loss is None else loss)
+
+    def partition(self, *groups):
+        """
+        :param groups: iterables of node ids. Nodes in no group are cut off from every other node.
+        """
+        self.groups = {node_id: i for i, group in enumerate(groups) for node_id in group}
+
+    def heal(self):
+        self.groups = None
+
+    def send(self, source: str, destination: str, message: dict):
+        latency, jitter, loss = self.links.get((source, destination), (self.latency, self.jitter, self.loss))
+        groups = self.groups
+        size = len(Codec.encode_message(message))
+        with self.condition:
+            self.sent += 1
+            self.bytes_sent += size
+            self.bytes_by_source[source] += size
+            if destination not in self.inboxes or self.rng.random() < loss or \
+                    (groups is not None and groups.get(source, -1) != groups.get(destination, -2)):
+                self.dropped += 1
+                return
+            copies = 2 if self.rng.random() < self.duplicate else 1
+            for _ in range(copies):
+                due = time.time() + latency + self.rng.uniform(0, jitter)
+                heapq.heappush(self.pending, (due, next(self.sequence), destination, dict(message)))
+            self.condition.notify()
+
+    def deliver(self):
+        """
+        Scheduler thread: moves every message to its destination's inbox when it is due.
+
+        :return: None
+        """
+        while True:
+            with self.condition:
+                while not self.pending or self.pending[0][0] > time.time():
+                    self.condition.wait(self.pending[0][0] - time.time() if self.pending else None)
+                _, _, destination, message = heapq.heappop(self.pending)
+                self.delivered += 1
+            self.inboxes[destination].put(message)
+
+
+class SimTransport(Transport):
+    """
+    A node's end of a SimNetwork.
+    """
+
+    def __init__(self, network: SimNetwork, node_id: str):
+        self.network = network
+        self.node_id = node_id
+        self.inbox = network.inboxes[node_id]
+
+    def send(self, message: dict, destination: str):
+        self.network.send(self.node_id, destination, message)
+
+    def receive(self, timeout: float = 0.1) -> list:
+        try:
+            messages = [self.inbox.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                messages.append(self.inbox.get_nowait())
+            except queue.Empty:
+                return messages
+
+
+class Recorder:
+    """
+    Collects the times blocks are mined and received across the simulated nodes.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.mined = {}  # block hash -> (node id, time)
+        self.received = []  # (block hash, node id, time)
+        self.orphans = 0
+
+    def block_mined(self, node_id: str, block):
+        with self.lock:
+            self.mined[block.hash] = (node_id, time.time())
+
+    def block_received(self, node_id: str, block, orphan: bool):
+        with self.lock:
+            self.received.append((block.hash, node_id, time.time()))
+            self.orphans += orphan
+
+
+class SimNode(Node):
+    """
+    Node reporting the blocks it mines and receives to a Recorder.
+    """
+
+    def __init__(self, node_id: str, recorder: Recorder, **kwargs):
+        self.recorder = recorder  # set first, the mining thread starts in the constructor
+        super().__init__(node_id, **kwargs)
+
+    def hash_block(self, transactions, index):
+        block = super().hash_block(transactions, index)
+        if block is not None:
+            self.recorder.block_mined(self.node_id, block)
+        return block
+
+    def receive_block(self, incoming_block):
+        self.recorder.block_received(self.node_id, incoming_block, incoming_block.prevHash not in self.blockchain.tree)
+        super().receive_block(incoming_block)
+
+
+class AsyncSimNode(SimNode, AsyncNode):
+    """
+    SimNode on the asyncio runtime.
+    """
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Simulation:
+    """
+    A cluster of SimNodes on a SimNetwork, with accounts node0 .. node<N-1>, and a seeded load source sending random
+    transfers between them to fanout random nodes each.
+
+    Methods
+    -------
+    run(duration: float, rate: float, partition: tuple, settle_timeout: float)
+        apply the load, wait for the nodes to agree on a tip and return the metrics
+    close()
+        stop the nodes and remove their files
+    """
+
+    def __init__(self, nodes: int = 4, latency: float = 0.01, jitter: float = 0.0, loss: float = 0.0,
+                 difficulty: int = 3, fanout: int = 1, seed: int = 0, initial_balance: float = 1000,
+                 relay_fanout: int = None, compact_blocks: bool = False, duplicate: float = 0.0,
+                 asyncio: bool = False):
+        """
+        Constructor for the Simulation. Starts the nodes.
+
+        :param nodes: int. Number of nodes.
+        :param latency: float. Seconds a message takes.
+        :param jitter: float. Most extra seconds a message takes at random.
+        :param loss: float. Probability that a message is dropped.
+        :param difficulty: int. Leading zeros required of a block hash.
+        :param fanout: int. Number of nodes each transaction is sent to.
+        :param seed: int. Seed of the network and of the load.
+        :param initial_balance: float. Balance of every account in the genesis block.
+        :param relay_fanout: int. Number of peers the nodes announce new items to, None to send them to every peer.
+        :param compact_blocks: bool. Send blocks as compact blocks.
+        :param duplicate: float. Probability that a message is delivered twice.
+        :param asyncio: bool. Run the nodes on the asyncio runtime (see AsyncNode).
+        """
+        self.node_ids = [str(i) for i in range(nodes)]
+        self.accounts = ['node' + node_id for node_id in self.node_ids]
+        self.fanout = fanout
+        self.rng = random.Random(seed)
+        self.network = SimNetwork(latency, jitter, loss, seed, duplicate)
+        self.recorder = Recorder()
+        self.data_dir = tempfile.mkdtemp()
+        balances = {account: initial_balance for account in self.accounts}
+        # every inbox exists before any node starts, so messages sent while starting up are not lost
+        transports = [self.network.transport(node_id) for node_id in self.node_ids]
+        node_class = AsyncSimNode if asyncio else SimNode
+        self.nodes = [node_class(node_id, self.recorder, transport=transport, peers=self.node_ids,
+                                 data_dir=self.data_dir, difficulty=difficulty, initial_balances=balances,
+                                 relay_fanout=relay_fanout, compact_blocks=compact_blocks)
+                      for node_id, transport in zip(self.node_ids, transports)]
+        self.submitted = 0
+
+    def send_transaction(self, fanout: int = None, relayed: bool = False):
+        """
+        Sends a random payment to fanout random nodes, the constructor's fanout by default.
+
+        :param fanout: int. Number of nodes the transaction is sent to.
+        :param relayed: bool. Send the transaction as if a peer relayed it, so that a node not running the gossip relay
+        keeps it to itself instead of sending it to every peer.
+        :return: None
+        """
+        sender, receiver = self.rng.sample(self.accounts, 2)
+        tx = Transaction(_to=receiver, _from=sender, amount=round(self.rng.uniform(0.01, 1), 2))
+        message = {'contents': tx.to_bytes(), 'type': 'Transaction'}
+        if relayed:
+            message['sender'] = 'load'
+        for node_id in self.rng.sample(self.node_ids, fanout or self.fanout):
+            self.network.send('load', node_id, message)
+        self.submitted += 1
+
+    def run(self, duration: float = 10.0, rate: float = 20.0, partition=None, settle_timeout: float = 30.0) -> dict:
+        """
+        Send rate transactions per second for duration seconds, then wait until every node has the same tip for a
+        second. While waiting, one transaction a second keeps being sent to a single node: nodes tied on equal height
+        branches only switch when a next block arrives, and without load none would be mined.
+
+        :param partition: tuple (start, end). Seconds into the run between which the nodes are split in two halves.
+        :param settle_timeout: float. Most seconds to wait for the nodes to agree.
+        :return: dict of metrics.
+        """
+        start = time.time()
+        next_send = start
+        partitioned = False
+        while time.time() - start < duration:
+            now = time.time() - start
+            if partition and not partitioned and partition[0] <= now < partition[1]:
+                half = len(self.node_ids) // 2
+                self.network.partition(self.node_ids[:half], self.node_ids[half:])
+                partitioned = True
+            elif partitioned and now >= partition[1]:
+                self.network.heal()
+                partitioned = False
+            if time.time() >= next_send:
+                self.send_transaction()
+                next_send += 1 / rate
+            time.sleep(max(0.0, min(next_send - time.time(), 0.01)))
+        self.network.heal()
+        load_end = time.time()
+        converged = self.wait_for_agreement(settle_timeout, 1.0)
+        return self.metrics(load_end - start, None if converged is None else converged - load_end)
+
+    def tips(self) -> set:
+        return set(node.blockchain.get_last_block().hash for node in self.nodes)
+
+    def wait_for_agreement(self, timeout: float, rate: float):
+        """
+        :param rate: float. Transactions per second sent while the nodes disagree.
+        :return: float. Time the nodes started agreeing on one tip for at least a second, None on timeout.
+        """
+        deadline = time.time() + timeout
+        agreed_since = None
+        next_send = time.time() + 1 / rate
+        while time.time() < deadline:
+            if agreed_since is None and time.time() >= next_send:
+                self.send_transaction(1, relayed=True)  # one miner, so the next block cannot tie again
+                next_send = time.time() + 1 / rate
+            if len(self.tips()) == 1:
+                agreed_since = agreed_since or time.time()
+                if time.time() - agreed_since >= 1:
+                    return agreed_since
+            else:
+                agreed_since = None
+            time.sleep(0.01)
+        return None
+
+    def metrics(self, load_seconds: float, convergence) -> dict:
+        reference = self.nodes[0].blockchain
+        chain_hashes = set(reference.store.hashes)
+        confirmed = sum(reference.blockchain[height].transaction_count for height in range(1, len(reference.blockchain)))
+        with self.recorder.lock:
+            mined = dict(self.recorder.mined)
+            received = list(self.recorder.received)
+            orphans = self.recorder.orphans
+        delays = [t - mined[_hash][1] for _hash, node_id, t in received if _hash in mined]
+        return {
+            'nodes': len(self.nodes),
+            'submitted': self.submitted,
+            'confirmed': confirmed,
+            'confirmed_tps': confirmed / load_seconds,
+            'height': len(reference.blockchain) - 1,
+            'blocks_mined': len(mined),
+            'fork_rate': (len(mined) - len(chain_hashes & set(mined))) / len(mined) if mined else 0.0,
+            'orphan_rate': orphans / len(received) if received else 0.0,
+            'propagation_p50': percentile(delays, 0.5),
+            'propagation_p90': percentile(delays, 0.9),
+            'propagation_p99': percentile(delays, 0.99),
+            'convergence_seconds': convergence,
+            'messages_sent': self.network.sent,
+            'messages_dropped': self.network.dropped,
+            'duplicates_dropped': sum(node.messenger.seen.hits for node in self.nodes if node.messenger.seen),
+            'bytes_sent': self.network.bytes_sent,
+            'bytes_per_block': self.network.bytes_sent / len(mined) if mined else None,
+            'max_node_bytes_sent': max(self.network.bytes_by_source[node_id] for node_id in self.node_ids),
+        }
+
+    def close(self):
+        for node in self.nodes:
+            node.stop()
+            node.messenger.off()
+        for node in self.nodes:
+            node.mine_thread.join()
+            node.blockchain.store.close()
+            node.blockchain.index.close()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate a cluster of nodes in one process.')
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load')
+    parser.add_argument('--rate', type=float, default=20.0, help='transactions per second')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per message')
+    parser.add_argument('--jitter', type=float, default=0.0, help='most extra seconds per message')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability a message is dropped')
+    parser.add_argument('--difficulty', type=int, default=3, help='leading zeros of a block hash')
+    parser.add_argument('--fanout', type=int, default=1, help='nodes each transaction is sent to')
+    parser.add_argument('--partition', type=str, default=None, help='START,END seconds the network is split in two')
+    parser.add_argument('--relay-fanout', type=int, default=None,
+                        help='peers new blocks and transactions are announced to, all peers get them in full by default')
+    parser.add_argument('--duplicate', type=float, default=0.0, help='probability a message is delivered twice')
+    parser.add_argument('--compact-blocks', action='store_true', help='send blocks as compact blocks')
+    parser.add_argument('--asyncio', action='store_true', help='run the nodes on the asyncio runtime')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # the nodes print every block they handle
+    try:
+        simulation = Simulation(args.nodes, args.latency, args.jitter, args.loss, args.difficulty, args.fanout,
+                                args.seed, relay_fanout=args.relay_fanout, compact_blocks=args.compact_blocks,
+                                duplicate=args.duplicate, asyncio=args.asyncio)
+        try:
+            results = simulation.run(args.duration, args.rate,
+                                     tuple(float(t) for t in args.partition.split(',')) if args.partition else None)
+        finally:
+            simulation.close()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    for key, value in results.items():
+        print('{:<20} {}'.format(key, '{:.4f}'.format(value) if isinstance(value, float) else value))
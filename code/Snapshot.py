@@ -0,0 +1,78 @@
+"""
+Snapshot files of a node's tip state, so a restarting node does not replay its whole history.
+
+A snapshot holds the height and hash of the chain tip it was taken at and the ledger state there: the current
+balances, the balance changes of the most recent blocks (enough to undo a reorganization) and how far the ledger
+journal reached. A node starts from its latest snapshot and replays only the journal records written after it; older
+blocks stay in the block store and older balance changes in the journal until something asks for them.
+
+The file is the SHA-256 of the pickled state followed by the pickled state. A snapshot whose hash does not match, for
+example one torn by a crash, is skipped for the one before it. Snapshots are written under a temporary name and
+renamed into place, and the last KEEP of each node are kept.
+"""
+import hashlib, os, pickle
+
+KEEP = 2
+PREFIX = 'snapshot'
+
+
+def snapshot_paths(data_dir: str, node_id: str) -> list:
+    """
+    :return: list of str. Paths of the node's snapshot files, newest first.
+    """
+    prefix = PREFIX + node_id + '.'
+    if not os.path.isdir(data_dir):
+        return []
+    heights = [int(name[len(prefix):]) for name in os.listdir(data_dir)
+               if name.startswith(prefix) and name[len(prefix):].isdigit()]
+    return [os.path.join(data_dir, prefix + str(height)) for height in sorted(heights, reverse=True)]
+
+
+def write_snapshot(data_dir: str, node_id: str, state: dict):
+    """
+    Write a snapshot of the node at state['height'] and drop all but the newest KEEP.
+
+    :param state: dict. Picklable, with at least the 'height'.
+    :return: str. Path of the snapshot.
+    """
+    payload = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+    path = os.path.join(data_dir, PREFIX + node_id + '.' + str(state['height']))
+    with open(path + '.tmp', 'wb') as snapshot_file:
+        snapshot_file.write(hashlib.sha256(payload).digest() + payload)
+    os.replace(path + '.tmp', path)
+    for old in snapshot_paths(data_dir, node_id)[KEEP:]:
+        os.remove(old)
+    return path
+
+
+def read_snapshot(path: str):
+    """
+    :return: dict, or None if the file is missing or fails its integrity hash.
+    """
+    try:
+        with open(path, 'rb') as snapshot_file:
+            data = snapshot_file.read()
+    except OSError:
+        return None
+    digest, payload = data[:32], data[32:]
+    if hashlib.sha256(payload).digest() != digest:
+        print('snapshot', path, 'is corrupted, skipping it')
+        return None
+    try:
+        return pickle.loads(payload)
+    except (pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError, IndexError):
+        return None
+
+
+def latest_snapshot(data_dir: str, node_id: str, usable=None):
+    """
+    The newest snapshot of a node that passes its integrity hash.
+
+    :param usable: function. Called with each intact snapshot, newest first, a snapshot it returns False for is skipped.
+    :return: dict, or None if there is none.
+    """
+    for path in snapshot_paths(data_dir, node_id):
+        state = read_snapshot(path)
+        if state is not None and (usable is None or usable(state)):
+            return state
+    return None
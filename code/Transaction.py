@@ -1,4 +1,28 @@
-import hashlib, json, datetime
+import hashlib, json, datetime, struct, sys
+from threading import Lock
+import Codec
+
+LEDGER_RECORD = struct.Struct('<iid?')  # sender id, receiver id, amount, whether the amount is an int
+account_ids = {}  # account name -> integer id, shared by every ledger of the process
+account_names = []  # integer id -> account name
+account_lock = Lock()
+
+
+def account_id(name: str) -> int:
+    """
+    Returns the integer id of an account, interning it on first use.
+
+    :param name: str.
+    :return: int.
+    """
+    _id = account_ids.get(name)
+    if _id is None:
+        with account_lock:  # transactions are built on several threads
+            _id = account_ids.get(name)
+            if _id is None:
+                _id = account_ids[name] = len(account_names)
+                account_names.append(name)
+    return _id
 
 
 class Transaction:
@@ -14,9 +38,13 @@ class Transaction:
     amount : str
         the amount of currency being transferred
     timestamp: str
-        timestamp of when the transaction was created
+        timestamp of when the transaction was created. Kept as integer microseconds, see Codec.pack_timestamp().
     unique_id: str
-        hash of the transaction contents. Unique to that transaction. Used to identify transactions in network.
+        hash of the transaction contents. Unique to that transaction. Used to identify transactions in network. Kept
+        as its raw 32 bytes, see Codec.pack_hash().
+    ledger_record: bytes
+        LEDGER_RECORD of the sender and receiver ids, see account_id(), and the amount. None if the amount is not a
+        number.
 
     Methods
     _______
@@ -24,9 +52,20 @@ class Transaction:
         return a JSON string representation of the transaction attributes but not the unique_id
     generateIDh()
         return a hash representation of the JSON form of the transaction attributes to use as a unique_id
+    to_bytes()
+        return the compact binary representation of the transaction
+    from_bytes(data: bytes)
+        build a transaction from its compact binary representation
+
+    A transaction does not change once built, so its JSON and binary representations are computed on first use and
+    cached. Its ledger_record, the ids of its accounts and its amount packed for VectorLedger, is built with it, so a
+    block's records are joined into one NumPy array without looking at the transactions one by one.
 
     """
-    def __init__(self, json_string = '', _to: str = '', _from: str = '', amount: float = 0.0):
+    __slots__ = ('to_node', 'from_node', 'amount', '_timestamp', '_id', '_json', '_bytes', 'ledger_record')
+
+    def __init__(self, json_string = '', _to: str = '', _from: str = '', amount: float = 0.0, timestamp: str = '',
+                 unique_id: str = ''):
         """
         Transaction constructor. Takes a JSON string or a set of variables to init instance variables
 
@@ -34,21 +73,51 @@ class Transaction:
         :param _to: str. Used if JSON string parameter not used.
         :param _from: str. Used if JSON string parameter not used.
         :param amount: str. Used if JSON string parameter not used.
+        :param timestamp: str. Used with unique_id to rebuild an existing transaction, otherwise the current time.
+        May also be given packed, as by Codec.pack_timestamp().
+        :param unique_id: str. Used with timestamp to rebuild an existing transaction, otherwise generated. May also be
+        given packed, as by Codec.pack_hash().
         """
+        self._json = None  # cached __str__() result
+        self._bytes = None  # cached to_bytes() result
         # if a json string parameter is given, use that to construct the object
         if json_string != '':
             json_obj = json.loads(json_string)
-            self.to_node = json_obj['to_node']
-            self.from_node = json_obj['from_node']
+            self.to_node = sys.intern(json_obj['to_node'])  # a few account names are shared by every transaction
+            self.from_node = sys.intern(json_obj['from_node'])
             self.amount = json_obj['amount']
-            self.timestamp = json_obj['timestamp']
-            self.unique_id = json_obj['unique_id']
+            self._timestamp = Codec.pack_timestamp(json_obj['timestamp'])
+            self._id = Codec.pack_hash(json_obj['unique_id'])
         else:  # else use given parameters to construct new tx
-            self.to_node = _to
-            self.from_node = _from
+            self.to_node = sys.intern(_to)
+            self.from_node = sys.intern(_from)
             self.amount = amount
-            self.timestamp = str(datetime.datetime.now())
-            self.unique_id = self.generateIDh()  # hash of to, from, amount, timestamp
+            self._timestamp = Codec.pack_timestamp(timestamp or str(datetime.datetime.now()))
+            self._id = Codec.pack_hash(unique_id or self.generateIDh())  # hash of to, from, amount, timestamp
+        try:
+            self.ledger_record = LEDGER_RECORD.pack(account_id(self.from_node), account_id(self.to_node), self.amount,
+                                                    type(self.amount) is int)
+        except struct.error:  # not a number, the ledgers reject the block
+            self.ledger_record = None
+
+    @property
+    def timestamp(self) -> str:
+        return Codec.unpack_timestamp(self._timestamp)
+
+    @property
+    def unique_id(self) -> str:
+        return Codec.unpack_hash(self._id)
+
+    def __getstate__(self):
+        return {'to_node': self.to_node, 'from_node': self.from_node, 'amount': self.amount,
+                'timestamp': self._timestamp, 'unique_id': self._id}
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled transaction, including ones pickled before transactions had slots.
+        """
+        self.__init__(_to=state['to_node'], _from=state['from_node'], amount=state['amount'],
+                      timestamp=state['timestamp'], unique_id=state['unique_id'])
 
     def txHeaderToJSON(self) -> str:
         """
@@ -73,12 +142,41 @@ class Transaction:
         hashMe = self.txHeaderToJSON()
         return hashlib.sha256(hashMe.encode()).hexdigest()
 
+    def to_bytes(self) -> bytes:
+        """
+        return the compact binary representation of the transaction
+
+        :return: bytes
+        """
+        if self._bytes is None:
+            self._bytes = Codec.encode_transaction(self.to_node, self.from_node, self.amount, self._timestamp, self._id)
+        return self._bytes
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        build a transaction from its compact binary representation
+
+        :param data: bytes.
+        :return: Transaction
+        """
+        fields, _ = Codec.decode_transaction(data)
+        return cls(**fields)
+
     def __str__(self) -> str:
         """
         override of the string representation. Return the JSON representation of the object attributes.
         :return: str.
         """
-        return json.dumps(self.__dict__)
+        if self._json is None:
+            self._json = json.dumps({
+                'to_node': self.to_node,
+                'from_node': self.from_node,
+                'amount': self.amount,
+                'timestamp': self.timestamp,
+                'unique_id': self.unique_id
+            })
+        return self._json
 
     def __eq__(self, _in) -> bool:
         """
@@ -1,7 +1,7 @@
-from datetime import datetime
 from time import sleep
 from Transaction import Transaction
-import boto3, random
+from Messenger import SQSBatchSender
+import random
 
 message_queue_URLs = {
     '0': 'https://sqs.us-east-1.amazonaws.com/000000000000/0.fifo',
@@ -12,10 +12,14 @@ message_queue_URLs = {
 
 
 class Tx_Generator:
-    def __init__(self):
+    def __init__(self, sqs=None, max_delay: float = 0.05):
         self.nodes = ['0', '1', '2', '3']
-        self.sqs = boto3.client('sqs')  # make a new SQS object
-        self.msg_count = 0
+        if sqs is None:
+            import boto3
+            sqs = boto3.client('sqs')  # make a new SQS object
+        self.sqs = sqs
+        # messages are coalesced per node and sent in batches
+        self.sender = SQSBatchSender(self.sqs, message_queue_URLs, 'tx Generator', max_delay)
 
     def make_tx(self) -> str:
         from_node = self.nodes[random.randrange(4)]
@@ -29,30 +33,8 @@ class Tx_Generator:
 
         return str(Transaction(_from=from_node, _to=to_node, amount=amount))
 
-    def format_for_SQS(self, message: dict) -> dict:
-        SQSmsg = {}
-        for key, value in message.items():
-            SQSmsg[key] = {
-                'DataType': 'String',
-                'StringValue': value
-            }
-        return SQSmsg
-
     def send(self, message: dict, destination: str):
-        # used to uniquely identify messages:
-        self.msg_count += 1
-        # included to ensure all messages have a different non-duplication hash:
-        timestamp = str(datetime.now())
-        message_body = 'Message # {} from tx Generator. {}'.format(self.msg_count, timestamp)
-        SQSmsg = self.format_for_SQS(message)
-
-        # response stores confirmation data from SQS
-        response = self.sqs.send_message(
-            QueueUrl=message_queue_URLs[destination],
-            MessageAttributes=SQSmsg,
-            MessageGroupId='queue',
-            MessageBody=message_body
-        )
+        self.sender.send(message, destination)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,219 @@
+from threading import Thread, Lock
+import Codec
+import json, os, queue, socket, struct
+
+FRAME_LENGTH = struct.Struct('>I')  # length prefix of every frame on a socket connection
+
+
+class Transport:
+    """
+    Interface between a Messenger and the medium messages travel over. A message is a dict of string keys and
+    str or bytes values; a transport only has to deliver it to the named destination and hand received messages back.
+
+    Methods
+    -------
+    send(message: dict, destination: str)
+        deliver a message to a destination node
+    receive(timeout: float)
+        return a list of received messages, waiting up to timeout seconds for the first one
+    close()
+        release connections and threads
+    """
+
+    def send(self, message: dict, destination: str):
+        raise NotImplementedError
+
+    def receive(self, timeout: float = 0.1) -> list:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def parse_address(address: str):
+    """
+    Turn a configured peer address into a socket family and address. 'tcp:host:port' is a TCP address and
+    'unix:path' the path of a Unix domain socket, so a path is never mistaken for a port.
+
+    :param address: str.
+    :return: tuple (family, address).
+    """
+    scheme, separator, rest = address.partition(':')
+    if scheme == 'tcp' and separator:
+        host, separator, port = rest.rpartition(':')
+        if separator and port.isdigit():
+            return socket.AF_INET, (host, int(port))
+    elif scheme == 'unix' and rest:
+        return socket.AF_UNIX, rest
+    raise ValueError("address {!r} is neither 'tcp:host:port' nor 'unix:path'".format(address))
+
+
+def read_frame(connection: socket.socket):
+    """
+    Read one length prefixed frame from a connection.
+
+    :param connection: socket.
+    :return: bytes, or None if the connection was closed.
+    """
+    header = read_exactly(connection, FRAME_LENGTH.size)
+    if header is None:
+        return None
+    length, = FRAME_LENGTH.unpack(header)
+    return read_exactly(connection, length)
+
+
+def read_exactly(connection: socket.socket, size: int):
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class SocketTransport(Transport):
+    """
+    Direct peer to peer transport over TCP or Unix domain sockets. Every node listens on its own address and keeps one
+    persistent connection open to each peer it sends to. Messages travel as length prefixed frames, encoded with
+    Codec.encode_message.
+
+    Attributes
+    ----------
+    id : str
+        name of this node
+    addresses : dict
+        node name -> address, 'tcp:host:port' for TCP or 'unix:path' for a Unix domain socket
+
+    Methods
+    -------
+    send(message: dict, destination: str)
+        send a frame over the persistent connection to destination, reconnecting once if it was lost
+    receive(timeout: float)
+        return messages read from incoming connections
+    from_file(id: str, path: str)
+        build a transport from a JSON file mapping node names to addresses
+    """
+
+    def __init__(self, id: str, addresses: dict):
+        """
+        Constructor for the SocketTransport. Starts listening on the address of this node.
+
+        :param id: str. Name of this node, must be a key of addresses.
+        :param addresses: dict. Node name -> address for every node in the network.
+        """
+        self.id = id
+        self.addresses = addresses
+        self.incoming = queue.Queue()
+        self.connections = {}  # destination -> connected socket
+        self.send_locks = {}  # destination -> lock, frames to one peer must not interleave
+        self.locks_lock = Lock()
+        self.running = True
+
+        family, address = parse_address(addresses[id])
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)  # left over from a previous run
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(64)
+        self.accept_thread = Thread(target=self.accept_connections, name='Accept Thread' + id, daemon=True)
+        self.accept_thread.start()
+
+    @classmethod
+    def from_file(cls, id: str, path: str):
+        """
+        Build a transport from a JSON file mapping node names to addresses, e.g. {"0": "tcp:10.0.0.1:5000", ...}
+
+        :param id: str. Name of this node.
+        :param path: str. Path of the JSON file.
+        :return: SocketTransport.
+        """
+        with open(path) as f:
+            return cls(id, json.load(f))
+
+    def accept_connections(self):
+        """this method accepts incoming connections and threads a reader for each"""
+        while self.running:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            Thread(target=self.read_connection, args=(connection,), daemon=True).start()
+
+    def read_connection(self, connection: socket.socket):
+        """reads frames off an incoming connection until it closes"""
+        with connection:
+            while self.running:
+                try:
+                    frame = read_frame(connection)
+                except OSError:
+                    return
+                if frame is None:
+                    return
+                self.incoming.put(Codec.decode_message(frame))
+
+    def connect(self, destination: str) -> socket.socket:
+        family, address = parse_address(self.addresses[destination])
+        connection = socket.socket(family, socket.SOCK_STREAM)
+        connection.connect(address)
+        if family == socket.AF_INET:
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections[destination] = connection
+        return connection
+
+    def send(self, message: dict, destination: str):
+        payload = Codec.encode_message(message)
+        frame = FRAME_LENGTH.pack(len(payload)) + payload
+        with self.locks_lock:
+            lock = self.send_locks.setdefault(destination, Lock())
+        with lock:
+            for attempt in range(2):
+                try:
+                    connection = self.connections.get(destination) or self.connect(destination)
+                    connection.sendall(frame)
+                    return
+                except OSError:
+                    # the peer went away, drop the connection and try once more with a fresh one
+                    stale = self.connections.pop(destination, None)
+                    if stale is not None:
+                        stale.close()
+            print('could not reach node', destination)
+
+    def receive(self, timeout: float = 0.1) -> list:
+        try:
+            messages = [self.incoming.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                messages.append(self.incoming.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def close(self):
+        self.running = False
+        self.server.close()
+        for connection in self.connections.values():
+            connection.close()
+        self.connections = {}
+
+
+if __name__ == '__main__':
+    import tempfile, time
+    directory = tempfile.mkdtemp()
+    addresses = {'0': 'tcp:127.0.0.1:0', '1': 'unix:' + os.path.join(directory, 'node1.sock')}
+    # port 0 lets the OS pick a free port, look it up before the other node connects
+    a = SocketTransport('0', addresses)
+    addresses['0'] = 'tcp:127.0.0.1:' + str(a.server.getsockname()[1])
+    b = SocketTransport('1', addresses)
+    for destination, receiver in [('0', a), ('1', b)]:
+        start = time.perf_counter()
+        for i in range(1000):
+            (b if destination == '0' else a).send({'type': 'Transaction', 'contents': str(i)}, destination)
+            while not receiver.receive(timeout=1):
+                pass
+        print('round trips to node', destination, addresses[destination], ':',
+              round((time.perf_counter() - start) * 1000, 3), 'microseconds per message')
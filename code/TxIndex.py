@@ -0,0 +1,200 @@
+from Block import Block
+import Codec
+from threading import Lock
+import sqlite3, time
+
+POSITION_BITS = 20  # a transaction is referred to by height << POSITION_BITS | position in its block
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blocks (height INTEGER PRIMARY KEY, hash BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS transactions (unique_id BLOB PRIMARY KEY, ref INTEGER NOT NULL) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS transactions_ref ON transactions (ref);
+CREATE TABLE IF NOT EXISTS account_transactions (account TEXT, ref INTEGER, unique_id BLOB NOT NULL,
+    counterparty TEXT NOT NULL, amount NOT NULL, PRIMARY KEY (account, ref)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS account_transactions_ref ON account_transactions (ref);
+CREATE TABLE IF NOT EXISTS balances (account TEXT, height INTEGER, balance NOT NULL,
+    PRIMARY KEY (account, height)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS balances_height ON balances (height);
+'''
+
+
+def make_ref(height: int, position: int) -> int:
+    return height << POSITION_BITS | position
+
+
+def split_ref(ref: int):
+    """
+    :return: tuple (height, position).
+    """
+    return ref >> POSITION_BITS, ref & ((1 << POSITION_BITS) - 1)
+
+
+class TxIndex:
+    """
+    Persistent secondary indexes over the node's chain, in an SQLite database next to the block store: the block in
+    which each transaction id is (height and position), the transactions of each account, and the balance of each
+    account after every block that changed it. Every lookup is a B-tree search, O(log n) in the number of blocks, and a
+    page of account history costs O(log n + page size).
+
+    The chain adds a block to the index when it applies it and truncates the index when a reorganization drops blocks,
+    so the index always describes the node's current chain. Changes are committed at most every commit_interval
+    seconds; blocks a crash kept out of the index are indexed again from the chain at startup.
+
+    Attributes
+    ----------
+    path : str
+        path of the database file
+    db : sqlite3.Connection
+        shared by the chain and the query threads, used under lock
+
+    Methods
+    -------
+    tip()
+        height of the last indexed block
+    add_block(block: Block, changes: dict)
+        index a block and the balances it changed
+    truncate(height: int)
+        drop every block at or above height
+    find_transaction(unique_id: str)
+        height and position of a transaction
+    balance_at(account: str, height: int)
+        balance of an account after the block at height
+    account_history(account: str, limit: int, before: int)
+        a page of an account's transactions, newest first
+    """
+
+    def __init__(self, path: str, commit_interval: float = 1.0):
+        """
+        Constructor for the TxIndex. Opens (or creates) the database.
+
+        :param path: str. Path of the database file.
+        :param commit_interval: float. Seconds between two commits to disk.
+        """
+        self.path = path
+        self.commit_interval = commit_interval
+        self.last_commit = time.time()
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def tip(self) -> int:
+        """
+        :return: int. Height of the last indexed block, -1 if the index is empty.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT MAX(height) FROM blocks').fetchone()
+        return -1 if row[0] is None else row[0]
+
+    def block_hash(self, height: int):
+        """
+        :return: str. Hash of the indexed block at height, or None.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT hash FROM blocks WHERE height = ?', (height,)).fetchone()
+        return None if row is None else Codec.unpack_hash(row[0])
+
+    def add_block(self, block: Block, changes: dict):
+        """
+        Index a block at the next height.
+
+        :param block: Block.
+        :param changes: dict. {account: (old balance, new balance)} of the accounts the block changed, as recorded by
+        the ledger.
+        :return: None
+        """
+        height = block.index
+        transactions = []
+        entries = {}
+        for position, tx in enumerate(block.transactions):
+            ref = make_ref(height, position)
+            unique_id = Codec.pack_hash(tx.unique_id)
+            transactions.append((unique_id, ref))
+            # a transfer to oneself is a single entry with no change
+            entries[tx.from_node, ref] = (unique_id, tx.to_node, -tx.amount if tx.to_node != tx.from_node else 0)
+            if tx.to_node != tx.from_node:
+                entries[tx.to_node, ref] = (unique_id, tx.from_node, tx.amount)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO blocks VALUES (?, ?)', (height, Codec.pack_hash(block.hash)))
+            self.db.executemany('INSERT OR IGNORE INTO transactions VALUES (?, ?)', transactions)
+            self.db.executemany('INSERT OR REPLACE INTO account_transactions VALUES (?, ?, ?, ?, ?)',
+                                [key + value for key, value in entries.items()])
+            self.db.executemany('INSERT OR REPLACE INTO balances VALUES (?, ?, ?)',
+                                [(account, height, new) for account, (old, new) in changes.items()])
+            self.commit_when_due()
+
+    def commit_when_due(self):
+        """
+        Commit if the last commit is commit_interval seconds old. Called under lock.
+
+        :return: None
+        """
+        now = time.time()
+        if now - self.last_commit >= self.commit_interval:
+            self.db.commit()
+            self.last_commit = now
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+            self.last_commit = time.time()
+
+    def truncate(self, height: int):
+        """
+        Drop every block at or above height, as a reorganization does.
+
+        :param height: int. First height to drop.
+        :return: None
+        """
+        ref = make_ref(height, 0)
+        with self.lock:
+            self.db.execute('DELETE FROM blocks WHERE height >= ?', (height,))
+            self.db.execute('DELETE FROM transactions WHERE ref >= ?', (ref,))
+            self.db.execute('DELETE FROM account_transactions WHERE ref >= ?', (ref,))
+            self.db.execute('DELETE FROM balances WHERE height >= ?', (height,))
+            self.commit_when_due()
+
+    def find_transaction(self, unique_id: str):
+        """
+        :param unique_id: str. Hex transaction id.
+        :return: tuple (height, position) of the block holding the transaction, or None.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT ref FROM transactions WHERE unique_id = ?',
+                                  (Codec.pack_hash(unique_id),)).fetchone()
+        return None if row is None else split_ref(row[0])
+
+    def balance_at(self, account: str, height: int):
+        """
+        :return: int or float. Balance of the account after the block at height, None if it did not exist yet.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT balance FROM balances WHERE account = ? AND height <= ? '
+                                  'ORDER BY height DESC LIMIT 1', (account, height)).fetchone()
+        return None if row is None else row[0]
+
+    def account_history(self, account: str, limit: int = 50, before: int = None):
+        """
+        A page of the transactions of an account, newest first.
+
+        :param limit: int. Most transactions in the page.
+        :param before: int. Cursor returned with the previous page, None for the first page.
+        :return: tuple (list of dicts with the height, position, unique_id, counterparty and amount of each transaction,
+        negative when the account sent it; cursor of the next page, None after the last).
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT ref, unique_id, counterparty, amount FROM account_transactions '
+                                   'WHERE account = ? AND ref < ? ORDER BY ref DESC LIMIT ?',
+                                   (account, (1 << 62) if before is None else before, limit)).fetchall()
+        page = []
+        for ref, unique_id, counterparty, amount in rows:
+            height, position = split_ref(ref)
+            page.append({'height': height, 'position': position, 'unique_id': Codec.unpack_hash(unique_id),
+                         'counterparty': counterparty, 'amount': amount})
+        return page, (rows[-1][0] if len(rows) == limit else None)
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
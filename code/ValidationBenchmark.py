@@ -0,0 +1,80 @@
+from Block import Block, MERKLE_VERSION
+from BlockChain import BlockChain
+from Ledger import Ledger
+from Transaction import Transaction
+from ValidationPipeline import ValidationPipeline, decode_block
+import datetime, hashlib, multiprocessing, os, shutil, sys, tempfile, time
+
+
+def make_burst(blocks: int, tx_per_block: int) -> list:
+    """
+    Encoded blocks extending a fresh chain, as a node catching up would receive them. There is no difficulty to meet
+    in the benchmark.
+
+    :return: list of bytes.
+    """
+    data_dir = tempfile.mkdtemp()
+    try:
+        prev_hash = BlockChain('bench', Ledger('bench', data_dir), data_dir).get_last_block().hash
+    finally:
+        shutil.rmtree(data_dir)
+    burst = []
+    for index in range(1, blocks + 1):
+        transactions = [Transaction(_to='node' + str((index + i) % 4), _from='node' + str((index + i + 1) % 4),
+                                    amount=0.0001) for i in range(tx_per_block)]
+        block = Block(index=index, prevHash=prev_hash, timestamp=str(datetime.datetime.now()),
+                      transactions=transactions, version=MERKLE_VERSION)
+        block.hash = hashlib.sha256(block.hash_contents()).hexdigest()
+        burst.append(block.to_bytes())
+        prev_hash = block.hash
+    return burst
+
+
+def time_catch_up(burst: list, workers) -> float:
+    """
+    Time a fresh chain taking in the whole burst. workers None checks and applies every block in turn on one thread,
+    otherwise the blocks go through a ValidationPipeline with that many worker processes.
+
+    :return: float. Seconds until the last block is on the chain.
+    """
+    data_dir = tempfile.mkdtemp()
+    try:
+        blockchain = BlockChain('bench', Ledger('bench', data_dir), data_dir)
+        start = time.perf_counter()
+        if workers is None:
+            for contents in burst:
+                block = decode_block(contents)
+                if not (block.verify_proof_of_work() and block.verify_merkle_root()):
+                    raise AssertionError('block failed validation')
+                blockchain.verify_block(block)
+        else:
+            pipeline = ValidationPipeline(blockchain.verify_block, workers)
+            for contents in burst:
+                pipeline.submit(contents)
+            pipeline.close()
+        elapsed = time.perf_counter() - start
+        if len(blockchain.blockchain) != len(burst) + 1:
+            raise AssertionError('only {} of {} blocks applied'.format(len(blockchain.blockchain) - 1, len(burst)))
+        return elapsed
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    tx_per_block = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    cores = multiprocessing.cpu_count()
+    worker_counts = [None, 0] + sorted(set(n for n in (1, 2, 4, 8, 16) if n <= cores) | {cores})
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # the chain classes print every block they handle
+    try:
+        burst = make_burst(blocks, tx_per_block)
+        results = [(workers, time_catch_up(burst, workers)) for workers in worker_counts]
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print('catching up on {} blocks of {} transactions, {} cores'.format(blocks, tx_per_block, cores))
+    print('validation           | seconds | blocks per second')
+    for workers, seconds in results:
+        label = 'serial' if workers is None else 'pipeline, {} workers'.format(workers)
+        print('{:<20} | {:>7.2f} | {:>8.0f}'.format(label, seconds, blocks / seconds))
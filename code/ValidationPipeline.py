@@ -0,0 +1,166 @@
+from Block import Block, MERKLE_VERSION
+from threading import Thread
+import multiprocessing, queue, struct
+
+_STOP = object()  # sentinel passed down the stages by close()
+
+
+def decode_block(contents, transactions: list = None) -> Block:
+    """
+    Builds a Block from received contents, binary (bytes) or JSON (str).
+
+    :param transactions: list. Its transactions as check_block() decoded them, None to decode them from contents.
+    :return: Block.
+    """
+    block = Block.from_bytes(contents) if isinstance(contents, bytes) else Block(contents)
+    if transactions is not None:
+        block.adopt_transactions(transactions)
+    return block
+
+
+def check_block(contents):
+    """
+    The stateless checks of a received block, which need nothing from the node: decode, proof of work recompute,
+    structure (no transaction twice) and transaction id recompute, including the Merkle root of MERKLE_VERSION
+    blocks. Runs in a worker process, so it takes and returns only plain values and Transactions.
+
+    :param contents: bytes or str. Block in its binary or JSON representation.
+    :return: tuple (bool, str or list). True and the decoded transactions if the block passed, for decode_block() to
+    reuse instead of decoding them again, otherwise False and the reason.
+    """
+    try:
+        block = decode_block(contents)
+        if not block.verify_proof_of_work():
+            return False, 'proof of work check not passed'
+        transactions = block.transactions
+        if len(set(tx.unique_id for tx in transactions)) != len(transactions):
+            return False, 'transaction included twice'
+        if block.version >= MERKLE_VERSION:
+            if not block.verify_merkle_root():
+                return False, 'transactions do not match the Merkle root'
+        elif not block.verify_transaction_ids():
+            return False, 'transaction id does not match its transaction'
+    except (ValueError, KeyError, IndexError, TypeError, struct.error) as e:
+        return False, 'malformed block: ' + repr(e)
+    return True, transactions
+
+
+class _Done:
+    """
+    Result of a check run in the calling thread, with the get() of a pool result.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class ValidationPipeline:
+    """
+    Validates received blocks in stages ahead of the node's sequential ledger and chain stage. A dispatcher thread takes
+    the raw contents of received blocks and hands them to a pool of worker processes, which run check_block(); a
+    collector thread takes the results in arrival order, builds the blocks that passed from their header and the
+    transactions the worker decoded (marked verified, so the chain stage does not repeat the checks) and passes them to
+    deliver. Both hand-offs are bounded queues, so a burst of
+    blocks blocks the sender instead of piling up in memory, while up to queue_size blocks are checked in parallel.
+
+    Attributes
+    ----------
+    deliver : function
+        called with every block that passed, in arrival order, from the collector thread
+    workers : int
+        number of worker processes, 0 runs the checks in the dispatcher thread
+    incoming : queue.Queue
+        raw block contents waiting for a worker
+    pending : queue.Queue
+        (contents, result) of every block handed to a worker, in arrival order
+    rejected : int
+        number of blocks that failed the checks
+
+    Methods
+    -------
+    submit(contents)
+        queue a received block for validation, blocks while the pipeline is full
+    close()
+        stop the stage threads and the worker processes
+    """
+
+    def __init__(self, deliver, workers: int = 0, queue_size: int = 64):
+        """
+        Constructor for the ValidationPipeline. Starts the stage threads and the worker processes.
+
+        :param deliver: function. Called with every Block that passed the checks.
+        :param workers: int. Number of worker processes, 0 runs the checks in the dispatcher thread.
+        :param queue_size: int. Most blocks waiting in each stage.
+        """
+        self.deliver = deliver
+        self.workers = workers
+        self.pool = multiprocessing.Pool(workers) if workers > 0 else None
+        self.incoming = queue.Queue(queue_size)
+        self.pending = queue.Queue(queue_size)
+        self.rejected = 0
+        self.threads = [Thread(target=self.dispatch, name='Validation Dispatcher', daemon=True),
+                        Thread(target=self.collect, name='Validation Collector', daemon=True)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, contents):
+        """
+        Queue a received block for validation, blocks while the pipeline is full.
+
+        :param contents: bytes or str. Block in its binary or JSON representation.
+        :return: None
+        """
+        self.incoming.put(contents)
+
+    def dispatch(self):
+        """
+        Dispatcher stage: hands every received block to a worker, or checks it here without workers.
+
+        :return: None
+        """
+        while True:
+            contents = self.incoming.get()
+            if contents is _STOP:
+                self.pending.put(_STOP)
+                return
+            if self.pool is not None:
+                result = self.pool.apply_async(check_block, (contents,))
+            else:
+                result = _Done(check_block(contents))
+            self.pending.put((contents, result))
+
+    def collect(self):
+        """
+        Collector stage: waits for the checks of every block in arrival order and delivers the blocks that passed.
+
+        :return: None
+        """
+        while True:
+            item = self.pending.get()
+            if item is _STOP:
+                return
+            contents, result = item
+            passed, outcome = result.get()
+            if not passed:
+                self.rejected += 1
+                print('Incoming block rejected:', outcome)
+                continue
+            block = decode_block(contents, outcome)
+            block.mark_verified()
+            self.deliver(block)
+
+    def close(self):
+        """
+        Stop the stage threads once the blocks already submitted went through, and stop the worker processes.
+
+        :return: None
+        """
+        self.incoming.put(_STOP)
+        for t in self.threads:
+            t.join()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
@@ -0,0 +1,293 @@
+from Ledger import Ledger
+from Transaction import Transaction, account_names, account_id as intern_account
+import operator
+
+try:
+    import numpy as np
+    RECORD = np.dtype([('sender', '<i4'), ('receiver', '<i4'), ('amount', '<f8'), ('int', '?')])  # LEDGER_RECORD
+except ImportError:  # numpy is only needed for this ledger mode
+    np = None
+
+LEDGER_RECORD = operator.attrgetter('ledger_record')
+NOT_TOUCHED = 2 ** 62  # scratch value of an account the block being applied has not touched
+MIN_VECTOR_TRANSACTIONS = 256  # smaller blocks are applied by the Ledger's loop, which is faster for them
+
+
+class VectorLedger(Ledger):
+    """
+    Ledger that applies whole blocks with NumPy. Account names are interned to integer ids (see Transaction.account_id())
+    and the current balances are mirrored in an array indexed by id, next to the balances dict the Ledger keeps. Every
+    transaction carries its account ids and amount packed in its ledger_record, so the records of a block are joined
+    into one array without a Python step per transaction. Its debits and credits are interleaved in transaction order
+    and the accounts it touches numbered in the order the block first touches them, so all the work after that is over
+    the touched accounts only, O(transactions) and not O(accounts). Their balances are gathered from the array and the
+    debits and credits scatter-added with np.add.at, which adds them one by one in that order, so every balance comes
+    out bit for bit as the Ledger's own loop computes it. Overdrafts are found with a single comparison over the
+    touched accounts. Blocks of fewer than MIN_VECTOR_TRANSACTIONS transactions, where the fixed cost of the NumPy
+    calls outweighs the loop, go through the Ledger's loop.
+
+    It accepts and rejects exactly the blocks the Ledger does, returns the same bad transactions in the same order,
+    and like the Ledger keeps an int balance int while only int amounts are applied to it. Requires numpy.
+
+    Attributes
+    ----------
+    balance_array : numpy array.
+        current balance by account id
+    present : numpy array.
+        whether each account id is in the current balances
+    integral : numpy array.
+        whether the current balance of each account id is an int
+    scratch : numpy array.
+        NOT_TOUCHED for every account id, used by apply_block()
+
+    Methods
+    ----------
+    account_id(name: str)
+        Returns the integer id of an account, making room for it in the arrays.
+    """
+
+    def __init__(self, node_id, data_dir: str = '../files', initial_balances: dict = None):
+        """
+        Constructor for the VectorLedger.
+
+        :param node_id: str. Name of the node the ledger belongs to, used in its file names.
+        :param data_dir: str. Directory the ledger files are kept in.
+        :param initial_balances: dict. Balances of the genesis block if no ledger is on disk yet.
+        """
+        if np is None:
+            raise ImportError('the vectorized ledger requires numpy')
+        self.balance_array = np.zeros(16)
+        self.present = np.zeros(16, dtype=bool)
+        self.integral = np.zeros(16, dtype=bool)
+        self.scratch = np.full(16, NOT_TOUCHED, dtype=np.intp)
+        super().__init__(node_id, data_dir, initial_balances)
+
+    def account_id(self, name: str) -> int:
+        """
+        Returns the integer id of an account, making room for it in the arrays.
+
+        :param name: str.
+        :return: int.
+        """
+        _id = intern_account(name)
+        self.reserve()
+        return _id
+
+    def reserve(self):
+        """
+        Grows the arrays to hold every interned account, doubling their capacity.
+
+        :return: None
+        """
+        size = len(self.balance_array)
+        if size >= len(account_names):
+            return
+        while size < len(account_names):
+            size *= 2
+        extra = size - len(self.balance_array)
+        self.balance_array = np.concatenate((self.balance_array, np.zeros(extra)))
+        self.present = np.concatenate((self.present, np.zeros(extra, dtype=bool)))
+        self.integral = np.concatenate((self.integral, np.zeros(extra, dtype=bool)))
+        self.scratch = np.concatenate((self.scratch, np.full(extra, NOT_TOUCHED, dtype=np.intp)))
+
+    def verify_transaction(self, transactions, index):
+        """
+        Takes transaction objects and applies them to the ledger at index. If any balance is negative return false.
+
+        :param transactions: list. List of Transaction objects to verify
+        :param index: int. index at which the transactions are applied (equal to block index)
+        :return: bool, list. Return True, [changed balances dict] if all valid, otherwise return false,
+        [bad transactions] if transactions cause any balance to go negative or name an unknown account.
+        """
+        records = self.records(transactions)
+        if records is None:
+            return super().verify_transaction(transactions, index)
+        try:
+            touched, balances, integral, senders = self.apply_block(records, index)
+        except KeyError as e:
+            print('unknown account', e)
+            return False, [tx.unique_id for tx in transactions if e.args[0] in (tx.from_node, tx.to_node)]
+        negative = balances < 0
+        if not negative.any():
+            return True, [self.balance_dict(touched, balances, integral)]
+        # rank every overdrawn account by when the block first touches it, the order the Ledger reports them in
+        rank = np.full(len(touched), -1)
+        overdrawn = np.nonzero(negative)[0]
+        rank[overdrawn] = np.arange(len(overdrawn))
+        sender_rank = rank[senders]
+        bad = np.nonzero(sender_rank >= 0)[0]
+        bad = bad[np.argsort(sender_rank[bad], kind='stable')]
+        for _ in range(len(overdrawn)):
+            print('found negative balance')
+        all_bad_tx = [transactions[i].unique_id for i in bad.tolist()]
+        print('bad transactions found: ', all_bad_tx)
+        return False, all_bad_tx
+
+    def apply_transactions(self, transactions, index) -> dict:
+        """
+        Apply transactions on top of the state after block index - 1, touching only the accounts involved.
+
+        :param transactions: list. List of Transaction objects.
+        :param index: int. index at which the transactions are applied
+        :return: dict. New balance of every account the transactions touch.
+        """
+        records = self.records(transactions)
+        if records is None:
+            return super().apply_transactions(transactions, index)
+        touched, balances, integral, _ = self.apply_block(records, index)
+        return self.balance_dict(touched, balances, integral)
+
+    def records(self, transactions):
+        """
+        :param transactions: list. List of Transaction objects.
+        :return: numpy array of RECORD, the ledger records of the transactions, None for a block the Ledger's loop
+        applies: one under MIN_VECTOR_TRANSACTIONS or with an amount that is not a number.
+        """
+        if len(transactions) < MIN_VECTOR_TRANSACTIONS:
+            return None
+        try:
+            records = np.frombuffer(b''.join(map(LEDGER_RECORD, transactions)), RECORD)
+        except TypeError:  # a record is None
+            return None
+        self.reserve()  # the transactions may name accounts interned since
+        return records
+
+    def balance_dict(self, touched, balances, integral) -> dict:
+        """
+        :return: dict. account name -> new balance, an int where integral is set.
+        """
+        names = map(account_names.__getitem__, touched.tolist())
+        if not integral.any():
+            return dict(zip(names, balances.tolist()))
+        if integral.all():
+            return dict(zip(names, balances.astype(np.int64).tolist()))
+        return {name: int(value) if is_int else value
+                for name, value, is_int in zip(names, balances.tolist(), integral.tolist())}
+
+    def apply_block(self, records, index):
+        """
+        Vectorized apply_transactions(), over the accounts the block touches only.
+
+        :param records: numpy array of RECORD. Ledger records of the transactions, see records().
+        :param index: int. index at which the transactions are applied
+        :return: tuple (array of the touched account ids in the order the block first touches them, array of their new
+        balances, array of whether each new balance is an int, array of the position in touched of the sender of every
+        transaction).
+        """
+        count = len(records)
+        amounts = records['amount']
+        # debit then credit of every transaction, in block order
+        flat_ids = np.empty(2 * count, dtype=np.intp)
+        flat_ids[0::2] = records['sender']
+        flat_ids[1::2] = records['receiver']
+        deltas = np.empty(2 * count)
+        deltas[0::2] = -amounts
+        deltas[1::2] = amounts
+
+        # number the touched accounts 0 .. n - 1 in the order the block first touches them, with a scratch array
+        # indexed by account id that is reset afterwards, so no step costs more than O(transactions)
+        positions = np.arange(2 * count)
+        np.minimum.at(self.scratch, flat_ids, positions)
+        touched = flat_ids[self.scratch[flat_ids] == positions]
+        self.scratch[touched] = np.arange(len(touched))
+        local = self.scratch[flat_ids]
+        self.scratch[touched] = NOT_TOUCHED
+
+        # the previous state is normally the current one, which is mirrored in the balance array
+        if index - 1 == len(self.block_changes) - 1:
+            missing = ~self.present[touched]
+            if missing.any():
+                raise KeyError(account_names[int(touched[missing][0])])
+            balances = self.balance_array[touched]
+            integral = self.integral[touched]
+        else:
+            state = self.state_at(index - 1)
+            previous = [state[account_names[_id]] for _id in touched.tolist()]
+            balances = np.array(previous, dtype=np.float64)
+            integral = np.fromiter((type(value) is int for value in previous), bool, len(previous))
+        np.add.at(balances, local, deltas)
+        # a balance stays an int while every amount applied to it is one, as in the Ledger's loop
+        float_amounts = ~records['int']
+        if not float_amounts.any():
+            pass
+        elif float_amounts.all():
+            integral[:] = False
+        else:
+            integral &= np.bincount(local, np.repeat(float_amounts, 2), len(touched)) == 0
+        return touched, balances, integral, local[0::2]
+
+    def apply_balance_state(self, balance, index):
+        """
+        Applies new balances as the state after the block at index, which must be the next index.
+
+        :param balance: dict. Dictionary of peer keys and their new balance values.
+        :param index: int.
+        :return: None
+        """
+        super().apply_balance_state(balance, index)
+        for node, value in balance.items():
+            self.mirror(node, value)
+
+    def mirror(self, node: str, value):
+        """
+        Sets the balance of an account in the arrays.
+
+        :param node: str. Account name.
+        :param value: int or float. Its balance, None if it has none.
+        :return: None
+        """
+        _id = self.account_id(node)
+        self.present[_id] = value is not None
+        self.integral[_id] = type(value) is int
+        self.balance_array[_id] = value if value is not None else 0
+
+    def restore_snapshot(self, state: dict):
+        """
+        Sets the ledger to the state returned by snapshot_state().
+
+        :param state: dict.
+        :return: None
+        """
+        super().restore_snapshot(state)
+        for node, value in self.balances.items():
+            self.mirror(node, value)
+
+    def load_history(self):
+        """
+        Rebuilds the changes of every block by replaying the whole journal, for a ledger started from a snapshot.
+
+        :return: None
+        """
+        self.present[:] = False
+        super().load_history()
+
+    def undo_to(self, index):
+        """
+        Undo the block changes after index in memory.
+
+        :param index: int. Last block to keep.
+        :return: None
+        """
+        self.ensure_history(index)
+        undone = set()
+        for changes in self.block_changes[index + 1:]:
+            undone.update(changes)
+        super().undo_to(index)
+        for node in undone:
+            self.mirror(node, self.balances.get(node))
+
+
+if __name__ == '__main__':
+    import shutil, tempfile
+    data_dir = tempfile.mkdtemp()
+    transactions = [Transaction(_to='node1', _from='node3', amount=1.1),
+                    Transaction(_to='node3', _from='node1', amount=0.5)]
+    L = VectorLedger('0', data_dir)
+    print(L.blockchain_balances[-1])
+    verify_boolean, change = L.verify_transaction(transactions, 1)
+    print(verify_boolean, change)
+    if verify_boolean:
+        L.add_balance_state(change[0], 1)
+    print(L.verify_transaction([Transaction(_to='node1', _from='node2', amount=11)], 2))
+    print(list(L.blockchain_balances))
+    shutil.rmtree(data_dir)